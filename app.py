@@ -1,114 +1,2895 @@
 import os
-import random
+import base64
+import bisect
 import string
 import json
+import math
+import mimetypes
+import mmap
 import logging
 import secrets
-import shutil
-import io # For in-memory zip file
+import gzip
+import hashlib
+import codecs
+import sqlite3
+import struct
+import tempfile
+import zlib
+import time
+import collections
+import concurrent.futures
+import contextlib
+import queue
+import threading
 import zipfile # For creating zip archives
 import re # For page ID validation
+import selectors
+import socket
 from datetime import datetime # For backup naming
-from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, send_file
-# send_file will be used for download
+from functools import partial, wraps
+import click
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, session, flash, g, has_request_context, stream_with_context
+from werkzeug.exceptions import HTTPException
+
+try:
+    import brotli # Optional: enables brotli response compression
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl # Not available on Windows
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__)
 DATA_DIR = "data"
 BACKUP_DIR = "backup" # New directory for backups
-PAGE_STATUS_FILE = os.path.join(DATA_DIR, "page_status.json")
+PAGE_CATALOG_FILE = os.path.join(DATA_DIR, "page_catalog.db")
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "file") # "file" (default) or "sqlite"
+SQLITE_DATABASE = os.environ.get("SQLITE_DATABASE", os.path.join(DATA_DIR, "cryptpad.db"))
+ADMIN_PAGES_PER_PAGE = int(os.environ.get("ADMIN_PAGES_PER_PAGE", "50"))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Admin password setup
-ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
-if ADMIN_PASSWORD is None:
-    ADMIN_PASSWORD = secrets.token_hex(16)
-    logging.warning(f"ADMIN_PASSWORD not set. Using a random password: {ADMIN_PASSWORD}")
-
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(32)) # For session management
-
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 if not os.path.exists(BACKUP_DIR): # Create backup directory
     os.makedirs(BACKUP_DIR)
 
-# Helper functions for page status management
-def load_page_statuses():
-    """Loads page statuses from the JSON file."""
-    if not os.path.exists(PAGE_STATUS_FILE):
-        return {}
+GENERATED_SECRETS_FILE = os.path.join(DATA_DIR, ".secrets.json")
+
+def load_generated_secrets():
+    """Returns the random admin password and secret key of this instance.
+
+    They are generated once and stored in data/.secrets.json, so that all
+    worker processes of a server, and restarts, use the same values.
+    """
     try:
-        with open(PAGE_STATUS_FILE, "r", encoding="utf-8") as f:
+        with open(GENERATED_SECRETS_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"Error loading page status file: {e}")
-        return {}
+    except FileNotFoundError:
+        pass
+    generated = {"admin_password": secrets.token_hex(16), "secret_key": secrets.token_hex(32)}
+    fd, temp_path = tempfile.mkstemp(dir=DATA_DIR, prefix=".secrets.") # Readable by the owner only
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(generated, f)
+        # Publishes the complete file, unless another worker has already stored its secrets
+        os.link(temp_path, GENERATED_SECRETS_FILE)
+    except FileExistsError:
+        with open(GENERATED_SECRETS_FILE, "r", encoding="utf-8") as f:
+            generated = json.load(f)
+    finally:
+        os.remove(temp_path)
+    return generated
+
+# Admin password setup
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
+FLASK_SECRET_KEY = os.environ.get("FLASK_SECRET_KEY")
+if ADMIN_PASSWORD is None or FLASK_SECRET_KEY is None:
+    generated_secrets = load_generated_secrets()
+    if ADMIN_PASSWORD is None:
+        ADMIN_PASSWORD = generated_secrets["admin_password"]
+        logging.warning(f"ADMIN_PASSWORD not set. Using the generated password from {GENERATED_SECRETS_FILE}: {ADMIN_PASSWORD}")
+    if FLASK_SECRET_KEY is None:
+        FLASK_SECRET_KEY = generated_secrets["secret_key"]
+
+app.secret_key = FLASK_SECRET_KEY # For session management
+
+# Size limits
+MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 32 * 1024 * 1024)) # Largest request body, as sent
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 16 * 1024 * 1024)) # Largest page content, after decompression
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+
+# Metrics
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "").lower() in ("1", "true", "yes")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def format_metric_labels(labels):
+    """Formats label pairs as {name="value",...} for the Prometheus text format."""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format.
+
+    Values are kept per process; every worker of a multi-process server
+    reports its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {} # name -> (type, help text, histogram buckets)
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, help_text):
+        self._families[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._families[name] = ("histogram", help_text, buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self, gauges=()):
+        """Returns all metrics as Prometheus text.
+
+        ``gauges`` are (name, help text, value) tuples computed by the caller.
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (sample_name, labels), value in sorted(self._counters.items()):
+                        if sample_name == name:
+                            lines.append(f"{name}{format_metric_labels(labels)} {value}")
+                    continue
+                for (sample_name, labels), histogram in sorted(self._histograms.items()):
+                    if sample_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{name}_sum{format_metric_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{name}_count{format_metric_labels(labels)} {histogram['count']}")
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.histogram("cryptpad_http_request_duration_seconds", "Time spent handling requests, by endpoint.")
+metrics.counter("cryptpad_http_requests_total", "Requests handled, by endpoint and status code.")
+metrics.counter("cryptpad_storage_bytes_total", "Page and backup bytes read from or written to storage, by endpoint.")
+metrics.histogram("cryptpad_status_file_load_seconds", "Time spent loading page_status.json.")
+metrics.histogram("cryptpad_backup_duration_seconds", "Time spent storing a backup.")
+metrics.histogram("cryptpad_backup_size_bytes", "Uncompressed size of backed up pages.", SIZE_BUCKETS)
+metrics.counter("cryptpad_backup_stored_bytes_total", "Compressed bytes added to the backup store.")
+metrics.counter("cryptpad_saves_journaled_total", "Delta saves acknowledged from the write-behind journal.")
+metrics.counter("cryptpad_page_flushes_total", "Page writes of journaled saves.")
+metrics.counter("cryptpad_saves_rate_limited_total", "Saves rejected by the save rate limits, by scope.")
+metrics.counter("cryptpad_pages_archived_total", "Pages moved into the cold archive.")
+metrics.counter("cryptpad_pages_restored_total", "Archived pages restored on access.")
+
+def count_storage_io(direction, nbytes):
+    """Adds bytes read or written by storage to the metrics of the current endpoint."""
+    endpoint = (request.endpoint or "unmatched") if has_request_context() else "background"
+    metrics.inc("cryptpad_storage_bytes_total", nbytes, endpoint=endpoint, direction=direction)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Records request latency (including response compression) and optionally reports it to the client."""
+    started = g.get("request_started")
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("cryptpad_http_request_duration_seconds", duration, endpoint=endpoint)
+    metrics.inc("cryptpad_http_requests_total", endpoint=endpoint, status=response.status_code)
+    if METRICS_SERVER_TIMING:
+        response.headers.add("Server-Timing", f"app;dur={duration * 1000:.1f}")
+    return response
+
+# Locking
+LOCK_DIR = os.path.join(DATA_DIR, ".locks")
+PAGE_LOCK_STRIPES = 64
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """Holds an exclusive (or shared) fcntl lock on a lock file (only a no-op where fcntl is unavailable)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class PageLocks:
+    """Serializes writes to the same page across threads and processes.
+
+    A thread first takes one of a fixed set of in-process locks chosen by
+    the page ID's hash, then an fcntl lock on the lock file of the same
+    stripe in data/.locks/, so the number of lock files stays fixed however
+    many page IDs are requested. Writes to pages of different stripes run
+    in parallel; the locks are not reentrant, so take them once around a
+    whole read-modify-write, and never hold two page locks at once.
+    """
+
+    def __init__(self, lock_dir, stripes=PAGE_LOCK_STRIPES):
+        self.lock_dir = lock_dir
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        os.makedirs(lock_dir, exist_ok=True)
+        # Earlier versions created a lock file per page ID
+        for filename in os.listdir(lock_dir):
+            if filename.endswith(".lock") and not filename.startswith((".", "stripe-")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(lock_dir, filename))
+
+    @contextlib.contextmanager
+    def lock(self, page_id):
+        stripe = zlib.crc32(page_id.encode("utf-8")) % len(self._stripes)
+        with self._stripes[stripe]:
+            with file_lock(os.path.join(self.lock_dir, f"stripe-{stripe}.lock")):
+                yield
+
+page_locks = PageLocks(LOCK_DIR)
+
+# Helper functions for page status management
+DEFAULT_PAGE_STATUS = {"status": "enabled", "security_mode": "prompt"}
+
+def normalize_page_status(page_data):
+    """Converts a stored status entry (including legacy formats) to the current dict format."""
+    # Handle legacy format (string status only)
+    if isinstance(page_data, str):
+        page_data = {"status": page_data}
+    normalized = dict(DEFAULT_PAGE_STATUS)
+    normalized.update(page_data)
+    # Migrate legacy session mode to prompt
+    if normalized.get("security_mode") == "session":
+        normalized["security_mode"] = "prompt"
+    return normalized
+
+class PageStatusRegistry:
+    """Process-wide cache of page_status.json.
+
+    The file is parsed once and only re-read when its mtime or size changes
+    (e.g. another worker process wrote it). Changes are made under an fcntl
+    lock on page_status.json.lock, re-read the file first, and go to a
+    temporary file which is then atomically renamed over the original, so
+    concurrent updates of different pages from several processes are kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._lock = threading.RLock()
+        self._statuses = {}
+        self._stamp = None
+
+    @contextlib.contextmanager
+    def _locked_for_update(self):
+        with self._lock:
+            with file_lock(self.lock_path):
+                # Another process may have written within the stamp's resolution
+                self._stamp = None
+                self._refresh()
+                yield
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        statuses = {}
+        if stamp is not None:
+            started = time.perf_counter()
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                statuses = {page_id: normalize_page_status(data) for page_id, data in raw.items()}
+            except (FileNotFoundError, json.JSONDecodeError) as e:
+                logging.error(f"Error loading page status file: {e}")
+            metrics.observe("cryptpad_status_file_load_seconds", time.perf_counter() - started)
+        self._statuses = statuses
+        self._stamp = stamp
+
+    def _write(self):
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".page_status.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._statuses, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Error saving page status file: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            # Force a reload so the cache matches what is actually on disk
+            self._stamp = None
+            return
+        self._stamp = self._file_stamp()
+
+    def get(self, page_id):
+        """Returns a copy of the status entry for a page."""
+        with self._lock:
+            self._refresh()
+            return dict(self._statuses.get(page_id, DEFAULT_PAGE_STATUS))
+
+    def all(self):
+        """Returns a copy of all status entries."""
+        with self._lock:
+            self._refresh()
+            return {page_id: dict(data) for page_id, data in self._statuses.items()}
+
+    def update(self, page_id, **fields):
+        """Updates fields of a page's status entry and persists the change."""
+        with self._locked_for_update():
+            page_data = dict(self._statuses.get(page_id, DEFAULT_PAGE_STATUS))
+            page_data.update(fields)
+            self._statuses[page_id] = page_data
+            self._write()
+
+    def update_many(self, compute_changes, removed=()):
+        """Updates and removes the status entries of many pages with a single file write.
+
+        ``compute_changes(current)`` returns a dict mapping page IDs to the
+        fields to update; ``current(page_id)`` returns a copy of a page's
+        entry. It is called while the file is locked, so changes derived
+        from the current values (e.g. toggles) cannot undo concurrent
+        updates. ``removed`` lists page IDs whose entries are removed.
+        Returns the new entries of the changed pages.
+        """
+        with self._locked_for_update():
+            changes = compute_changes(lambda page_id: dict(self._statuses.get(page_id, DEFAULT_PAGE_STATUS)))
+            updated = {}
+            for page_id, fields in changes.items():
+                page_data = dict(self._statuses.get(page_id, DEFAULT_PAGE_STATUS))
+                page_data.update(fields)
+                self._statuses[page_id] = updated[page_id] = page_data
+            for page_id in removed:
+                self._statuses.pop(page_id, None)
+            self._write()
+            return {page_id: dict(data) for page_id, data in updated.items()}
+
+    def remove(self, page_id):
+        """Removes a page's status entry, if present."""
+        with self._locked_for_update():
+            if page_id in self._statuses:
+                del self._statuses[page_id]
+                self._write()
+
+    def replace(self, statuses):
+        """Replaces all status entries."""
+        with self._locked_for_update():
+            self._statuses = {page_id: normalize_page_status(data) for page_id, data in statuses.items()}
+            self._write()
+
+def load_page_statuses():
+    """Returns all page statuses (served from the in-memory registry)."""
+    return page_statuses.all()
 
 def save_page_statuses(statuses):
-    """Saves page statuses to the JSON file."""
-    try:
-        with open(PAGE_STATUS_FILE, "w", encoding="utf-8") as f:
-            json.dump(statuses, f, indent=4)
-    except IOError as e:
-        logging.error(f"Error saving page status file: {e}")
+    """Replaces all page statuses and writes them to the JSON file."""
+    page_statuses.replace(statuses)
 
 def get_page_status(page_id):
     """Gets the status of a page, defaulting to 'enabled'."""
-    statuses = load_page_statuses()
-    page_data = statuses.get(page_id, {"status": "enabled", "security_mode": "prompt"})
-    # Handle legacy format (string status only)
-    if isinstance(page_data, str):
-        page_data = {"status": page_data, "security_mode": "prompt"}
-    return page_data.get("status", "enabled")
+    return page_statuses.get(page_id)["status"]
 
 def get_page_security_mode(page_id):
     """Gets the security mode of a page, defaulting to 'prompt'."""
-    statuses = load_page_statuses()
-    page_data = statuses.get(page_id, {"status": "enabled", "security_mode": "prompt"})
-    # Handle legacy format (string status only)
-    if isinstance(page_data, str):
-        return "prompt"
-    current_mode = page_data.get("security_mode", "prompt")
-    # Migrate legacy session mode to prompt
-    if current_mode == "session":
-        return "prompt"
-    return current_mode
+    return page_statuses.get(page_id)["security_mode"]
 
 def set_page_status(page_id, status):
     """Sets the status of a page."""
-    statuses = load_page_statuses()
-    page_data = statuses.get(page_id, {"status": "enabled", "security_mode": "prompt"})
-    # Handle legacy format (string status only)
-    if isinstance(page_data, str):
-        page_data = {"status": page_data, "security_mode": "prompt"}
-    page_data["status"] = status
-    statuses[page_id] = page_data
-    save_page_statuses(statuses)
+    page_statuses.update(page_id, status=status)
+    catalog_page_status_changed(page_id)
+    page_events.publish(page_id, "status", {"status": status})
 
 def set_page_security_mode(page_id, security_mode):
     """Sets the security mode of a page."""
-    statuses = load_page_statuses()
-    page_data = statuses.get(page_id, {"status": "enabled", "security_mode": "prompt"})
-    # Handle legacy format (string status only)
-    if isinstance(page_data, str):
-        page_data = {"status": page_data, "security_mode": "prompt"}
-    page_data["security_mode"] = security_mode
-    statuses[page_id] = page_data
-    save_page_statuses(statuses)
+    page_statuses.update(page_id, security_mode=security_mode)
+    catalog_page_status_changed(page_id)
 
 def remove_page_status(page_id):
     """Removes the status entry for a page."""
-    statuses = load_page_statuses()
-    if page_id in statuses:
-        del statuses[page_id]
-        save_page_statuses(statuses)
+    page_statuses.remove(page_id)
+
+# Storage backends
+# Pages, their statuses and their backups are accessed through a storage
+# object so the route functions do not depend on how state is persisted.
+# FileStorage keeps the original layout (data/<id>.md, page_status.json and
+# the backup blob store); SQLiteStorage keeps everything in one WAL-mode
+# SQLite database. STORAGE_BACKEND selects which one is used.
+BACKUP_MANIFEST_NAME = "manifest.json"
+BACKUP_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+BLOB_CHUNK_SIZE = 64 * 1024
+PAGE_APPEND_MIN_SIZE = 256 * 1024 # Smaller pages are rewritten atomically even if a save only appends
+
+class PageStat(collections.namedtuple("PageStat", "st_mtime_ns st_size")):
+    """Modification time and size of a stored page (the os.stat_result fields used here)."""
+    __slots__ = ()
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+def atomic_write_bytes(path, data):
+    """Writes a file via a temporary file and an atomic rename."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def fsync_directory(path):
+    """Makes renames and new files in a directory durable (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def iter_decompressed(chunks):
+    """Decompresses an iterable of zlib-compressed chunks in bounded-size pieces."""
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, BLOB_CHUNK_SIZE)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, BLOB_CHUNK_SIZE)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+class SQLiteConnections:
+    """Hands out one SQLite connection per thread and process for a database file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        # Connections must not be shared across threads or forked processes
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+class FileStorage:
+    """Stores pages as files in DATA_DIR and backups as compressed blobs in BACKUP_DIR.
+
+    Backup contents are stored once per distinct content as zlib-compressed
+    blobs named by their SHA-256 hash. Each page has a small manifest
+    (backup/<page_id>/manifest.json) listing its backups as
+    timestamp -> hash entries.
+    """
+
+    name = "file"
+
+    def __init__(self, data_dir, backup_dir):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir
+        self.blob_dir = os.path.join(backup_dir, ".blobs") # Dot prefix: can never clash with a page ID
+        self.staging_dir = data_dir # Same file system as the pages, for atomic renames
+        self.append_dir = os.path.join(data_dir, ".appends") # Sizes of pages before an append in progress
+        self.statuses = PageStatusRegistry(os.path.join(data_dir, "page_status.json"))
+        os.makedirs(self.append_dir, exist_ok=True)
+        self.recover_torn_appends()
+
+    # Pages
+    def page_path(self, page_id):
+        return os.path.join(self.data_dir, f"{page_id}.md")
+
+    def page_exists(self, page_id):
+        return os.path.exists(self.page_path(page_id))
+
+    def page_stat(self, page_id):
+        """Returns the page's stat result, or None if it does not exist."""
+        try:
+            return os.stat(self.page_path(page_id))
+        except FileNotFoundError:
+            return None
+
+    def read_page(self, page_id):
+        """Returns the raw content of a page and the matching stat result."""
+        with open(self.page_path(page_id), "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        count_storage_io("read", len(data))
+        return data, st
+
+    def read_page_first_line(self, page_id):
+        with open(self.page_path(page_id), "rb") as f:
+            line = f.readline()
+        count_storage_io("read", len(line))
+        return line.decode("utf-8")
+
+    def read_page_ranges(self, page_id, ranges):
+        """Returns the bytes of the given (start, end) ranges of a page and the page's stat result."""
+        chunks = []
+        with open(self.page_path(page_id), "rb") as f:
+            st = os.fstat(f.fileno())
+            for start, end in ranges:
+                f.seek(start)
+                chunks.append(f.read(end - start))
+        count_storage_io("read", sum(len(chunk) for chunk in chunks))
+        return chunks, st
+
+    def iter_page_chunks(self, page_id, chunk_size=BLOB_CHUNK_SIZE):
+        with open(self.page_path(page_id), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                count_storage_io("read", len(chunk))
+                yield chunk
+
+    def write_page(self, page_id, data, appended=None):
+        """Writes a page and returns its new stat result.
+
+        If ``appended`` is given, ``data`` is the old content followed by
+        ``appended``, and for pages of at least PAGE_APPEND_MIN_SIZE bytes
+        only the appended bytes are written (see ``_append_page``).
+        Otherwise the page is replaced atomically, so readers never see a
+        partial write. Callers serialize writes to a page with ``page_locks``.
+        """
+        path = self.page_path(page_id)
+        if appended is None or len(data) - len(appended) < PAGE_APPEND_MIN_SIZE:
+            atomic_write_bytes(path, data)
+            st = os.stat(path)
+            count_storage_io("write", len(data))
+        else:
+            st = self._append_page(page_id, appended)
+            count_storage_io("write", len(appended))
+        return st
+
+    def _append_marker_path(self, page_id):
+        return os.path.join(self.append_dir, page_id)
+
+    def _append_page(self, page_id, appended):
+        """Appends to a page and fsyncs it.
+
+        The page's size before the append is recorded durably first, in
+        data/.appends/<page_id>, so that an append torn by a crash is cut
+        off again by ``recover_torn_appends`` and the page matches the last
+        acknowledged save.
+        """
+        marker_path = self._append_marker_path(page_id)
+        with open(self.page_path(page_id), "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            atomic_write_bytes(marker_path, str(size).encode("ascii"))
+            fsync_directory(self.append_dir)
+            try:
+                f.write(appended)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.truncate(size) # E.g. a short write on a full disk
+                raise
+            st = os.fstat(f.fileno())
+        os.remove(marker_path)
+        return st
+
+    def recover_torn_appends(self):
+        """Truncates pages whose append was interrupted back to their size before it; returns their IDs."""
+        recovered = []
+        for page_id in os.listdir(self.append_dir):
+            if page_id.startswith("."): # Temporary file of a marker being written
+                continue
+            with page_locks.lock(page_id): # A marker seen under the lock belongs to no running append
+                marker_path = self._append_marker_path(page_id)
+                try:
+                    with open(marker_path, "rb") as f:
+                        size = int(f.read())
+                    with open(self.page_path(page_id), "r+b") as f:
+                        f.truncate(size)
+                        os.fsync(f.fileno())
+                except FileNotFoundError: # Append finished meanwhile, or the page was deleted
+                    pass
+                except ValueError:
+                    pass # Marker torn itself: the append had not started
+                else:
+                    recovered.append(page_id)
+                    logging.warning(f"Truncated page {page_id} to {size} bytes after an interrupted append.")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(marker_path)
+        return recovered
+
+    def write_page_from_file(self, page_id, staged_path):
+        """Moves a complete staging file into place as the page's content.
+
+        The staging file must have been created in ``staging_dir``, so the
+        rename is atomic. Returns the page's new stat result.
+        """
+        path = self.page_path(page_id)
+        os.replace(staged_path, path)
+        st = os.stat(path)
+        count_storage_io("write", st.st_size)
+        return st
+
+    def import_page(self, page_id, data, mtime_ns):
+        """Writes a page with a given modification time (used by archive restores). Returns its stat result."""
+        path = self.page_path(page_id)
+        atomic_write_bytes(path, data)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        count_storage_io("write", len(data))
+        return os.stat(path)
+
+    def create_pages(self, page_ids):
+        """Creates empty pages, skipping IDs that are already taken.
+
+        Returns a dict mapping the created page IDs to their stat results.
+        """
+        created = {}
+        for page_id in page_ids:
+            try:
+                with open(self.page_path(page_id), "xb") as f:
+                    created[page_id] = os.fstat(f.fileno())
+            except FileExistsError:
+                continue
+        return created
+
+    def delete_page(self, page_id):
+        os.remove(self.page_path(page_id))
+
+    def list_page_ids(self):
+        return [filename[:-3] for filename in os.listdir(self.data_dir) if filename.endswith(".md")]
+
+    # Backups
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.z")
+
+    def store_blob(self, data):
+        """Stores content in the blob store if not already present.
+
+        Returns its hash and the number of bytes written (0 if deduplicated).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            try:
+                # A fresh mtime keeps collect_unreferenced_blobs(older_than) away from it
+                os.utime(path)
+                return digest, 0
+            except FileNotFoundError:
+                pass # Collected meanwhile; store it again
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, 6)
+        atomic_write_bytes(path, compressed)
+        count_storage_io("write", len(compressed))
+        return digest, len(compressed)
+
+    def iter_blob(self, digest):
+        """Yields the decompressed content of a blob in bounded-size chunks."""
+        def compressed_chunks():
+            with open(self.blob_path(digest), "rb") as f:
+                while True:
+                    chunk = f.read(BLOB_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    count_storage_io("read", len(chunk))
+                    yield chunk
+        return iter_decompressed(compressed_chunks())
+
+    def list_backups(self, page_id):
+        """Returns a page's backup entries ({"timestamp", "hash", "size"}), oldest first."""
+        try:
+            with open(os.path.join(self.backup_dir, page_id, BACKUP_MANIFEST_NAME), "r", encoding="utf-8") as f:
+                return json.load(f).get("backups", [])
+        except FileNotFoundError:
+            return []
+        except (json.JSONDecodeError, AttributeError) as e:
+            logging.error(f"Error loading backup manifest for {page_id}: {e}")
+            return []
+
+    def save_backups(self, page_id, entries):
+        """Atomically replaces a page's backup manifest."""
+        os.makedirs(os.path.join(self.backup_dir, page_id), exist_ok=True)
+        entries = sorted(entries, key=lambda entry: entry["timestamp"])
+        atomic_write_bytes(
+            os.path.join(self.backup_dir, page_id, BACKUP_MANIFEST_NAME),
+            json.dumps({"backups": entries}, indent=4).encode("utf-8"),
+        )
+
+    def delete_backups(self, page_id):
+        """Removes a page's backup manifest (its blobs are left to collect_unreferenced_blobs)."""
+        try:
+            os.remove(os.path.join(self.backup_dir, page_id, BACKUP_MANIFEST_NAME))
+            os.rmdir(os.path.join(self.backup_dir, page_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e: # E.g. legacy backup files not migrated yet
+            logging.warning(f"Could not remove backup directory of {page_id}: {e}")
+
+    def backup_page_ids(self):
+        """Returns the ids of all pages that have a backup manifest."""
+        return [
+            page_id for page_id in os.listdir(self.backup_dir)
+            if not page_id.startswith(".") and os.path.exists(os.path.join(self.backup_dir, page_id, BACKUP_MANIFEST_NAME))
+        ]
+
+    def collect_unreferenced_blobs(self, older_than):
+        """Deletes blobs that no manifest references. Returns (count, bytes) removed.
+
+        Blobs stored or deduplicated after ``older_than`` are skipped, since
+        a backup may have stored them without having written its manifest
+        yet. Callers hold ``blob_store_lock(exclusive=True)``.
+        """
+        referenced = set()
+        for page_id in self.backup_page_ids():
+            referenced.update(entry["hash"] for entry in self.list_backups(page_id))
+        removed = removed_bytes = 0
+        if not os.path.isdir(self.blob_dir):
+            return removed, removed_bytes
+        for prefix in os.listdir(self.blob_dir):
+            prefix_dir = os.path.join(self.blob_dir, prefix)
+            for blob_file in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, blob_file)
+                if not blob_file.endswith(".z") or blob_file[:-2] in referenced:
+                    continue
+                try:
+                    st = os.stat(path)
+                    if st.st_mtime >= older_than:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                    removed_bytes += st.st_size
+                except OSError as e:
+                    logging.warning(f"Could not remove unreferenced blob {path}: {e}")
+        return removed, removed_bytes
+
+class SQLiteStatusStore:
+    """Page statuses stored in the SQLite backend (same interface as PageStatusRegistry)."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def get(self, page_id):
+        row = self._db.get().execute(
+            "SELECT status, security_mode FROM page_status WHERE page_id = ?", (page_id,)
+        ).fetchone()
+        return dict(row) if row else dict(DEFAULT_PAGE_STATUS)
+
+    def all(self):
+        rows = self._db.get().execute("SELECT page_id, status, security_mode FROM page_status")
+        return {row["page_id"]: {"status": row["status"], "security_mode": row["security_mode"]} for row in rows}
+
+    def update(self, page_id, **fields):
+        conn = self._db.get()
+        with conn:
+            # Single statement, so concurrent updates of different fields cannot be lost
+            page_data = dict(DEFAULT_PAGE_STATUS)
+            page_data.update(fields)
+            assignments = ", ".join(f"{name} = excluded.{name}" for name in fields)
+            conn.execute(
+                f"""INSERT INTO page_status (page_id, status, security_mode) VALUES (?, ?, ?)
+                    ON CONFLICT(page_id) DO UPDATE SET {assignments}""",
+                (page_id, page_data["status"], page_data["security_mode"]),
+            )
+
+    def update_many(self, compute_changes, removed=()):
+        conn = self._db.get()
+        with conn:
+            # Takes the write lock before reading, so the changes are computed from current values
+            conn.execute("BEGIN IMMEDIATE")
+
+            def current(page_id):
+                row = conn.execute("SELECT status, security_mode FROM page_status WHERE page_id = ?", (page_id,)).fetchone()
+                return dict(row) if row else dict(DEFAULT_PAGE_STATUS)
+
+            changes = compute_changes(current)
+            updated = {}
+            for page_id, fields in changes.items():
+                updated[page_id] = dict(current(page_id), **fields)
+                conn.execute(
+                    """INSERT INTO page_status (page_id, status, security_mode) VALUES (?, ?, ?)
+                       ON CONFLICT(page_id) DO UPDATE SET status = excluded.status, security_mode = excluded.security_mode""",
+                    (page_id, updated[page_id]["status"], updated[page_id]["security_mode"]),
+                )
+            conn.executemany("DELETE FROM page_status WHERE page_id = ?", [(page_id,) for page_id in removed])
+        return updated
+
+    def remove(self, page_id):
+        conn = self._db.get()
+        with conn:
+            conn.execute("DELETE FROM page_status WHERE page_id = ?", (page_id,))
+
+    def replace(self, statuses):
+        conn = self._db.get()
+        with conn:
+            conn.execute("DELETE FROM page_status")
+            for page_id, data in statuses.items():
+                data = normalize_page_status(data)
+                conn.execute(
+                    "INSERT INTO page_status (page_id, status, security_mode) VALUES (?, ?, ?)",
+                    (page_id, data["status"], data["security_mode"]),
+                )
+
+class SQLiteStorage:
+    """Stores pages, statuses, backup entries and backup blobs as rows of one SQLite database."""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.staging_dir = os.path.dirname(path) or "."
+        self._db = SQLiteConnections(path)
+        self.statuses = SQLiteStatusStore(self._db)
+        conn = self._db.get()
+        with conn:
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    page_id TEXT PRIMARY KEY,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS page_status (
+                    page_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    security_mode TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS backups (
+                    page_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    source_mtime_ns INTEGER,
+                    PRIMARY KEY (page_id, timestamp)
+                );
+                CREATE INDEX IF NOT EXISTS idx_backups_hash ON backups (hash);
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    created REAL NOT NULL
+                );"""
+            )
+
+    # Pages
+    def page_exists(self, page_id):
+        return self._db.get().execute("SELECT 1 FROM pages WHERE page_id = ?", (page_id,)).fetchone() is not None
+
+    def page_stat(self, page_id):
+        row = self._db.get().execute("SELECT mtime_ns, size FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+        return PageStat(row["mtime_ns"], row["size"]) if row else None
+
+    def read_page(self, page_id):
+        row = self._db.get().execute(
+            "SELECT content, mtime_ns, size FROM pages WHERE page_id = ?", (page_id,)
+        ).fetchone()
+        if row is None:
+            # Same exception as the file backend, so callers handle both alike
+            raise FileNotFoundError(f"Page '{page_id}' not found")
+        count_storage_io("read", row["size"])
+        return bytes(row["content"]), PageStat(row["mtime_ns"], row["size"])
+
+    def read_page_first_line(self, page_id):
+        data, _ = self.read_page(page_id)
+        return data.split(b"\n", 1)[0].decode("utf-8")
+
+    def read_page_ranges(self, page_id, ranges):
+        conn = self._db.get()
+        conn.execute("BEGIN") # The stamp and the ranges must come from the same version of the row
+        try:
+            row = conn.execute("SELECT rowid, mtime_ns, size FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"Page '{page_id}' not found")
+            if hasattr(conn, "blobopen"): # Python 3.11+
+                chunks = []
+                with conn.blobopen("pages", "content", row["rowid"], readonly=True) as blob:
+                    for start, end in ranges:
+                        blob.seek(start)
+                        chunks.append(blob.read(end - start))
+            else:
+                data = conn.execute("SELECT content FROM pages WHERE rowid = ?", (row["rowid"],)).fetchone()[0]
+                chunks = [bytes(data[start:end]) for start, end in ranges]
+        finally:
+            conn.commit()
+        count_storage_io("read", sum(len(chunk) for chunk in chunks))
+        return chunks, PageStat(row["mtime_ns"], row["size"])
+
+    def iter_page_chunks(self, page_id, chunk_size=BLOB_CHUNK_SIZE):
+        data, _ = self.read_page(page_id)
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    def _next_mtime_ns(self, conn, page_id):
+        row = conn.execute("SELECT mtime_ns FROM pages WHERE page_id = ?", (page_id,)).fetchone()
+        # Keep the stamp strictly increasing so revision caches notice every write
+        return max(time.time_ns(), row["mtime_ns"] + 1 if row else 0)
+
+    def write_page(self, page_id, data, appended=None):
+        conn = self._db.get()
+        with conn:
+            mtime_ns = self._next_mtime_ns(conn, page_id)
+            conn.execute(
+                """INSERT INTO pages (page_id, content, size, mtime_ns) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(page_id) DO UPDATE SET
+                       content = excluded.content, size = excluded.size, mtime_ns = excluded.mtime_ns""",
+                (page_id, data, len(data), mtime_ns),
+            )
+        count_storage_io("write", len(data))
+        return PageStat(mtime_ns, len(data))
+
+    def write_page_from_file(self, page_id, staged_path):
+        """Stores a staging file as the page's content and removes the file.
+
+        The content is copied into the row in chunks through incremental
+        blob I/O, so it is never held in memory as a whole.
+        """
+        size = os.path.getsize(staged_path)
+        conn = self._db.get()
+        with conn:
+            mtime_ns = self._next_mtime_ns(conn, page_id)
+            conn.execute(
+                """INSERT INTO pages (page_id, content, size, mtime_ns) VALUES (?, zeroblob(?), ?, ?)
+                   ON CONFLICT(page_id) DO UPDATE SET
+                       content = excluded.content, size = excluded.size, mtime_ns = excluded.mtime_ns""",
+                (page_id, size, size, mtime_ns),
+            )
+            rowid = conn.execute("SELECT rowid FROM pages WHERE page_id = ?", (page_id,)).fetchone()[0]
+            with open(staged_path, "rb") as f:
+                if hasattr(conn, "blobopen"): # Python 3.11+
+                    with conn.blobopen("pages", "content", rowid) as blob:
+                        while True:
+                            chunk = f.read(BLOB_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            blob.write(chunk)
+                else:
+                    conn.execute("UPDATE pages SET content = ? WHERE rowid = ?", (f.read(), rowid))
+        os.remove(staged_path)
+        count_storage_io("write", size)
+        return PageStat(mtime_ns, size)
+
+    def create_pages(self, page_ids):
+        mtime_ns = time.time_ns()
+        created = {}
+        conn = self._db.get()
+        with conn:
+            for page_id in page_ids:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO pages (page_id, content, size, mtime_ns) VALUES (?, ?, 0, ?)",
+                    (page_id, b"", mtime_ns),
+                )
+                if cursor.rowcount:
+                    created[page_id] = PageStat(mtime_ns, 0)
+        return created
+
+    def import_page(self, page_id, data, mtime_ns):
+        """Inserts a page with a given modification time (used by the migration tool and archive restores)."""
+        conn = self._db.get()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (page_id, content, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                (page_id, data, len(data), mtime_ns),
+            )
+        count_storage_io("write", len(data))
+        return PageStat(mtime_ns, len(data))
+
+    def delete_page(self, page_id):
+        conn = self._db.get()
+        with conn:
+            if conn.execute("DELETE FROM pages WHERE page_id = ?", (page_id,)).rowcount == 0:
+                raise FileNotFoundError(f"Page '{page_id}' not found")
+
+    def list_page_ids(self):
+        return [row[0] for row in self._db.get().execute("SELECT page_id FROM pages")]
+
+    # Backups
+    def store_blob(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        conn = self._db.get()
+        with conn:
+            # Deduplicated blobs get a fresh "created" time, like the file backend's mtime
+            if conn.execute("UPDATE blobs SET created = ? WHERE hash = ?", (time.time(), digest)).rowcount:
+                return digest, 0
+            compressed = zlib.compress(data, 6)
+            conn.execute(
+                """INSERT INTO blobs (hash, data, created) VALUES (?, ?, ?)
+                   ON CONFLICT(hash) DO UPDATE SET created = excluded.created""",
+                (digest, compressed, time.time()),
+            )
+        count_storage_io("write", len(compressed))
+        return digest, len(compressed)
+
+    def iter_blob(self, digest):
+        row = self._db.get().execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Backup blob {digest} not found")
+        data = bytes(row["data"])
+        count_storage_io("read", len(data))
+        return iter_decompressed(data[offset:offset + BLOB_CHUNK_SIZE] for offset in range(0, len(data), BLOB_CHUNK_SIZE))
+
+    def list_backups(self, page_id):
+        rows = self._db.get().execute(
+            "SELECT timestamp, hash, size, source_mtime_ns FROM backups WHERE page_id = ? ORDER BY timestamp",
+            (page_id,),
+        )
+        entries = []
+        for row in rows:
+            entry = {"timestamp": row["timestamp"], "hash": row["hash"], "size": row["size"]}
+            if row["source_mtime_ns"] is not None:
+                entry["source_mtime_ns"] = row["source_mtime_ns"]
+            entries.append(entry)
+        return entries
+
+    def save_backups(self, page_id, entries):
+        conn = self._db.get()
+        with conn:
+            conn.execute("DELETE FROM backups WHERE page_id = ?", (page_id,))
+            conn.executemany(
+                "INSERT INTO backups (page_id, timestamp, hash, size, source_mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                [(page_id, e["timestamp"], e["hash"], e["size"], e.get("source_mtime_ns")) for e in entries],
+            )
+
+    def delete_backups(self, page_id):
+        conn = self._db.get()
+        with conn:
+            conn.execute("DELETE FROM backups WHERE page_id = ?", (page_id,))
+
+    def backup_page_ids(self):
+        return [row[0] for row in self._db.get().execute("SELECT DISTINCT page_id FROM backups")]
+
+    def collect_unreferenced_blobs(self, older_than):
+        conn = self._db.get()
+        with conn:
+            removed, removed_bytes = conn.execute(
+                """SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs
+                   WHERE created < ? AND hash NOT IN (SELECT hash FROM backups)""",
+                (older_than,),
+            ).fetchone()
+            conn.execute(
+                "DELETE FROM blobs WHERE created < ? AND hash NOT IN (SELECT hash FROM backups)",
+                (older_than,),
+            )
+        return removed, removed_bytes
+
+def create_storage(backend):
+    """Creates the storage backend selected by configuration."""
+    if backend == "file":
+        return FileStorage(DATA_DIR, BACKUP_DIR)
+    if backend == "sqlite":
+        return SQLiteStorage(SQLITE_DATABASE)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'file' or 'sqlite').")
+
+# Write-behind saves
+SAVE_COALESCE_SECONDS = float(os.environ.get("SAVE_COALESCE_SECONDS", "1")) # 0 writes every save through
+SAVE_JOURNAL_DIR = os.path.join(DATA_DIR, ".journal")
+SAVE_JOURNAL_MAX_BYTES = 1024 * 1024 # A longer journal is written to the page at once
+
+class WriteBehindStorage:
+    """Storage wrapper that journals delta saves and writes pages behind.
+
+    A delta save is acknowledged once its edits are appended and fsynced
+    to data/.journal/<page_id>.log. The page itself is rewritten once the
+    oldest journaled save is ``delay`` seconds old, so a burst of saves of
+    a page costs one page write. Reads replay the journal on top of the
+    stored page (cached per process), so every process sees every
+    acknowledged save. Other methods are passed to the wrapped storage.
+    Journals left behind by a stopped process are written by the flusher
+    of any other process. The catalog is updated when a journal is written
+    to the page, once per coalesced batch of saves.
+    """
+
+    def __init__(self, inner, journal_dir, delay):
+        self.inner = inner
+        self.journal_dir = journal_dir
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = {} # page_id -> (journal stamp, data, PageStat, revision)
+        self._thread = None
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def journal_path(self, page_id):
+        return os.path.join(self.journal_dir, f"{page_id}.log")
+
+    @staticmethod
+    def _journal_stamp(st):
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _forget_pending(self, page_id):
+        with self._lock:
+            self._pending.pop(page_id, None)
+
+    def _pending_state(self, page_id):
+        """Returns (data, st, revision) with the journal applied, or None if nothing is pending."""
+        try:
+            f = open(self.journal_path(page_id), "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            journal_st = os.fstat(f.fileno())
+            stamp = self._journal_stamp(journal_st)
+            with self._lock:
+                cached = self._pending.get(page_id)
+            if cached and cached[0] == stamp:
+                return cached[1:]
+            raw = f.read(journal_st.st_size) # Appends only add records after this point
+        records = []
+        for line in raw.split(b"\n"):
+            try:
+                records.append(json.loads(line))
+            except ValueError: # A record cut off by a crash was never acknowledged
+                break
+        try:
+            data, st = self.inner.read_page(page_id)
+        except FileNotFoundError:
+            return None
+        # The revision cache holds the journaled version of the page, so the stored page's
+        # revision is taken from the journal if it is still its base, or computed here
+        revision = None
+        if records and records[0].get("base_stamp") == list(stat_stamp(st)):
+            revision = records[0]["base_revision"]
+        revision = revision or page_revisions.cached(page_id, st) or compute_revision(data)
+        if records and records[0].get("base_revision") == revision:
+            content = data.decode("utf-8")
+            for record in records:
+                content, _ = apply_page_edits(content, record["edits"])
+            data = content.encode("utf-8")
+            st = PageStat(records[-1]["mtime_ns"], len(data))
+            revision = records[-1].get("revision") or compute_revision(data)
+            page_revisions.store(page_id, st, revision)
+        # Otherwise the journal was already written to the page (or superseded) and is stale
+        with self._lock:
+            self._pending[page_id] = (stamp, data, st, revision)
+        return data, st, revision
+
+    # Reads see journaled saves
+    def page_stat(self, page_id):
+        state = self._pending_state(page_id)
+        return state[1] if state else self.inner.page_stat(page_id)
+
+    def read_page(self, page_id):
+        state = self._pending_state(page_id)
+        if state is None:
+            return self.inner.read_page(page_id)
+        count_storage_io("read", len(state[0]))
+        return state[0], state[1]
+
+    def read_page_first_line(self, page_id):
+        state = self._pending_state(page_id)
+        if state is None:
+            return self.inner.read_page_first_line(page_id)
+        return state[0].split(b"\n", 1)[0].decode("utf-8")
+
+    def iter_page_chunks(self, page_id, chunk_size=BLOB_CHUNK_SIZE):
+        state = self._pending_state(page_id)
+        if state is None:
+            yield from self.inner.iter_page_chunks(page_id, chunk_size)
+            return
+        data = state[0]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    def read_page_ranges(self, page_id, ranges):
+        state = self._pending_state(page_id)
+        if state is None:
+            return self.inner.read_page_ranges(page_id, ranges)
+        return [state[0][start:end] for start, end in ranges], state[1]
+
+    # Writes (callers hold the page's lock)
+    def journal_edits(self, page_id, data, edits):
+        """Appends a delta save to the page's journal; returns the page's new stat result and revision.
+
+        ``data`` is the content after applying ``edits`` to the current
+        content, which the caller has just read.
+        """
+        state = self._pending_state(page_id)
+        revision = compute_revision(data)
+        record = {"time": time.time(), "edits": edits, "revision": revision}
+        if state is None:
+            st = self.inner.page_stat(page_id)
+            record["base_revision"] = page_revisions.cached(page_id, st) or page_revisions.remember(page_id, st, self.inner.read_page(page_id)[0])
+            record["base_stamp"] = stat_stamp(st)
+        else:
+            st = state[1]
+        # Keep the stamp strictly increasing so revision caches notice every save
+        record["mtime_ns"] = max(time.time_ns(), st.st_mtime_ns + 1)
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        fd = os.open(self.journal_path(page_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+            journal_st = os.fstat(fd)
+        finally:
+            os.close(fd)
+        count_storage_io("write", len(line))
+        metrics.inc("cryptpad_saves_journaled_total")
+        new_st = PageStat(record["mtime_ns"], len(data))
+        with self._lock:
+            self._pending[page_id] = (self._journal_stamp(journal_st), data, new_st, revision)
+        if journal_st.st_size > SAVE_JOURNAL_MAX_BYTES:
+            return self._flush_locked(page_id) or new_st, revision
+        return new_st, revision
+
+    def _discard_journal(self, page_id):
+        # A full write supersedes the journal. Removing it only after the write is safe:
+        # a journal whose base revision no longer matches the page is ignored.
+        try:
+            os.remove(self.journal_path(page_id))
+        except FileNotFoundError:
+            pass
+        self._forget_pending(page_id)
+
+    def write_page(self, page_id, data, appended=None):
+        if appended is not None and self._pending_state(page_id) is not None:
+            appended = None # The stored page lacks the journaled saves, so write it in full
+        st = self.inner.write_page(page_id, data, appended)
+        self._discard_journal(page_id)
+        return st
+
+    def write_page_from_file(self, page_id, staged_path):
+        st = self.inner.write_page_from_file(page_id, staged_path)
+        self._discard_journal(page_id)
+        return st
+
+    def import_page(self, page_id, data, mtime_ns):
+        st = self.inner.import_page(page_id, data, mtime_ns)
+        self._discard_journal(page_id)
+        return st
+
+    def delete_page(self, page_id):
+        self.inner.delete_page(page_id)
+        self._discard_journal(page_id)
+
+    # Flushing
+    def _flush_locked(self, page_id):
+        """Writes the journaled saves to the page and removes the journal; returns the new stat result."""
+        state = self._pending_state(page_id)
+        if state is None:
+            self._discard_journal(page_id) # No journal, or the page was deleted
+            return None
+        st = None
+        if stat_stamp(state[1]) != stat_stamp(self.inner.page_stat(page_id)):
+            data, _, revision = state
+            st = self.inner.write_page(page_id, data)
+            page_revisions.store(page_id, st, revision)
+            catalog_page_written(page_id, data.decode("utf-8"), st, revision)
+            metrics.inc("cryptpad_page_flushes_total")
+        self._discard_journal(page_id)
+        return st
+
+    def flush(self, page_id):
+        """Writes a page's journaled saves to the page."""
+        with page_locks.lock(page_id):
+            self._flush_locked(page_id)
+
+    def flush_due(self, flush_all=False):
+        """Flushes all journals whose oldest save is older than the delay; returns how many were flushed."""
+        flushed = 0
+        now = time.time()
+        for entry in os.scandir(self.journal_dir):
+            if not entry.name.endswith(".log"):
+                continue
+            page_id = entry.name[:-4]
+            if not flush_all:
+                try:
+                    with open(entry.path, "rb") as f:
+                        first_line = f.readline()
+                except FileNotFoundError: # Flushed meanwhile
+                    continue
+                try:
+                    started = json.loads(first_line)["time"]
+                except (ValueError, KeyError):
+                    started = 0 # Unreadable journal: flush() discards it
+                if now - started < self.delay:
+                    continue
+            try:
+                self.flush(page_id)
+                flushed += 1
+            except Exception as e:
+                logging.error(f"Error writing journaled saves of page {page_id}: {e}")
+        return flushed
+
+    def start(self):
+        """Starts the thread that writes due journals in this process."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="save-flusher", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        while True:
+            time.sleep(max(self.delay / 4, 0.05))
+            self.flush_due()
+
+storage = create_storage(STORAGE_BACKEND)
+if SAVE_COALESCE_SECONDS > 0:
+    storage = WriteBehindStorage(storage, SAVE_JOURNAL_DIR, SAVE_COALESCE_SECONDS)
+page_statuses = storage.statuses
 
-def generate_page_id(length=4):
-    """Generates a random string of fixed length (lowercase letters)."""
-    letters = string.ascii_lowercase
-    return "".join(random.choice(letters) for i in range(length))
+# Cold-tier archive
+ARCHIVE_DIR = os.path.join(DATA_DIR, ".archive")
+ARCHIVE_PACK_MAX_PAGES = 10000 # Pages per pack file; larger runs write several packs
+ARCHIVE_INDEX_MAGIC = b"CPARCIX1"
+ARCHIVE_INDEX_HEADER = struct.Struct("<8sQQQ") # Magic, slot count, directory segment offset and length
+ARCHIVE_INDEX_SLOT = struct.Struct("<16sQQ4xI") # Page ID hash, record segment offset and length, state
+ARCHIVE_SLOT_EMPTY, ARCHIVE_SLOT_LIVE, ARCHIVE_SLOT_TOMBSTONE = 0, 1, 2
+
+def archive_key(page_id):
+    """Returns the 16-byte hash of a page ID used as its key in archive indexes."""
+    return hashlib.blake2b(page_id.encode("utf-8"), digest_size=16).digest()
+
+class ArchivePackWriter:
+    """Writes one pack file of the cold archive, and its index once complete.
+
+    A pack is a sequence of independently zlib-compressed segments: the
+    content of each page, each distinct backup blob of its pages, one JSON
+    record per page pointing to these segments, and finally a directory
+    mapping page IDs to their records.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.name = f"pack-{time.time_ns()}-{os.getpid()}"
+        fd, self._tmp_path = tempfile.mkstemp(dir=archive_dir, prefix=".tmp.")
+        self._file = os.fdopen(fd, "wb")
+        self._offset = 0
+        self._blobs = {} # Blob hash -> segment, so backups shared by pages are stored once
+        self.records = {} # Page ID -> record segment
+
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+        count_storage_io("write", len(data))
+
+    def _add_segment(self, chunks):
+        compressor = zlib.compressobj(6)
+        start = self._offset
+        for chunk in chunks:
+            self._write(compressor.compress(chunk))
+        self._write(compressor.flush())
+        return [start, self._offset - start]
+
+    def add_page(self, page_id, chunks, st, backups, iter_blob):
+        """Adds a page's content (an iterable of chunks) and its backup entries, whose blobs are read with iter_blob."""
+        record = {
+            "page_id": page_id,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "content": self._add_segment(chunks),
+            "backups": backups,
+            "blobs": {},
+        }
+        for entry in backups:
+            digest = entry["hash"]
+            if digest not in self._blobs:
+                self._blobs[digest] = self._add_segment(iter_blob(digest))
+            record["blobs"][digest] = self._blobs[digest]
+        self.records[page_id] = self._add_segment([json.dumps(record).encode("utf-8")])
+
+    def commit(self):
+        """Moves the pack into place and writes its index, which makes the pack visible. Returns its name."""
+        directory = self._add_segment([json.dumps(self.records).encode("utf-8")])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        # Open addressing with linear probing; at most half of the slots are used
+        slot_count = 1 << (2 * max(len(self.records), 1) - 1).bit_length()
+        slots = [None] * slot_count
+        for page_id, (offset, length) in self.records.items():
+            key = archive_key(page_id)
+            slot = int.from_bytes(key[:8], "little") & (slot_count - 1)
+            while slots[slot] is not None:
+                slot = (slot + 1) & (slot_count - 1)
+            slots[slot] = ARCHIVE_INDEX_SLOT.pack(key, offset, length, ARCHIVE_SLOT_LIVE)
+        empty = ARCHIVE_INDEX_SLOT.pack(bytes(16), 0, 0, ARCHIVE_SLOT_EMPTY)
+        index = ARCHIVE_INDEX_HEADER.pack(ARCHIVE_INDEX_MAGIC, slot_count, *directory)
+        index += b"".join(slot or empty for slot in slots)
+
+        os.replace(self._tmp_path, os.path.join(self.archive_dir, f"{self.name}.pack"))
+        atomic_write_bytes(os.path.join(self.archive_dir, f"{self.name}.idx"), index)
+        return self.name
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+class ColdArchive:
+    """Pack files in data/.archive/ holding the content and backups of inactive pages.
+
+    Each pack has an index (pack-<time>-<pid>.idx): a hash table of
+    fixed-size slots keyed by a hash of the page ID. Indexes are
+    memory-mapped, so finding a page costs a few slot reads per pack,
+    however many pages the pack holds. Restored or deleted pages get a
+    tombstone in their slot instead of rewriting the pack; packs without
+    live pages are removed by the next archival run.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._indexes = {} # Pack name -> mapped index, newest pack first
+        self._stamp = None
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def _path(self, name, suffix):
+        return os.path.join(self.archive_dir, f"{name}{suffix}")
+
+    def _packs(self):
+        """Returns the mapped indexes, picking up packs added or removed by other processes."""
+        stamp = os.stat(self.archive_dir).st_mtime_ns
+        with self._lock:
+            if stamp != self._stamp:
+                names = sorted((f[:-4] for f in os.listdir(self.archive_dir) if f.startswith("pack-") and f.endswith(".idx")),
+                               key=lambda name: int(name.split("-")[1]), reverse=True)
+                indexes = {}
+                for name in names:
+                    index = self._indexes.get(name)
+                    if index is None:
+                        try:
+                            with open(self._path(name, ".idx"), "rb") as f:
+                                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        except (FileNotFoundError, ValueError): # Removed meanwhile
+                            continue
+                    indexes[name] = index
+                # Unmapping is left to the garbage collector: other threads may still read them
+                self._indexes = indexes
+                self._stamp = stamp
+            return self._indexes
+
+    @staticmethod
+    def _find(index, key):
+        """Returns the (slot position, offset, length, state) of a key in an index, or None."""
+        _, slot_count, _, _ = ARCHIVE_INDEX_HEADER.unpack_from(index)
+        slot = int.from_bytes(key[:8], "little") & (slot_count - 1)
+        while True:
+            position = ARCHIVE_INDEX_HEADER.size + slot * ARCHIVE_INDEX_SLOT.size
+            slot_key, offset, length, state = ARCHIVE_INDEX_SLOT.unpack_from(index, position)
+            if state == ARCHIVE_SLOT_EMPTY:
+                return None
+            if slot_key == key:
+                return position, offset, length, state
+            slot = (slot + 1) & (slot_count - 1)
+
+    def lookup(self, page_id):
+        """Returns the location of a page's archived record, or None if it is not archived."""
+        key = archive_key(page_id)
+        for name, index in self._packs().items():
+            found = self._find(index, key)
+            if found and found[3] == ARCHIVE_SLOT_LIVE:
+                return (name, found[1], found[2])
+        return None
+
+    def contains(self, page_id):
+        return self.lookup(page_id) is not None
+
+    def _iter_segment(self, name, segment):
+        """Yields the decompressed content of a segment in bounded-size chunks."""
+        offset, length = segment
+        def compressed_chunks():
+            with open(self._path(name, ".pack"), "rb") as f:
+                f.seek(offset)
+                remaining = length
+                while remaining:
+                    chunk = f.read(min(BLOB_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise OSError(f"Archive pack {name} is truncated.")
+                    remaining -= len(chunk)
+                    count_storage_io("read", len(chunk))
+                    yield chunk
+        return iter_decompressed(compressed_chunks())
+
+    def read_record(self, location):
+        """Returns the record of an archived page (see ArchivePackWriter.add_page)."""
+        name, offset, length = location
+        record = json.loads(b"".join(self._iter_segment(name, (offset, length))))
+        record["pack"] = name
+        return record
+
+    def iter_content(self, record):
+        return self._iter_segment(record["pack"], record["content"])
+
+    def iter_blob(self, record, digest):
+        return self._iter_segment(record["pack"], record["blobs"][digest])
+
+    def iter_page_chunks(self, page_id):
+        """Yields the content of an archived page; raises FileNotFoundError if it is not archived."""
+        location = self.lookup(page_id)
+        if location is None:
+            raise FileNotFoundError(f"Page {page_id} is not archived.")
+        yield from self.iter_content(self.read_record(location))
+
+    def discard(self, page_id, pack=None, keep=None):
+        """Marks a page's records as removed, in all packs or only in ``pack``, except in ``keep``.
+
+        Callers hold the page's lock.
+        """
+        key = archive_key(page_id)
+        for name, index in self._packs().items():
+            if name == keep or pack not in (None, name):
+                continue
+            found = self._find(index, key)
+            if found and found[3] == ARCHIVE_SLOT_LIVE:
+                fd = os.open(self._path(name, ".idx"), os.O_WRONLY)
+                try:
+                    os.pwrite(fd, ARCHIVE_INDEX_SLOT.pack(key, found[1], found[2], ARCHIVE_SLOT_TOMBSTONE), found[0])
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def page_locations(self):
+        """Yields (page_id, location) for all archived pages."""
+        seen = set()
+        for name, index in self._packs().items():
+            _, _, directory_offset, directory_length = ARCHIVE_INDEX_HEADER.unpack_from(index)
+            directory = json.loads(b"".join(self._iter_segment(name, (directory_offset, directory_length))))
+            for page_id in directory:
+                found = self._find(index, archive_key(page_id))
+                if page_id not in seen and found and found[3] == ARCHIVE_SLOT_LIVE:
+                    seen.add(page_id)
+                    yield page_id, (name, found[1], found[2])
+
+    def remove_empty_packs(self):
+        """Deletes packs whose pages have all been restored or deleted; returns (count, bytes) removed."""
+        removed = removed_bytes = 0
+        for name, index in self._packs().items():
+            slots = ARCHIVE_INDEX_SLOT.iter_unpack(index[ARCHIVE_INDEX_HEADER.size:])
+            if any(state == ARCHIVE_SLOT_LIVE for _, _, _, state in slots):
+                continue
+            removed_bytes += os.path.getsize(self._path(name, ".pack"))
+            # The index goes first, so a crash in between leaves an unreferenced pack, not a broken index
+            os.remove(self._path(name, ".idx"))
+            os.remove(self._path(name, ".pack"))
+            removed += 1
+        return removed, removed_bytes
+
+    def new_pack(self):
+        return ArchivePackWriter(self.archive_dir)
+
+cold_archive = ColdArchive(ARCHIVE_DIR)
+
+# Helper functions for backups
+BLOB_STORE_LOCK_FILE = os.path.join(LOCK_DIR, ".blobs.lock")
+
+def blob_store_lock(exclusive=False):
+    """Locks the backup blob store across threads and processes.
+
+    Code that stores blobs and then references them from a manifest holds
+    the lock shared across both steps; collecting unreferenced blobs holds
+    it exclusively, so it never sees a blob whose manifest is not written yet.
+    """
+    return file_lock(BLOB_STORE_LOCK_FILE, shared=not exclusive)
+
+def collect_unreferenced_blobs(older_than):
+    """Deletes backup blobs that no manifest references. Returns (count, bytes) removed."""
+    with blob_store_lock(exclusive=True):
+        return storage.collect_unreferenced_blobs(older_than)
+
+def add_backup_entry(page_id, data, timestamp, source_mtime_ns=None):
+    """Stores content as a backup of a page taken at the given timestamp.
+
+    Returns the new entry and the number of blob bytes written.
+    """
+    started = time.perf_counter()
+    with blob_store_lock():
+        digest, written = storage.store_blob(data)
+        entry = {"timestamp": timestamp, "hash": digest, "size": len(data)}
+        if source_mtime_ns is not None:
+            # Lets the backup scheduler detect unchanged pages without reading them
+            entry["source_mtime_ns"] = source_mtime_ns
+        # A second backup within the same second replaces the first, as the old file copies did
+        entries = [e for e in storage.list_backups(page_id) if e["timestamp"] != timestamp]
+        entries.append(entry)
+        storage.save_backups(page_id, entries)
+    metrics.observe("cryptpad_backup_duration_seconds", time.perf_counter() - started)
+    metrics.observe("cryptpad_backup_size_bytes", len(data))
+    metrics.inc("cryptpad_backup_stored_bytes_total", written)
+    return entry, written
+
+def create_page_backup(page_id):
+    """Backs up the current content of a page and returns the new backup entry."""
+    restore_archived_page(page_id)
+    with page_locks.lock(page_id):
+        data, st = storage.read_page(page_id)
+        entry, _ = add_backup_entry(page_id, data, datetime.now().strftime(BACKUP_TIMESTAMP_FORMAT), st.st_mtime_ns)
+    catalog_page_backups_changed(page_id)
+    return entry
+
+def format_backup_timestamp(timestamp):
+    """Formats a manifest timestamp (YYYYMMDDHHMMSS) for display."""
+    return datetime.strptime(timestamp, BACKUP_TIMESTAMP_FORMAT).strftime("%Y-%m-%d %H:%M:%S")
+
+def list_backup_timestamps(page_id):
+    """Returns the formatted backup timestamps of a page, latest first."""
+    return [format_backup_timestamp(entry["timestamp"]) for entry in reversed(storage.list_backups(page_id))]
+
+def migrate_legacy_backups(page_id):
+    """Moves a page's legacy backup/<page_id>/<page_id>_<timestamp>.md copies into the backup store.
+
+    Returns the number of migrated files.
+    """
+    page_specific_backup_dir = os.path.join(BACKUP_DIR, page_id)
+    legacy_files = []
+    for backup_file in sorted(os.listdir(page_specific_backup_dir)):
+        if backup_file.startswith(f"{page_id}_") and backup_file.endswith(".md"):
+            timestamp = backup_file[len(page_id)+1:-3]
+            try:
+                datetime.strptime(timestamp, BACKUP_TIMESTAMP_FORMAT)
+            except ValueError:
+                logging.warning(f"Could not parse timestamp from backup file: {backup_file}")
+                continue
+            legacy_files.append((timestamp, os.path.join(page_specific_backup_dir, backup_file)))
+    if not legacy_files:
+        return 0
+
+    with page_locks.lock(page_id), blob_store_lock():
+        entries = {entry["timestamp"]: entry for entry in storage.list_backups(page_id)}
+        for timestamp, path in legacy_files:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest, _ = storage.store_blob(data)
+            entries[timestamp] = {"timestamp": timestamp, "hash": digest, "size": len(data)}
+        storage.save_backups(page_id, list(entries.values()))
+    # Only remove the copies once the manifest referencing their blobs is stored
+    for _, path in legacy_files:
+        os.remove(path)
+    return len(legacy_files)
+
+# Helper functions for the page catalog
+def page_title_from_first_line(first_line, size):
+    """Derives the admin dashboard title of a page from its first line."""
+    if first_line:
+        return first_line
+    # If file is not empty but first line is blank, use a placeholder
+    if size > 0:
+        return "[Untitled - First line blank]"
+    return "[Empty Page]"
+
+SEARCH_INDEX_MAX_BYTES = 1024 * 1024 # Only the start of very large pages is indexed for search
+SEARCH_EXCLUDED_PATTERN = re.compile(r"ENC<[^>]*(?:>|$)") # Also matches a section cut off by the size limit
+
+def page_search_text(content):
+    """Returns the plaintext of a page for the search index, without its encrypted sections."""
+    return SEARCH_EXCLUDED_PATTERN.sub(" ", content[:SEARCH_INDEX_MAX_BYTES])
+
+def read_page_search_text(page_id):
+    """Reads the start of a page and returns its plaintext for the search index."""
+    head = b""
+    if storage.page_exists(page_id):
+        chunks = storage.iter_page_chunks(page_id)
+    else:
+        chunks = cold_archive.iter_page_chunks(page_id) # Archived pages stay searchable
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SEARCH_INDEX_MAX_BYTES:
+            break
+    return page_search_text(head[:SEARCH_INDEX_MAX_BYTES].decode("utf-8", errors="ignore"))
+
+def read_page_title(page_id, size):
+    """Reads the first line of a page to use as its title."""
+    try:
+        return page_title_from_first_line(storage.read_page_first_line(page_id).strip(), size)
+    except Exception as e:
+        logging.error(f"Could not read first line for {page_id}: {e}")
+        return "[Error reading title]"
+
+class PageCatalog:
+    """Persistent index of page metadata used by the admin dashboard.
+
+    Rows are kept up to date by the routes that change pages, so listing
+    pages is an indexed query instead of a scan of all pages and backups.
+    Page IDs, titles and the plaintext of pages are also kept in an FTS5
+    full-text index (the page_search table) for the dashboard's search.
+    """
+
+    SORT_COLUMNS = {
+        "id": "page_id",
+        "title": "title COLLATE NOCASE",
+        "size": "size",
+        "modified": "mtime",
+        "status": "status",
+        "security_mode": "security_mode",
+        "backups": "backup_count",
+        "latest_backup": "latest_backup",
+    }
+
+    SEARCH_WEIGHTS = (10.0, 5.0, 1.0) # bm25 weights of the page_id, title and body columns
+
+    def __init__(self, path):
+        self.path = path
+        self._db = SQLiteConnections(path)
+        self.search_available = False
+
+    def _connect(self):
+        return self._db.get()
+
+    def init(self):
+        """Creates the catalog tables and rebuilds the catalog if it is new."""
+        is_new = not os.path.exists(self.path)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    page_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'enabled',
+                    security_mode TEXT NOT NULL DEFAULT 'prompt',
+                    backup_count INTEGER NOT NULL DEFAULT 0,
+                    latest_backup TEXT,
+                    archived INTEGER NOT NULL DEFAULT 0,
+                    checksum TEXT,
+                    restored REAL
+                )"""
+            )
+            # Columns added after the first version of the catalog
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(pages)")}
+            for column, definition in (("archived", "INTEGER NOT NULL DEFAULT 0"), ("checksum", "TEXT"), ("restored", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE pages ADD COLUMN {column} {definition}")
+            for column in ("title", "size", "mtime", "status", "security_mode", "backup_count", "latest_backup"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_pages_{column} ON pages ({column})")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_archived_mtime ON pages (archived, mtime)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS scrub_issues (
+                    page_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    detail TEXT NOT NULL,
+                    found_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_scrub_issues_page_id ON scrub_issues (page_id)")
+        search_is_new = self._init_search(conn)
+        if is_new:
+            self.rebuild()
+        elif search_is_new:
+            # Catalog from before the search index: index the existing pages once
+            with conn:
+                self._rebuild_search(conn)
+
+    def _init_search(self, conn):
+        """Creates the full-text search table; returns whether it was newly created."""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'page_search'").fetchone() is not None
+        try:
+            with conn:
+                # Rows share the rowid of the page's row in the pages table
+                conn.execute(
+                    """CREATE VIRTUAL TABLE IF NOT EXISTS page_search
+                       USING fts5(page_id, title, body, tokenize = 'unicode61', prefix = '2 3')"""
+                )
+        except sqlite3.OperationalError as e:
+            logging.warning(f"Full-text search is not available ({e}); searching page IDs and titles only.")
+            return False
+        self.search_available = True
+        return not exists
+
+    def _index_page(self, conn, page_id, title, text):
+        if not self.search_available:
+            return
+        rowid = conn.execute("SELECT rowid FROM pages WHERE page_id = ?", (page_id,)).fetchone()[0]
+        conn.execute("DELETE FROM page_search WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "INSERT INTO page_search (rowid, page_id, title, body) VALUES (?, ?, ?, ?)",
+            (rowid, page_id, page_search_text(title), text),
+        )
+
+    def _rebuild_search(self, conn):
+        if not self.search_available:
+            return
+        conn.execute("DELETE FROM page_search")
+        for row in conn.execute("SELECT rowid, page_id, title FROM pages").fetchall():
+            try:
+                text = read_page_search_text(row["page_id"])
+            except (OSError, UnicodeError) as e:
+                logging.error(f"Could not read page {row['page_id']} for the search index: {e}")
+                text = ""
+            conn.execute(
+                "INSERT INTO page_search (rowid, page_id, title, body) VALUES (?, ?, ?, ?)",
+                (row["rowid"], row["page_id"], page_search_text(row["title"]), text),
+            )
+
+    def upsert_page(self, page_id, title, size, mtime, text="", checksum=None):
+        """Records the title, size, modification time and checksum of a page, and indexes its text for search."""
+        page_status = page_statuses.get(page_id)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """INSERT INTO pages (page_id, title, size, mtime, status, security_mode, checksum)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(page_id) DO UPDATE SET
+                       title = excluded.title, size = excluded.size, mtime = excluded.mtime, checksum = excluded.checksum""",
+                (page_id, title, size, mtime, page_status["status"], page_status["security_mode"], checksum),
+            )
+            self._index_page(conn, page_id, title, text)
+
+    def add_pages(self, pages):
+        """Records newly created, empty pages given as a dict of page IDs to stat results."""
+        conn = self._connect()
+        with conn:
+            for page_id, st in pages.items():
+                title = page_title_from_first_line("", st.st_size)
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages (page_id, title, size, mtime, checksum) VALUES (?, ?, ?, ?, ?)",
+                    (page_id, title, st.st_size, st.st_mtime, compute_revision(b"")),
+                )
+                self._index_page(conn, page_id, title, "")
+
+    def update_status(self, page_id, status, security_mode):
+        """Records the status and security mode of a page."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE pages SET status = ?, security_mode = ? WHERE page_id = ?",
+                (status, security_mode, page_id),
+            )
+
+    def update_statuses(self, statuses):
+        """Records the status and security mode of many pages, given as a dict of page IDs to status entries."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE pages SET status = ?, security_mode = ? WHERE page_id = ?",
+                [(data["status"], data["security_mode"], page_id) for page_id, data in statuses.items()],
+            )
+
+    def update_backups(self, page_id, backup_count, latest_backup):
+        """Records the number of backups and the latest backup timestamp of a page."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE pages SET backup_count = ?, latest_backup = ? WHERE page_id = ?",
+                (backup_count, latest_backup, page_id),
+            )
+
+    def set_archived(self, page_ids, archived):
+        """Records whether pages are kept in the cold archive (and when they were restored from it)."""
+        restored = None if archived else time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE pages SET archived = ?, restored = COALESCE(?, restored) WHERE page_id = ?",
+                [(int(archived), restored, page_id) for page_id in page_ids],
+            )
+
+    def idle_page_ids(self, modified_before):
+        """Returns the ids of pages not in the archive and not modified (or restored) since the given time, oldest first."""
+        rows = self._connect().execute(
+            """SELECT page_id FROM pages WHERE archived = 0 AND mtime < ? AND COALESCE(restored, 0) < ?
+               ORDER BY mtime""",
+            (modified_before, modified_before),
+        )
+        return [row[0] for row in rows]
+
+    def page_checksum(self, page_id):
+        """Returns the catalog row with a page's recorded size, mtime and checksum, or None."""
+        return self._connect().execute(
+            "SELECT size, mtime, checksum, archived FROM pages WHERE page_id = ?", (page_id,)
+        ).fetchone()
+
+    def set_checksum(self, page_id, checksum):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE pages SET checksum = ? WHERE page_id = ?", (checksum, page_id))
+
+    def page_ids_after(self, page_id, limit):
+        """Returns up to ``limit`` page ids following ``page_id`` (or from the start if None), in order."""
+        rows = self._connect().execute(
+            "SELECT page_id FROM pages WHERE page_id > ? ORDER BY page_id LIMIT ?", (page_id or "", limit)
+        )
+        return [row[0] for row in rows]
+
+    def replace_scrub_issues(self, page_ids, issues):
+        """Replaces the recorded scrub issues of the given pages by new (page_id, kind, detail) issues."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM scrub_issues WHERE page_id = ?", [(page_id,) for page_id in page_ids])
+            conn.executemany(
+                "INSERT INTO scrub_issues (page_id, kind, detail, found_at) VALUES (?, ?, ?, ?)",
+                [(page_id, kind, detail, now) for page_id, kind, detail in issues],
+            )
+
+    def scrub_issues(self, limit=50):
+        """Returns the most recently found scrub issues as dicts, and the total number of issues."""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT page_id, kind, detail, found_at FROM scrub_issues ORDER BY found_at DESC, page_id LIMIT ?", (limit,)
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM scrub_issues").fetchone()[0]
+        return [dict(row) for row in rows], total
+
+    def archived_count(self):
+        """Returns the number of pages in the cold archive."""
+        return self._connect().execute("SELECT COUNT(*) FROM pages WHERE archived = 1").fetchone()[0]
+
+    def remove(self, page_id):
+        """Removes a page from the catalog."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM scrub_issues WHERE page_id = ?", (page_id,))
+            if self.search_available:
+                conn.execute("DELETE FROM page_search WHERE rowid = (SELECT rowid FROM pages WHERE page_id = ?)", (page_id,))
+            conn.execute("DELETE FROM pages WHERE page_id = ?", (page_id,))
+
+    def count(self):
+        """Returns the number of pages in the catalog."""
+        return self._connect().execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def backup_count(self):
+        """Returns the number of backups of all pages in the catalog."""
+        return self._connect().execute("SELECT COALESCE(SUM(backup_count), 0) FROM pages").fetchone()[0]
+
+    def list_pages(self, sort="id", descending=False, limit=50, offset=0):
+        """Returns one page of catalog rows as dicts, ordered by the given sort key."""
+        column = self.SORT_COLUMNS.get(sort, self.SORT_COLUMNS["id"])
+        direction = "DESC" if descending else "ASC"
+        rows = self._connect().execute(
+            f"SELECT * FROM pages ORDER BY {column} {direction}, page_id {direction} LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _search_terms(query):
+        return re.findall(r"\w+", query)
+
+    def _search_filter(self, query):
+        """Returns the FROM/WHERE clause and parameters selecting the pages that match a query."""
+        terms = self._search_terms(query)
+        if self.search_available:
+            # Every term must match, as a word or the start of a word, in any column
+            match = " ".join(f'"{term}"*' for term in terms)
+            return "pages JOIN page_search ON page_search.rowid = pages.rowid WHERE page_search MATCH ?", [match]
+        clauses, params = [], []
+        for term in terms:
+            pattern = "%" + term.replace("_", "\\_") + "%" # Terms are word characters only
+            clauses.append("(page_id LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        return "pages WHERE " + " AND ".join(clauses), params
+
+    def search_count(self, query):
+        """Returns the number of pages matching a search query."""
+        if not self._search_terms(query):
+            return 0
+        clause, params = self._search_filter(query)
+        return self._connect().execute(f"SELECT COUNT(*) FROM {clause}", params).fetchone()[0]
+
+    def search(self, query, sort=None, descending=False, limit=50, offset=0):
+        """Returns catalog rows matching a search query as dicts.
+
+        Without a sort key, the best matches come first (ranked by bm25,
+        weighting matches in the page ID over the title over the text). Rows
+        include a "snippet" of the matching text when full-text search is
+        available.
+        """
+        if not self._search_terms(query):
+            return []
+        clause, params = self._search_filter(query)
+        direction = "DESC" if descending else "ASC"
+        if sort in self.SORT_COLUMNS:
+            order = f"pages.{self.SORT_COLUMNS[sort]} {direction}, pages.page_id {direction}"
+        elif self.search_available:
+            order = "bm25(page_search, {}, {}, {}), pages.page_id".format(*self.SEARCH_WEIGHTS)
+        else:
+            order = "pages.page_id"
+        columns = "pages.*"
+        if self.search_available:
+            columns += ", snippet(page_search, 2, '', '', '...', 16) AS snippet"
+        rows = self._connect().execute(
+            f"SELECT {columns} FROM {clause} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def page_ids(self, status=None):
+        """Returns the ids of all catalogued pages, optionally only those with the given status."""
+        if status is None:
+            rows = self._connect().execute("SELECT page_id FROM pages ORDER BY page_id")
+        else:
+            rows = self._connect().execute("SELECT page_id FROM pages WHERE status = ? ORDER BY page_id", (status,))
+        return [row[0] for row in rows]
+
+    def rebuild(self):
+        """Rebuilds the catalog from the pages and backups in storage and the cold archive."""
+        statuses = load_page_statuses()
+        rows = []
+        for page_id in storage.list_page_ids():
+            st = storage.page_stat(page_id)
+            if st is None:
+                continue
+            page_status = statuses.get(page_id, DEFAULT_PAGE_STATUS)
+            backup_timestamps = list_backup_timestamps(page_id)
+            rows.append((
+                page_id,
+                read_page_title(page_id, st.st_size),
+                st.st_size,
+                st.st_mtime,
+                page_status["status"],
+                page_status["security_mode"],
+                len(backup_timestamps),
+                backup_timestamps[0] if backup_timestamps else None,
+                0,
+                None,
+            ))
+        hot_page_ids = {row[0] for row in rows}
+        for page_id, location in cold_archive.page_locations():
+            if page_id in hot_page_ids:
+                continue
+            try:
+                record = cold_archive.read_record(location)
+                first_line = next(cold_archive.iter_content(record), b"").split(b"\n", 1)[0]
+                title = page_title_from_first_line(first_line.decode("utf-8", errors="replace").strip(), record["size"])
+            except (OSError, ValueError, zlib.error) as e:
+                logging.error(f"Could not read archived page {page_id}: {e}")
+                continue
+            page_status = statuses.get(page_id, DEFAULT_PAGE_STATUS)
+            backup_timestamps = [format_backup_timestamp(entry["timestamp"]) for entry in reversed(record["backups"])]
+            rows.append((
+                page_id,
+                title,
+                record["size"],
+                record["mtime_ns"] / 1e9,
+                page_status["status"],
+                page_status["security_mode"],
+                len(backup_timestamps),
+                backup_timestamps[0] if backup_timestamps else None,
+                1,
+                None,
+            ))
+        conn = self._connect()
+        # Checksums are kept for pages that are unchanged since they were recorded
+        checksums = {
+            (row["page_id"], row["size"], row["mtime"]): row["checksum"]
+            for row in conn.execute("SELECT page_id, size, mtime, checksum FROM pages WHERE checksum IS NOT NULL")
+        }
+        rows = [row[:-1] + (checksums.get(row[:1] + row[2:4]),) for row in rows]
+        with conn:
+            conn.execute("DELETE FROM pages")
+            conn.executemany(
+                """INSERT INTO pages (page_id, title, size, mtime, status, security_mode, backup_count, latest_backup, archived, checksum)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self._rebuild_search(conn)
+        logging.info(f"Page catalog rebuilt with {len(rows)} pages.")
+        return len(rows)
+
+page_catalog = PageCatalog(PAGE_CATALOG_FILE)
+
+def catalog_page_written(page_id, content, st, checksum):
+    """Updates the catalog after a page has been written; ``checksum`` is the revision of the new content."""
+    try:
+        first_line = content.split("\n", 1)[0].strip()
+        title = page_title_from_first_line(first_line, st.st_size)
+        page_catalog.upsert_page(page_id, title, st.st_size, st.st_mtime, page_search_text(content), checksum)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Error updating catalog for page {page_id}: {e}")
+
+def catalog_page_backups_changed(page_id):
+    """Updates the catalog's backup count and latest backup for a page."""
+    try:
+        backup_timestamps = list_backup_timestamps(page_id)
+        page_catalog.update_backups(page_id, len(backup_timestamps), backup_timestamps[0] if backup_timestamps else None)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Error updating catalog backups for page {page_id}: {e}")
+
+def catalog_page_status_changed(page_id):
+    """Updates the catalog's status and security mode for a page."""
+    try:
+        page_status = page_statuses.get(page_id)
+        page_catalog.update_status(page_id, page_status["status"], page_status["security_mode"])
+    except sqlite3.Error as e:
+        logging.error(f"Error updating catalog status for page {page_id}: {e}")
+
+def catalog_page_removed(page_id):
+    """Removes a deleted page from the catalog."""
+    try:
+        page_catalog.remove(page_id)
+    except sqlite3.Error as e:
+        logging.error(f"Error removing page {page_id} from catalog: {e}")
+
+page_catalog.init()
+
+@app.cli.command("migrate-backups")
+def migrate_backups_command():
+    """Converts legacy per-file backups into the compressed, deduplicated backup store."""
+    migrated_pages = migrated_files = 0
+    for page_id in sorted(os.listdir(BACKUP_DIR)):
+        if page_id.startswith(".") or not os.path.isdir(os.path.join(BACKUP_DIR, page_id)):
+            continue
+        count = migrate_legacy_backups(page_id)
+        if count:
+            catalog_page_backups_changed(page_id)
+            migrated_pages += 1
+            migrated_files += count
+    print(f"Migrated {migrated_files} backup files of {migrated_pages} pages into the backup store.")
+
+@app.cli.command("migrate-storage")
+def migrate_storage_command():
+    """Copies pages, statuses and backups from the file layout into the SQLite database."""
+    if isinstance(storage, WriteBehindStorage) and storage.name == "file":
+        storage.flush_due(flush_all=True)
+    source = FileStorage(DATA_DIR, BACKUP_DIR)
+    target = SQLiteStorage(SQLITE_DATABASE)
+    page_count = backup_count = 0
+    for page_id in source.list_page_ids():
+        data, st = source.read_page(page_id)
+        target.import_page(page_id, data, st.st_mtime_ns)
+        page_count += 1
+    target.statuses.replace(source.statuses.all())
+    for page_id in source.backup_page_ids():
+        entries = source.list_backups(page_id)
+        for entry in entries:
+            data = b"".join(source.iter_blob(entry["hash"]))
+            digest, _ = target.store_blob(data)
+            if digest != entry["hash"]:
+                raise click.ClickException(f"Backup blob {entry['hash']} of page '{page_id}' is corrupted.")
+        target.save_backups(page_id, entries)
+        backup_count += len(entries)
+    print(f"Copied {page_count} pages and {backup_count} backups into {SQLITE_DATABASE}.")
+    print("Set STORAGE_BACKEND=sqlite to use it. The original files were left untouched.")
+
+@app.cli.command("flush-journal")
+def flush_journal_command():
+    """Writes all journaled saves to their pages (e.g. before reading data/ with other tools)."""
+    if not isinstance(storage, WriteBehindStorage):
+        print("Write-behind saves are disabled (SAVE_COALESCE_SECONDS=0); nothing to flush.")
+        return
+    count = storage.flush_due(flush_all=True)
+    print(f"Wrote the journaled saves of {count} pages.")
+
+@app.cli.command("rebuild-catalog")
+def rebuild_catalog_command():
+    """Rebuilds the admin page catalog from the pages in storage."""
+    count = page_catalog.rebuild()
+    print(f"Page catalog rebuilt with {count} pages.")
+
+# Archiving inactive pages
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "0")) # 0 disables archiving in scheduled backup runs
+ARCHIVE_LOCK_FILE = os.path.join(LOCK_DIR, ".archive.lock")
+# Held exclusively while pages move from storage into a new pack and shared by restores,
+# so a restore never finds a page both in storage and in a pack that is still being committed
+ARCHIVE_MOVE_LOCK_FILE = os.path.join(LOCK_DIR, ".archive-move.lock")
+
+def catalog_pages_archived(page_ids, archived):
+    """Records in the catalog that pages were moved into or out of the cold archive."""
+    try:
+        page_catalog.set_archived(page_ids, archived)
+    except sqlite3.Error as e:
+        logging.error(f"Error updating catalog archive flags of {len(page_ids)} pages: {e}")
+
+def archive_pages_into_pack(page_ids, modified_before, stats):
+    """Writes the given idle pages and their backups into one new pack, then removes them from storage."""
+    writer = cold_archive.new_pack()
+    snapshots = {}
+    try:
+        for page_id in page_ids:
+            with page_locks.lock(page_id):
+                st = storage.page_stat(page_id)
+                if st is None or st.st_mtime >= modified_before: # Deleted or saved since the catalog was read
+                    stats["pages_skipped"] += 1
+                    continue
+                backups = storage.list_backups(page_id)
+                writer.add_page(page_id, storage.iter_page_chunks(page_id), st, backups, storage.iter_blob)
+                snapshots[page_id] = (stat_stamp(st), backups)
+        if not snapshots:
+            writer.abort()
+            return
+    except BaseException:
+        writer.abort()
+        raise
+
+    archived = []
+    with file_lock(ARCHIVE_MOVE_LOCK_FILE):
+        try:
+            pack = writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        stats["packs_written"] += 1
+
+        # Only now that the pack is durable are the loose copies removed
+        for page_id, (stamp, backups) in snapshots.items():
+            with page_locks.lock(page_id):
+                st = storage.page_stat(page_id)
+                if st is None or stat_stamp(st) != stamp or storage.list_backups(page_id) != backups:
+                    # Changed while the pack was written: the page stays in storage
+                    cold_archive.discard(page_id, pack=pack)
+                    stats["pages_skipped"] += 1
+                    continue
+                storage.delete_page(page_id)
+                storage.delete_backups(page_id)
+                cold_archive.discard(page_id, keep=pack) # Copies left in older packs, e.g. by a crash
+            page_revisions.forget(page_id)
+            page_token_index.forget(page_id)
+            archived.append(page_id)
+    catalog_pages_archived(archived, True)
+    metrics.inc("cryptpad_pages_archived_total", len(archived))
+    stats["pages_archived"] += len(archived)
+
+def archive_idle_pages(idle_days):
+    """Moves pages not modified for ``idle_days`` days, with their backups, into the cold archive.
+
+    Returns the run's stats.
+    """
+    started = time.time()
+    stats = {
+        "started_at": datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+        "pages_archived": 0, "pages_skipped": 0, "packs_written": 0, "packs_removed": 0,
+        "blobs_removed": 0, "bytes_freed": 0,
+    }
+    # Only one run at a time, across processes
+    modified_before = started - idle_days * 86400
+    with file_lock(ARCHIVE_LOCK_FILE):
+        page_ids = page_catalog.idle_page_ids(modified_before)
+        for start in range(0, len(page_ids), ARCHIVE_PACK_MAX_PAGES):
+            archive_pages_into_pack(page_ids[start:start + ARCHIVE_PACK_MAX_PAGES], modified_before, stats)
+        if stats["pages_archived"]:
+            stats["blobs_removed"], stats["bytes_freed"] = collect_unreferenced_blobs(started)
+        stats["packs_removed"], freed = cold_archive.remove_empty_packs()
+        stats["bytes_freed"] += freed
+    stats["duration_seconds"] = round(time.time() - started, 3)
+    logging.info(f"Archive run finished: {stats}")
+    return stats
+
+def restore_archived_page(page_id):
+    """Moves an archived page and its backups back into storage, keeping its modification time.
+
+    Returns whether the page exists afterwards; False if it is neither
+    archived nor in storage. Callers check first that the page is not
+    disabled for the current user.
+    """
+    if not cold_archive.contains(page_id): # Checked before locking, so unknown IDs are cheap
+        return storage.page_exists(page_id)
+    with file_lock(ARCHIVE_MOVE_LOCK_FILE, shared=True), page_locks.lock(page_id):
+        location = cold_archive.lookup(page_id)
+        if location is None: # Restored by another request meanwhile
+            return storage.page_exists(page_id)
+        if storage.page_exists(page_id): # Stale copy, e.g. from an interrupted run
+            cold_archive.discard(page_id)
+            return True
+        record = cold_archive.read_record(location)
+        with blob_store_lock():
+            for digest in record["blobs"]:
+                stored_digest, _ = storage.store_blob(b"".join(cold_archive.iter_blob(record, digest)))
+                if stored_digest != digest:
+                    raise OSError(f"Archived backup {digest} of page '{page_id}' is corrupted.")
+            if record["backups"]:
+                entries = {entry["timestamp"]: entry for entry in record["backups"]}
+                entries.update((entry["timestamp"], entry) for entry in storage.list_backups(page_id))
+                storage.save_backups(page_id, list(entries.values()))
+        data = b"".join(cold_archive.iter_content(record))
+        st = storage.import_page(page_id, data, record["mtime_ns"])
+        revision = page_revisions.remember(page_id, st, data)
+        cold_archive.discard(page_id)
+    catalog_pages_archived([page_id], False)
+    catalog_page_written(page_id, data.decode("utf-8"), st, revision)
+    catalog_page_backups_changed(page_id)
+    metrics.inc("cryptpad_pages_restored_total")
+    logging.info(f"Restored page {page_id} from the archive.")
+    return True
+
+def page_available(page_id):
+    """Returns whether a page exists, restoring it from the cold archive first if it was archived."""
+    return storage.page_exists(page_id) or restore_archived_page(page_id)
+
+def page_exists_or_archived(page_id):
+    """Returns whether a page exists in storage or in the cold archive, without restoring it."""
+    return storage.page_exists(page_id) or cold_archive.contains(page_id)
+
+@app.cli.command("archive-pages")
+@click.option("--days", type=float, default=ARCHIVE_AFTER_DAYS or None, help="Archive pages not modified for this many days (default: ARCHIVE_AFTER_DAYS).")
+def archive_pages_command(days):
+    """Moves inactive pages and their backups into compressed archive packs."""
+    if not days or days <= 0:
+        raise click.UsageError("Set ARCHIVE_AFTER_DAYS or pass --days.")
+    stats = archive_idle_pages(days)
+    print(json.dumps(stats, indent=4))
+
+# Scheduled backups
+BACKUP_INTERVAL_SECONDS = int(os.environ.get("BACKUP_INTERVAL_SECONDS", "0")) # 0 disables the scheduler
+BACKUP_SPREAD_SECONDS = float(os.environ.get("BACKUP_SPREAD_SECONDS", str(BACKUP_INTERVAL_SECONDS / 2)))
+BACKUP_KEEP_HOURLY = int(os.environ.get("BACKUP_KEEP_HOURLY", "24"))
+BACKUP_KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", "7"))
+BACKUP_KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", "4"))
+BACKUP_SCHEDULER_LOCK_FILE = os.path.join(BACKUP_DIR, ".scheduler.lock")
+
+def select_backups_to_keep(entries, keep_hourly, keep_daily, keep_weekly):
+    """Returns the timestamps retained by an hourly/daily/weekly retention policy.
+
+    For each period the newest backup is kept, for the given number of most
+    recent periods. The newest backup overall is always kept.
+    """
+    newest_first = sorted(entries, key=lambda entry: entry["timestamp"], reverse=True)
+    keep = set()
+    if newest_first:
+        keep.add(newest_first[0]["timestamp"])
+
+    def period_key(kind, timestamp):
+        if kind == "hourly":
+            return timestamp[:10]
+        if kind == "daily":
+            return timestamp[:8]
+        year, week, _ = datetime.strptime(timestamp, BACKUP_TIMESTAMP_FORMAT).isocalendar()
+        return (year, week)
+
+    for kind, limit in (("hourly", keep_hourly), ("daily", keep_daily), ("weekly", keep_weekly)):
+        seen = set()
+        for entry in newest_first:
+            if len(seen) >= limit:
+                break
+            key = period_key(kind, entry["timestamp"])
+            if key not in seen:
+                seen.add(key)
+                keep.add(entry["timestamp"])
+    return keep
+
+class BackupScheduler:
+    """Background thread that periodically backs up changed pages and prunes old backups.
+
+    Pages are processed one at a time with a pause between them, so a run
+    is spread over ``spread`` seconds instead of reading every page at once.
+    """
+
+    def __init__(self, interval, spread, keep_hourly, keep_daily, keep_weekly):
+        self.interval = interval
+        self.spread = min(spread, interval) if interval else spread
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.runs = collections.deque(maxlen=20) # Stats of recent runs, newest last
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def start(self):
+        """Starts the scheduler thread unless another process already runs one."""
+        if self._thread is not None or not self._acquire_process_lock():
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="backup-scheduler", daemon=True)
+        self._thread.start()
+        logging.info(f"Backup scheduler started (interval {self.interval}s).")
+
+    def stop(self):
+        self._stop.set()
+
+    def _acquire_process_lock(self):
+        # With several worker processes only one of them runs the scheduler
+        if fcntl is None:
+            return True
+        lock_file = open(BACKUP_SCHEDULER_LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Scheduled backup run failed.")
+
+    def run_once(self, pace=True):
+        """Backs up all changed pages, applies retention and returns the run's stats."""
+        started = time.time()
+        stats = {
+            "started_at": datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+            "pages_scanned": 0, "pages_backed_up": 0, "pages_unchanged": 0, "errors": 0,
+            "backups_pruned": 0, "blobs_removed": 0,
+            "bytes_read": 0, "bytes_written": 0, "bytes_freed": 0,
+        }
+        page_ids = page_catalog.page_ids()
+        delay = self.spread / len(page_ids) if pace and page_ids else 0
+        for page_id in page_ids:
+            if self._stop.is_set():
+                break
+            stats["pages_scanned"] += 1
+            try:
+                with page_locks.lock(page_id):
+                    self._process_page(page_id, stats)
+            except Exception as e:
+                stats["errors"] += 1
+                logging.error(f"Scheduled backup of page {page_id} failed: {e}")
+            if delay:
+                self._stop.wait(delay)
+        if stats["backups_pruned"]:
+            stats["blobs_removed"], stats["bytes_freed"] = collect_unreferenced_blobs(started)
+        if ARCHIVE_AFTER_DAYS > 0 and not self._stop.is_set():
+            stats["archive"] = archive_idle_pages(ARCHIVE_AFTER_DAYS)
+        stats["duration_seconds"] = round(time.time() - started, 3)
+        self.runs.append(stats)
+        logging.info(f"Scheduled backup run finished: {stats}")
+        return stats
+
+    def _process_page(self, page_id, stats):
+        entries = storage.list_backups(page_id)
+        latest = entries[-1] if entries else None
+        st = storage.page_stat(page_id)
+        if st is None:
+            return
+        changed = True
+        if latest and latest.get("source_mtime_ns") == st.st_mtime_ns and latest["size"] == st.st_size:
+            changed = False
+        else:
+            data, st = storage.read_page(page_id)
+            stats["bytes_read"] += len(data)
+            if latest and latest["hash"] == hashlib.sha256(data).hexdigest():
+                # Same content with a new mtime: remember the mtime so it is not re-read next run
+                latest["source_mtime_ns"] = st.st_mtime_ns
+                storage.save_backups(page_id, entries)
+                changed = False
+
+        if changed:
+            _, written = add_backup_entry(page_id, data, datetime.now().strftime(BACKUP_TIMESTAMP_FORMAT), st.st_mtime_ns)
+            stats["bytes_written"] += written
+            stats["pages_backed_up"] += 1
+            entries = storage.list_backups(page_id)
+        else:
+            stats["pages_unchanged"] += 1
+
+        keep = select_backups_to_keep(entries, self.keep_hourly, self.keep_daily, self.keep_weekly)
+        kept_entries = [entry for entry in entries if entry["timestamp"] in keep]
+        if len(kept_entries) != len(entries):
+            storage.save_backups(page_id, kept_entries)
+            stats["backups_pruned"] += len(entries) - len(kept_entries)
+        if changed or len(kept_entries) != len(entries):
+            catalog_page_backups_changed(page_id)
+
+backup_scheduler = BackupScheduler(
+    BACKUP_INTERVAL_SECONDS, BACKUP_SPREAD_SECONDS,
+    BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY,
+)
+
+_background_services_pid = None
+
+@app.before_request
+def start_background_services():
+    """Starts background threads once in each (possibly forked) worker process."""
+    global _background_services_pid
+    if _background_services_pid == os.getpid():
+        return
+    _background_services_pid = os.getpid()
+    if BACKUP_INTERVAL_SECONDS > 0:
+        backup_scheduler.start()
+    if isinstance(storage, WriteBehindStorage):
+        storage.start()
+    if SCRUB_INTERVAL_SECONDS > 0:
+        integrity_scrubber.start()
+
+@app.cli.command("run-backups")
+def run_backups_command():
+    """Runs one scheduled backup pass (changed pages + retention) immediately."""
+    stats = backup_scheduler.run_once(pace=False)
+    print(json.dumps(stats, indent=4))
+
+# Integrity scrubbing
+SCRUB_INTERVAL_SECONDS = int(os.environ.get("SCRUB_INTERVAL_SECONDS", "0")) # 0 disables scheduled scrubs
+SCRUB_WORKERS = int(os.environ.get("SCRUB_WORKERS", "4"))
+SCRUB_MAX_BYTES_PER_SECOND = float(os.environ.get("SCRUB_MAX_BYTES_PER_SECOND", str(20 * 1024 * 1024))) # 0: unthrottled
+SCRUB_BATCH_PAGES = 200 # Pages verified between two saves of the resume position
+SCRUB_MAX_TOKEN_PROBLEMS = 5 # Broken ENC tokens listed per page
+SCRUB_STATE_FILE = os.path.join(DATA_DIR, ".scrub_state.json")
+SCRUB_LOCK_FILE = os.path.join(LOCK_DIR, ".scrub.lock")
+ENC_TOKEN_SCRUB_PATTERN = re.compile(r"ENC<[^>]*>?") # Also matches tokens missing their closing '>'
+
+class IoBudget:
+    """Paces the reads of several threads to at most ``rate`` bytes per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, nbytes):
+        """Accounts for bytes just read, sleeping while the budget is exceeded."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + nbytes / self.rate
+            delay = self._next - now
+        time.sleep(delay)
+
+def find_enc_token_problems(text):
+    """Returns descriptions of the ENC tokens in content that the editor could not decrypt."""
+    problems = []
+    for number, match in enumerate(ENC_TOKEN_SCRUB_PATTERN.finditer(text), 1):
+        try:
+            parse_enc_token(match.group())
+        except ValueError as e:
+            problems.append(f"section #{number}: {e}")
+    if len(problems) > SCRUB_MAX_TOKEN_PROBLEMS:
+        problems[SCRUB_MAX_TOKEN_PROBLEMS:] = [f"and {len(problems) - SCRUB_MAX_TOKEN_PROBLEMS} more"]
+    return problems
+
+def check_content(data, prefix=""):
+    """Checks that content is UTF-8 with decryptable ENC tokens; returns (kind, detail) issues."""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return [("invalid_utf8", f"{prefix}Invalid UTF-8 at byte {e.start}.")]
+    problems = find_enc_token_problems(text)
+    if problems:
+        return [("bad_enc_token", f"{prefix}Encrypted sections that cannot be decrypted: {'; '.join(problems)}.")]
+    return []
+
+def check_page_checksum(page_id, checksum, st):
+    """Compares a page's checksum with the one recorded in the catalog; returns an issue or None.
+
+    ``st`` is the stat result the content was read with (None for archived
+    pages). A missing checksum (e.g. after a catalog rebuild) is recorded.
+    """
+    row = page_catalog.page_checksum(page_id)
+    if row is None or row["checksum"] == checksum:
+        return None
+    # Saves update the page and its checksum under the page's lock
+    with page_locks.lock(page_id):
+        row = page_catalog.page_checksum(page_id)
+        if row is None or row["checksum"] == checksum:
+            return None
+        if st is not None:
+            current = storage.page_stat(page_id)
+            if current is None or stat_stamp(current) != stat_stamp(st):
+                return None # Saved or deleted while it was read; checked again next pass
+        if row["checksum"] is None:
+            page_catalog.set_checksum(page_id, checksum)
+            return None
+        if st is not None and (row["size"] != st.st_size or row["mtime"] != st.st_mtime):
+            # Written outside the application: report once, then verify against the new content
+            page_catalog.set_checksum(page_id, checksum)
+            return ("changed_outside", f"Content changed without a save by the application ({row['size']} -> {st.st_size} bytes).")
+    return ("checksum_mismatch", f"Content does not match the checksum recorded when it was saved ({row['checksum'][:12]}...).")
+
+def scrub_page(page_id, budget, verified_blobs, blob_lock):
+    """Verifies a page's content and checksum and its backup blobs.
+
+    Backup blobs in ``verified_blobs`` are skipped; verified ones are added.
+    Returns a list of (page_id, kind, detail) issues and a dict of stats.
+    """
+    issues = []
+    stats = {"pages": 0, "backups": 0, "bytes": 0}
+
+    def read_all(chunks):
+        parts = []
+        for chunk in chunks:
+            budget.consume(len(chunk))
+            parts.append(chunk)
+        data = b"".join(parts)
+        stats["bytes"] += len(data)
+        return data
+
+    try:
+        if isinstance(storage, WriteBehindStorage):
+            # Journaled saves are cataloged when written, so write them before checking the checksum
+            storage.flush(page_id)
+        st = storage.page_stat(page_id)
+        if st is not None:
+            chunks, backups, iter_blob = storage.iter_page_chunks(page_id), storage.list_backups(page_id), storage.iter_blob
+        else:
+            location = cold_archive.lookup(page_id)
+            if location is None: # Deleted meanwhile
+                return issues, stats
+            record = cold_archive.read_record(location)
+            chunks, backups, iter_blob = cold_archive.iter_content(record), record["backups"], partial(cold_archive.iter_blob, record)
+
+        try:
+            data = read_all(chunks)
+        except FileNotFoundError: # Deleted meanwhile
+            return issues, stats
+        except (OSError, zlib.error) as e:
+            issues.append((page_id, "unreadable", f"Could not read the page: {e}"))
+        else:
+            stats["pages"] += 1
+            issue = check_page_checksum(page_id, compute_revision(data), st)
+            if issue:
+                issues.append((page_id,) + issue)
+            issues.extend((page_id,) + issue for issue in check_content(data))
+
+        for entry in backups:
+            digest = entry["hash"]
+            with blob_lock:
+                if digest in verified_blobs:
+                    continue
+                verified_blobs.add(digest)
+            stats["backups"] += 1
+            prefix = f"Backup {format_backup_timestamp(entry['timestamp'])}: "
+            try:
+                data = read_all(iter_blob(digest))
+            except (OSError, zlib.error) as e:
+                issues.append((page_id, "backup_unreadable", f"{prefix}{e}"))
+                continue
+            if compute_revision(data) != digest or len(data) != entry["size"]:
+                issues.append((page_id, "backup_corrupt", f"{prefix}Content does not match its checksum."))
+                continue
+            issues.extend((page_id,) + issue for issue in check_content(data, prefix))
+    except Exception as e:
+        logging.exception(f"Error scrubbing page {page_id}")
+        issues.append((page_id, "error", str(e)))
+    return issues, stats
+
+class IntegrityScrubber:
+    """Re-verifies all pages and backups in the background, in page ID order.
+
+    Pages are verified in batches on a thread pool, with reads paced by an
+    I/O budget. After each batch the position is saved to
+    SCRUB_STATE_FILE, so a pass interrupted by a restart resumes where it
+    stopped. Only one process runs a pass at a time. Issues found are
+    stored in the catalog and shown on the admin dashboard.
+    """
+
+    def __init__(self, interval, workers, max_bytes_per_second):
+        self.interval = interval
+        self.workers = max(workers, 1)
+        self.max_bytes_per_second = max_bytes_per_second
+        self._stop = threading.Event()
+        self._thread = None
+        self._pass_thread = None
+
+    def load_state(self):
+        """Returns the saved state of the current or last pass ({} if there was none)."""
+        try:
+            with open(SCRUB_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logging.error(f"Error loading scrub state: {e}")
+            return {}
+
+    def _save_state(self, state):
+        atomic_write_bytes(SCRUB_STATE_FILE, json.dumps(state, indent=4).encode("utf-8"))
+
+    def start(self):
+        """Starts the thread that runs or resumes a pass every ``interval`` seconds."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run_loop, name="integrity-scrubber", daemon=True)
+        self._thread.start()
+        logging.info(f"Integrity scrubber started (interval {self.interval}s).")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_loop(self):
+        while not self._stop.wait(self.interval):
+            self._run_logged()
+
+    def _run_logged(self):
+        try:
+            self.run_once()
+        except Exception:
+            logging.exception("Integrity scrub failed.")
+
+    @property
+    def running(self):
+        """Whether this process is running a pass started from the admin dashboard."""
+        return self._pass_thread is not None and self._pass_thread.is_alive()
+
+    def start_pass(self):
+        """Runs or resumes a pass in a background thread; returns False if one is already running here."""
+        if self.running:
+            return False
+        self._pass_thread = threading.Thread(target=self._run_logged, name="integrity-scrub-pass", daemon=True)
+        self._pass_thread.start()
+        return True
+
+    def run_once(self, restart=False):
+        """Runs or resumes a pass; returns its state, or None if another process is running one."""
+        with open(SCRUB_LOCK_FILE, "a") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            return self._run_pass(restart)
+
+    def _run_pass(self, restart):
+        state = self.load_state()
+        if restart or not state or state.get("finished_at"):
+            state = {
+                "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "finished_at": None,
+                "cursor": None, # Last page ID verified
+                "stats": {"pages": 0, "backups": 0, "bytes": 0, "issues": 0},
+            }
+        else:
+            logging.info(f"Resuming integrity scrub after page {state['cursor']}.")
+        budget = IoBudget(self.max_bytes_per_second)
+        verified_blobs, blob_lock = set(), threading.Lock()
+        verify = partial(scrub_page, budget=budget, verified_blobs=verified_blobs, blob_lock=blob_lock)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scrub") as pool:
+            while not self._stop.is_set():
+                page_ids = page_catalog.page_ids_after(state["cursor"], SCRUB_BATCH_PAGES)
+                if not page_ids:
+                    state["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    break
+                issues = []
+                for page_issues, page_stats in pool.map(verify, page_ids):
+                    issues.extend(page_issues)
+                    for key, value in page_stats.items():
+                        state["stats"][key] += value
+                page_catalog.replace_scrub_issues(page_ids, issues)
+                state["stats"]["issues"] += len(issues)
+                state["cursor"] = page_ids[-1]
+                state["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self._save_state(state)
+        self._save_state(state)
+        if state["finished_at"]:
+            logging.info(f"Integrity scrub finished: {state['stats']}")
+        return state
+
+integrity_scrubber = IntegrityScrubber(SCRUB_INTERVAL_SECONDS, SCRUB_WORKERS, SCRUB_MAX_BYTES_PER_SECOND)
+
+@app.cli.command("scrub")
+@click.option("--restart", is_flag=True, help="Start a new pass instead of resuming an interrupted one.")
+def scrub_command(restart):
+    """Verifies the checksums and encrypted sections of all pages and backups."""
+    state = integrity_scrubber.run_once(restart=restart)
+    if state is None:
+        raise click.ClickException("Another process is running an integrity scrub.")
+    print(json.dumps(state, indent=4))
+    issues, total = page_catalog.scrub_issues(limit=20)
+    for issue in issues:
+        print(f"{issue['page_id']}: {issue['kind']}: {issue['detail']}")
+    if total > len(issues):
+        print(f"... and {total - len(issues)} more issues.")
+
+# Random page IDs
+PAGE_ID_ALPHABET = string.ascii_lowercase
+PAGE_ID_MIN_LENGTH = 4
+PAGE_ID_MAX_OCCUPANCY = float(os.environ.get("PAGE_ID_MAX_OCCUPANCY", 0.5))
+MAX_BULK_CREATE_PAGES = int(os.environ.get("MAX_BULK_CREATE_PAGES", 10000))
+
+class PageIdAllocator:
+    """Hands out random, unused page IDs without probing storage.
+
+    IDs in use (pages, leftover backups and statuses, reserved routes) are
+    loaded once into memory. Random IDs start at ``min_length`` letters and
+    grow by one letter whenever more than ``max_occupancy`` of the IDs of
+    the current length are taken, so a candidate is free with probability
+    of at least 1 - max_occupancy. IDs are never handed out twice by one
+    process; pages created by other processes are caught by the exclusive
+    create in storage.
+    """
+
+    def __init__(self, min_length=PAGE_ID_MIN_LENGTH, max_occupancy=PAGE_ID_MAX_OCCUPANCY):
+        self.min_length = min_length
+        self.max_occupancy = max_occupancy
+        self._lock = threading.Lock()
+        self._used = None
+        self._counts = collections.Counter() # Taken all-letter IDs per length
+
+    def _load(self):
+        if self._used is not None:
+            return
+        self._used = set()
+        self._counts.clear()
+        for page_id in RESERVED_ROUTES:
+            self._add(page_id)
+        for page_id in storage.list_page_ids():
+            self._add(page_id)
+        for page_id in storage.backup_page_ids():
+            self._add(page_id)
+        for page_id, _ in cold_archive.page_locations():
+            self._add(page_id)
+        for page_id in storage.statuses.all():
+            self._add(page_id)
+
+    def _add(self, page_id):
+        if page_id in self._used:
+            return
+        self._used.add(page_id)
+        if re.fullmatch(r"[a-z]+", page_id):
+            self._counts[len(page_id)] += 1
+
+    def _current_length(self):
+        length = self.min_length
+        while self._counts[length] >= self.max_occupancy * len(PAGE_ID_ALPHABET) ** length:
+            length += 1
+        return length
+
+    def allocate(self, count=1):
+        """Returns ``count`` distinct random IDs that are not in use."""
+        with self._lock:
+            self._load()
+            page_ids = []
+            for _ in range(count):
+                length = self._current_length()
+                page_id = "".join(secrets.choice(PAGE_ID_ALPHABET) for _ in range(length))
+                while page_id in self._used:
+                    page_id = "".join(secrets.choice(PAGE_ID_ALPHABET) for _ in range(length))
+                self._add(page_id)
+                page_ids.append(page_id)
+            return page_ids
+
+    def reserve(self, page_id):
+        """Marks an ID chosen by someone else (e.g. a custom page ID) as used."""
+        with self._lock:
+            if self._used is not None:
+                self._add(page_id)
+
+page_id_allocator = PageIdAllocator()
+
+def create_random_pages(count):
+    """Creates ``count`` empty pages with random IDs and returns their IDs."""
+    created = {}
+    while len(created) < count:
+        # IDs taken by another process in the meantime are skipped by storage and re-drawn
+        created.update(storage.create_pages(page_id_allocator.allocate(count - len(created))))
+    try:
+        page_catalog.add_pages(created)
+    except sqlite3.Error as e:
+        logging.error(f"Error adding {len(created)} new pages to catalog: {e}")
+    return list(created)
 
 def is_valid_custom_page_id(page_id):
     """Checks if a custom page ID is valid (3-20 chars, a-z, 0-9, _)."""
@@ -120,7 +2901,7 @@ def is_valid_custom_page_id(page_id):
 
 RESERVED_ROUTES = ["admin", "static", "admin_login", "admin_logout", "admin_panel", 
                    "delete_page", "backup_page", "toggle_status", "download_page", 
-                   "admin_create_page", "save", "load"] # Add any other top-level or critical route segments
+                   "admin_create_page", "export", "backup_runs", "metrics", "save", "load", "events", "blobs", "assets"] # Add any other top-level or critical route segments
 
 @app.route("/")
 def index():
@@ -161,61 +2942,78 @@ def admin_logout():
 @app.route("/admin")
 @login_required
 def admin_panel():
-    """Serves the admin dashboard page, listing existing pages."""
+    """Serves the admin dashboard page, listing existing pages from the catalog.
+
+    With a search query (``q``), only matching pages are listed, best
+    matches first unless a sort key is chosen.
+    """
+    query = request.args.get("q", "").strip()
+    sort = request.args.get("sort", "relevance" if query else "id")
+    if sort not in PageCatalog.SORT_COLUMNS and not (query and sort == "relevance"):
+        sort = "id"
+    order = "desc" if request.args.get("order") == "desc" else "asc"
+    per_page = min(max(request.args.get("per_page", ADMIN_PAGES_PER_PAGE, type=int), 1), 500)
+    total_pages = page_catalog.search_count(query) if query else page_catalog.count()
+    page_count = max((total_pages + per_page - 1) // per_page, 1)
+    current_page = min(max(request.args.get("page", 1, type=int), 1), page_count)
+
+    offset = (current_page - 1) * per_page
+    if query:
+        rows = page_catalog.search(query, sort, order == "desc", per_page, offset)
+    else:
+        rows = page_catalog.list_pages(sort, order == "desc", per_page, offset)
     pages = []
-    for filename in os.listdir(DATA_DIR):
-        if filename.endswith(".md"):
-            page_id = filename[:-3]
-            page_file_path = os.path.join(DATA_DIR, filename)
-            first_line = "[Empty Page]" # Default title
-            try:
-                with open(page_file_path, "r", encoding="utf-8") as f:
-                    first_line_read = f.readline().strip()
-                    if first_line_read:
-                        first_line = first_line_read
-                    # If file is not empty but first line is blank, it remains "[Empty Page]" or we can set another placeholder
-                    elif os.path.getsize(page_file_path) > 0 and not first_line_read:
-                        first_line = "[Untitled - First line blank]"
+    for row in rows:
+        pages.append({
+            "id": row["page_id"],
+            "name": row["page_id"],
+            "title": row["title"],
+            "size": row["size"],
+            "modified": datetime.fromtimestamp(row["mtime"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "status": row["status"],
+            "security_mode": row["security_mode"],
+            "backup_count": row["backup_count"],
+            "latest_backup": row["latest_backup"],
+            "snippet": (row.get("snippet") or "").strip(),
+            "archived": bool(row["archived"]),
+        })
 
-            except Exception as e:
-                logging.error(f"Could not read first line for {page_id}: {e}")
-                first_line = "[Error reading title]"
-
-            page_data = {
-                "id": page_id,
-                "name": page_id,
-                "title": first_line,
-                "status": get_page_status(page_id),
-                "security_mode": get_page_security_mode(page_id)
-            }
-            
-            # Get backup timestamps
-            page_specific_backup_dir = os.path.join(BACKUP_DIR, page_id)
-            backup_timestamps = []
-            if os.path.exists(page_specific_backup_dir):
-                for backup_file in sorted(os.listdir(page_specific_backup_dir), reverse=True): # Sort to get latest first
-                    if backup_file.startswith(f"{page_id}_") and backup_file.endswith(".md"):
-                        try:
-                            # Extract timestamp string: pageid_YYYYMMDDHHMMSS.md
-                            timestamp_str = backup_file[len(page_id)+1:-3]
-                            dt_obj = datetime.strptime(timestamp_str, "%Y%m%d%H%M%S")
-                            backup_timestamps.append(dt_obj.strftime("%Y-%m-%d %H:%M:%S"))
-                        except ValueError:
-                            # Handle cases where filename format might be unexpected
-                            logging.warning(f"Could not parse timestamp from backup file: {backup_file}")
-            page_data["backups"] = backup_timestamps # List of formatted timestamps
-            pages.append(page_data)
-            
-    return render_template("admin.html", pages=pages)
+    scrub_issues, scrub_issue_count = page_catalog.scrub_issues(limit=20)
+    scrub = {
+        "state": integrity_scrubber.load_state(),
+        "running": integrity_scrubber.running,
+        "issues": scrub_issues,
+        "issue_count": scrub_issue_count,
+    }
+
+    pagination = {
+        "page": current_page,
+        "page_count": page_count,
+        "per_page": per_page,
+        "total": total_pages,
+        "sort": sort,
+        "order": order,
+        "q": query,
+    }
+    return render_template("admin.html", pages=pages, pagination=pagination, scrub=scrub)
+
+def remove_page(page_id):
+    """Deletes a page's content and catalog entry (but not its status or backups)."""
+    restore_archived_page(page_id) # Keeps the backups of an archived page, as for other pages
+    with page_locks.lock(page_id):
+        storage.delete_page(page_id)
+    catalog_page_removed(page_id)
+    page_revisions.forget(page_id)
+    page_token_index.forget(page_id)
+    page_events.publish(page_id, "deleted", {})
 
 @app.route("/admin/delete_page/<page_id>", methods=["POST"])
 @login_required
 def delete_page(page_id):
     """Deletes a page (but not its backups)."""
-    file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-    if os.path.exists(file_path):
+    if page_exists_or_archived(page_id):
         try:
-            os.remove(file_path)
+            remove_page(page_id)
             remove_page_status(page_id) # Remove status on delete
             flash(f"Page '{page_id}' deleted successfully.", "success")
         except OSError as e:
@@ -228,36 +3026,63 @@ def delete_page(page_id):
 @login_required
 def backup_page(page_id):
     """Creates a timestamped backup of a page."""
-    source_file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-    
-    if not os.path.exists(source_file_path):
+    if not page_available(page_id):
         flash(f"Page '{page_id}' not found. Cannot create backup.", "warning")
         return redirect(url_for("admin_panel"))
 
-    # Ensure backup directory for the page exists (e.g. backup/eppa/)
-    # This helps organize backups per page.
-    page_specific_backup_dir = os.path.join(BACKUP_DIR, page_id)
-    if not os.path.exists(page_specific_backup_dir):
-        try:
-            os.makedirs(page_specific_backup_dir)
-        except OSError as e:
-            flash(f"Error creating backup directory for page '{page_id}': {e}", "danger")
-            return redirect(url_for("admin_panel"))
-        
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    # Backup filename will be like: pagename_timestamp.md, e.g., eppa_20230101120000.md
-    # Stored inside backup/pagename/
-    backup_filename = f"{page_id}_{timestamp}.md" 
-    backup_file_path = os.path.join(page_specific_backup_dir, backup_filename)
-    
     try:
-        shutil.copy2(source_file_path, backup_file_path) # copy2 preserves metadata
-        flash(f"Backup for page '{page_id}' created successfully: {backup_filename}", "success")
+        entry = create_page_backup(page_id)
+        flash(f"Backup for page '{page_id}' created successfully: {format_backup_timestamp(entry['timestamp'])}", "success")
     except Exception as e:
         flash(f"Error creating backup for page '{page_id}': {e}", "danger")
         
     return redirect(url_for("admin_panel"))
 
+@app.route("/admin/scrub", methods=["POST"])
+@login_required
+def start_scrub():
+    """Starts (or resumes) an integrity scrub of all pages and backups in the background."""
+    if integrity_scrubber.start_pass():
+        flash("Integrity scrub started. Reload this page to see its progress.", "success")
+    else:
+        flash("An integrity scrub is already running.", "warning")
+    return redirect(url_for("admin_panel"))
+
+@app.route("/admin/backup_runs", methods=["GET"])
+@login_required
+def backup_runs():
+    """Returns the stats of recent scheduled backup runs in this process."""
+    return jsonify({
+        "enabled": BACKUP_INTERVAL_SECONDS > 0,
+        "interval_seconds": BACKUP_INTERVAL_SECONDS,
+        "runs": list(backup_scheduler.runs),
+    })
+
+@app.route("/admin/metrics", methods=["GET"])
+def admin_metrics():
+    """Returns metrics in the Prometheus text format.
+
+    Accepts an admin session or HTTP basic auth with the admin password,
+    so that a Prometheus server can scrape it.
+    """
+    auth = request.authorization
+    basic_auth_ok = bool(auth and auth.password) and secrets.compare_digest(
+        auth.password.encode("utf-8"), ADMIN_PASSWORD.encode("utf-8")
+    )
+    if "admin_logged_in" not in session and not basic_auth_ok:
+        return Response("Authentication required\n", 401, {"WWW-Authenticate": 'Basic realm="cryptpad metrics"'})
+    try:
+        gauges = [
+            ("cryptpad_pages", "Number of pages.", page_catalog.count()),
+            ("cryptpad_backups", "Number of backups of existing pages.", page_catalog.backup_count()),
+            ("cryptpad_archived_pages", "Number of pages in the cold archive.", page_catalog.archived_count()),
+            ("cryptpad_scrub_issues", "Integrity problems found by the last scrub of each page.", page_catalog.scrub_issues(limit=0)[1]),
+        ]
+    except sqlite3.Error as e:
+        logging.error(f"Error reading page counts for metrics: {e}")
+        gauges = []
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
 @app.route("/admin/toggle_status/<page_id>", methods=["POST"])
 @login_required
 def toggle_page_status(page_id):
@@ -279,39 +3104,986 @@ def toggle_security_mode(page_id):
     flash(f"Security mode for page '{page_id}' changed to {mode_names[new_mode]}.", "success")
     return redirect(url_for("admin_panel"))
 
+# Page change notifications
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+SSE_QUEUE_SIZE = 8
+# Streams a process serves on request threads when the server cannot hand their connections to
+# the event stream hub; more are answered with 503 and editors poll /load instead
+SSE_THREAD_STREAMS = int(os.environ.get("SSE_THREAD_STREAMS", "8"))
+SSE_HAND_OFF_KEY = "cryptpad.hand_off" # WSGI environ entry set by serve.py, see RequestHandler there
+SSE_MAX_BUFFERED = 64 * 1024 # Bytes of unsent events after which a stream's client counts as gone
+
+class PageEventBroker:
+    """In-process publish/subscribe hub for page change events.
+
+    Each subscriber gets a small bounded queue. Events only carry metadata
+    (e.g. the new revision id), so when a slow consumer's queue is full the
+    oldest event is dropped: the newest one supersedes it anyway.
+    """
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {} # page_id -> {queue: notify callback or None}
+
+    def subscribe(self, page_id, notify=None):
+        """Returns a queue of (event, data) tuples; notify() is called after each event is queued."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(page_id, {})[subscriber] = notify
+        return subscriber
+
+    def unsubscribe(self, page_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(page_id)
+            if subscribers is not None:
+                subscribers.pop(subscriber, None)
+                if not subscribers:
+                    del self._subscribers[page_id]
+
+    def publish(self, page_id, event, data):
+        """Sends an event to all current subscribers of a page without blocking."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(page_id, {}).items())
+        for subscriber, notify in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+            if notify is not None:
+                notify()
+
+page_events = PageEventBroker(SSE_QUEUE_SIZE)
+
+def format_sse(event, data):
+    """Formats a server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def poll_page_change(page_id, last_stamp):
+    """Checks an event stream's page for changes that were not published in this process.
+
+    Saves made by other worker processes are not published here, so event
+    streams compare the page's stamp while idle. Returns the event to send
+    (or None) and the page's current stamp.
+    """
+    st = storage.page_stat(page_id)
+    if st is None:
+        return format_sse("deleted", {}), None
+    if stat_stamp(st) == last_stamp:
+        return None, last_stamp
+    revision = page_revisions.cached(page_id, st)
+    if revision is None:
+        data, st = storage.read_page(page_id)
+        revision = page_revisions.remember(page_id, st, data)
+    return format_sse("revision", {"revision": revision, "size": st.st_size}), stat_stamp(st)
+
+class EventStream:
+    """State of one event stream connection served by the EventStreamHub."""
+
+    def __init__(self, page_id, sock, last_stamp):
+        self.page_id = page_id
+        self.sock = sock
+        self.last_stamp = last_stamp
+        self.subscriber = None
+        self.output = bytearray()
+        self.next_check = 0
+        self.closing = False # Closed once the output is sent, after a "deleted" event
+
+class EventStreamHub:
+    """Serves the event streams of all handed-off connections on one thread.
+
+    serve.py passes the socket of an /events request to the hub (see
+    SSE_HAND_OFF_KEY) instead of keeping a request thread on it for as long
+    as the editor is open. The hub writes the response itself with
+    non-blocking sends, forwards the page's published events, and checks the
+    page for changes of other processes every SSE_KEEPALIVE_SECONDS.
+    """
+
+    RESPONSE_HEADERS = (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/event-stream; charset=utf-8\r\n"
+        b"Cache-Control: no-cache\r\n"
+        b"X-Accel-Buffering: no\r\n" # Disable response buffering in reverse proxies
+        b"Connection: close\r\n"
+        b"\r\n"
+        b"retry: 5000\n\n"
+    )
+
+    def __init__(self, keepalive_seconds):
+        self.keepalive_seconds = keepalive_seconds
+        self._lock = threading.Lock()
+        self._added = []
+        self._notified = set()
+        self._pid = None
+        self._streams = {}
+
+    def add(self, page_id, sock, last_stamp):
+        """Takes over a connection whose request has been read and starts its event stream."""
+        with self._lock:
+            if self._pid != os.getpid(): # First stream in this (worker) process
+                self._start()
+            self._added.append(EventStream(page_id, sock, last_stamp))
+        self._wake()
+
+    def stream_count(self):
+        with self._lock:
+            return len(self._streams) + len(self._added)
+
+    def _start(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ)
+        self._streams = {}
+        self._pid = os.getpid()
+        threading.Thread(target=self._run_loop, name="event-streams", daemon=True).start()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass # The hub has wake-ups pending already
+
+    def _drain_wake_ups(self):
+        try:
+            while len(self._wake_reader.recv(4096)) == 4096:
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _notify(self, stream):
+        with self._lock:
+            self._notified.add(stream)
+        self._wake()
+
+    def _run_loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                for key, mask in self._selector.select(1 if self._streams else None):
+                    if key.fileobj is self._wake_reader:
+                        self._drain_wake_ups()
+                    elif mask & selectors.EVENT_READ and not self._client_open(key.data):
+                        self._close(key.data)
+                    elif mask & selectors.EVENT_WRITE:
+                        self._flush(key.data)
+                with self._lock:
+                    added, self._added = self._added, []
+                    notified, self._notified = self._notified, set()
+                now = time.monotonic()
+                for stream in added:
+                    self._open(stream, now)
+                for stream in notified:
+                    self._forward_events(stream)
+                if now >= next_sweep:
+                    next_sweep = now + 1
+                    for stream in [stream for stream in self._streams.values() if stream.next_check <= now]:
+                        self._check_page(stream, now)
+            except Exception as e:
+                logging.error(f"Error in event stream hub: {e}")
+
+    def _open(self, stream, now):
+        stream.sock.setblocking(False)
+        stream.subscriber = page_events.subscribe(stream.page_id, partial(self._notify, stream))
+        stream.output += self.RESPONSE_HEADERS
+        stream.next_check = now + self.keepalive_seconds
+        with self._lock:
+            self._streams[stream.sock] = stream
+        self._selector.register(stream.sock, selectors.EVENT_READ, stream)
+        self._flush(stream)
+
+    def _client_open(self, stream):
+        # Clients send nothing after their request, so a readable socket was closed or reset
+        try:
+            return stream.sock.recv(4096) != b""
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+
+    def _forward_events(self, stream):
+        if stream.sock not in self._streams:
+            return
+        while True:
+            try:
+                event, data = stream.subscriber.get_nowait()
+            except queue.Empty:
+                break
+            if event == "revision":
+                st = storage.page_stat(stream.page_id)
+                if st is not None:
+                    stream.last_stamp = stat_stamp(st)
+            stream.output += format_sse(event, data).encode("utf-8")
+            if event == "deleted":
+                stream.closing = True
+                break
+        self._flush(stream)
+
+    def _check_page(self, stream, now):
+        stream.next_check = now + self.keepalive_seconds
+        try:
+            message, stream.last_stamp = poll_page_change(stream.page_id, stream.last_stamp)
+        except Exception as e:
+            logging.error(f"Error checking page {stream.page_id} for its event stream: {e}")
+            message = None
+        if message is None:
+            message = ": keepalive\n\n"
+        elif stream.last_stamp is None:
+            stream.closing = True
+        stream.output += message.encode("utf-8")
+        self._flush(stream)
+
+    def _flush(self, stream):
+        if stream.sock not in self._streams:
+            return
+        try:
+            while stream.output:
+                del stream.output[:stream.sock.send(stream.output)]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._close(stream)
+            return
+        if stream.closing and not stream.output:
+            self._close(stream)
+        elif len(stream.output) > SSE_MAX_BUFFERED:
+            self._close(stream) # The client stopped reading; it reconnects if it is still there
+        else:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if stream.output else 0)
+            self._selector.modify(stream.sock, events, stream)
+
+    def _close(self, stream):
+        with self._lock:
+            self._streams.pop(stream.sock, None)
+        page_events.unsubscribe(stream.page_id, stream.subscriber)
+        self._selector.unregister(stream.sock)
+        stream.sock.close()
+
+event_stream_hub = EventStreamHub(SSE_KEEPALIVE_SECONDS)
+thread_event_streams = threading.BoundedSemaphore(SSE_THREAD_STREAMS) if SSE_THREAD_STREAMS > 0 else None
+
+# Helper functions for page content and revisions
+def compute_revision(data):
+    """Returns the revision id (SHA-256 hex digest) of raw page content."""
+    return hashlib.sha256(data).hexdigest()
+
+def stat_stamp(st):
+    """Returns a (mtime_ns, size) tuple identifying one version of a file."""
+    return (st.st_mtime_ns, st.st_size)
+
+class PageRevisionCache:
+    """Maps page files to the revision of their current content.
+
+    Entries are keyed by the file's mtime/size stamp, so a lookup for an
+    unchanged page needs only a stat call. Pages written by another process
+    are re-hashed once on their next read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revisions = {}
+
+    def cached(self, page_id, st):
+        """Returns the cached revision if it matches the given stat result."""
+        with self._lock:
+            entry = self._revisions.get(page_id)
+        if entry and entry[0] == stat_stamp(st):
+            return entry[1]
+        return None
+
+    def remember(self, page_id, st, data):
+        """Records the revision of content just read from or written to a page file."""
+        revision = compute_revision(data)
+        with self._lock:
+            self._revisions[page_id] = (stat_stamp(st), revision)
+        return revision
+
+    def store(self, page_id, st, revision):
+        """Records a revision that was computed while the content was written."""
+        with self._lock:
+            self._revisions[page_id] = (stat_stamp(st), revision)
+
+    def forget(self, page_id):
+        with self._lock:
+            self._revisions.pop(page_id, None)
+
+page_revisions = PageRevisionCache()
+
+def current_page_revision(page_id):
+    """Returns the revision of a page, or None if it does not exist.
+
+    The page is hashed in chunks, and only if the revision cache does not
+    know its current version.
+    """
+    st = storage.page_stat(page_id)
+    if st is None:
+        return None
+    revision = page_revisions.cached(page_id, st)
+    if revision is None:
+        digest = hashlib.sha256()
+        for chunk in storage.iter_page_chunks(page_id):
+            digest.update(chunk)
+        revision = digest.hexdigest()
+        page_revisions.store(page_id, st, revision)
+    return revision
+
+def read_page_content(page_id):
+    """Reads a page and returns its content and current revision."""
+    data, st = storage.read_page(page_id)
+    return data.decode("utf-8"), page_revisions.remember(page_id, st, data)
+
+class PageTooLarge(Exception):
+    """Raised when page content would exceed MAX_PAGE_SIZE."""
+
+SAVE_STREAM_CHUNK_SIZE = 64 * 1024
+
+class StagedPage:
+    """A page upload copied into a staging file, with its size and revision."""
+
+    def __init__(self, path, size, revision):
+        self.path = path
+        self.size = size
+        self.revision = revision
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def stage_page_upload(stream, content_encoding=None):
+    """Copies a raw request body into a staging file in fixed-size chunks.
+
+    The body is decompressed if ``content_encoding`` is "gzip", checked to be
+    UTF-8 and hashed on the way, so only one chunk is held in memory at a
+    time. Raises PageTooLarge if the (decompressed) content exceeds
+    MAX_PAGE_SIZE and ValueError for an invalid body.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == "gzip" else None
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    digest = hashlib.sha256()
+    size = 0
+
+    def write(f, data):
+        nonlocal size
+        size += len(data)
+        if size > MAX_PAGE_SIZE:
+            raise PageTooLarge(f"Page content exceeds the limit of {MAX_PAGE_SIZE} bytes.")
+        decoder.decode(data) # Raises UnicodeDecodeError (a ValueError) for invalid UTF-8
+        digest.update(data)
+        f.write(data)
+
+    fd, staged_path = tempfile.mkstemp(dir=storage.staging_dir, prefix=".upload.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(SAVE_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if decompressor is None:
+                    write(f, chunk)
+                    continue
+                try:
+                    # Limit each output piece, so a small compressed body cannot expand in memory
+                    data = decompressor.decompress(chunk, SAVE_STREAM_CHUNK_SIZE)
+                    while data:
+                        write(f, data)
+                        data = decompressor.decompress(decompressor.unconsumed_tail, SAVE_STREAM_CHUNK_SIZE)
+                except zlib.error as e:
+                    raise ValueError(f"Invalid gzip data: {e}")
+            if decompressor is not None:
+                write(f, decompressor.flush())
+                if not decompressor.eof:
+                    raise ValueError("Incomplete gzip data.")
+            decoder.decode(b"", final=True)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(staged_path)
+        raise
+    return StagedPage(staged_path, size, digest.hexdigest())
+
+def write_staged_page(page_id, staged):
+    """Stores a staged upload as the page's content and returns the new revision.
+
+    Like write_page_content, callers hold the page's lock.
+    """
+    # The catalog needs only the title and the text kept in the search index
+    with open(staged.path, "rb") as f:
+        head = f.read(SEARCH_INDEX_MAX_BYTES).decode("utf-8", errors="ignore")
+    st = storage.write_page_from_file(page_id, staged.path)
+    page_revisions.store(page_id, st, staged.revision)
+    catalog_page_written(page_id, head, st, staged.revision)
+    page_events.publish(page_id, "revision", {"revision": staged.revision, "size": staged.size})
+    return staged.revision
+
+def write_page_content(page_id, content, appended=None, edits=None):
+    """Writes a page, updates the revision cache and catalog, and returns the new revision.
+
+    If ``appended`` is given, ``content`` is the old content followed by
+    ``appended`` and the backend may write only the appended text. If
+    ``edits`` is given, ``content`` is the result of applying them to the
+    current content, and with write-behind saves only the edits are
+    journaled.
+    """
+    data = content.encode("utf-8")
+    if len(data) > MAX_PAGE_SIZE:
+        raise PageTooLarge(f"Page content exceeds the limit of {MAX_PAGE_SIZE} bytes.")
+    if edits is not None and isinstance(storage, WriteBehindStorage):
+        # The catalog is updated when the journal is written to the page
+        st, revision = storage.journal_edits(page_id, data, edits)
+        page_revisions.store(page_id, st, revision)
+    else:
+        st = storage.write_page(page_id, data, appended.encode("utf-8") if appended is not None else None)
+        revision = page_revisions.remember(page_id, st, data)
+        catalog_page_written(page_id, content, st, revision)
+    page_events.publish(page_id, "revision", {"revision": revision, "size": len(data)})
+    return revision
+
+def apply_page_edits(content, edits):
+    """Applies a list of {"start", "end", "text"} edits to page content.
+
+    Offsets are UTF-16 code unit positions in the base content (as used by
+    JavaScript strings) and edits must not overlap. Returns the new content
+    and, if the edits only append to the end, the appended text.
+    """
+    if not isinstance(edits, list):
+        raise ValueError("Edits must be a list.")
+    units = content.encode("utf-16-le", "surrogatepass")
+    length = len(units) // 2
+    parsed = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise ValueError("Each edit must be an object.")
+        start, end, text = edit.get("start"), edit.get("end"), edit.get("text", "")
+        if type(start) is not int or type(end) is not int or not isinstance(text, str):
+            raise ValueError("Each edit needs integer 'start'/'end' and string 'text'.")
+        if not 0 <= start <= end <= length:
+            raise ValueError(f"Edit range {start}-{end} is outside the page (length {length}).")
+        parsed.append((start, end, text))
+    parsed.sort(key=lambda edit: (edit[0], edit[1]))
+
+    pieces = []
+    position = 0
+    for start, end, text in parsed:
+        if start < position:
+            raise ValueError("Edits must not overlap.")
+        pieces.append(units[position * 2:start * 2])
+        pieces.append(text.encode("utf-16-le", "surrogatepass"))
+        position = end
+    pieces.append(units[position * 2:])
+    new_content = b"".join(pieces).decode("utf-16-le", "surrogatepass")
+    # Reject lone surrogates, which cannot be stored as UTF-8
+    new_content.encode("utf-8")
+
+    appended = None
+    if len(parsed) == 1 and parsed[0][0] == parsed[0][1] == length:
+        appended = parsed[0][2]
+    return new_content, appended
+
+def is_last_modified_reliable(last_modified):
+    """Whether a modification time can serve as a validator.
+
+    Last-Modified has a resolution of one second, so a resource changed
+    within the current second could change again under the same value.
+    """
+    return int(last_modified) < int(time.time())
+
+def is_not_modified(etag, last_modified):
+    """Checks the request's conditional headers against a resource's validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and is_last_modified_reliable(last_modified):
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+# Encrypted sections (ENC tokens) are created and decrypted in the browser, see static/js/script.js.
+# v1 bodies are base64 of JSON {"iv": [...], "ciphertext": [...]} and always start with "eyJ";
+# v2 bodies are unpadded base64url of a version byte, the 12-byte IV and the ciphertext.
+ENC_TOKEN_PATTERN = re.compile(r"ENC<[^>]+>")
+ENC_TOKEN_VERSION = 2
+ENC_IV_LENGTH = 12
+
+ENC_TAG_LENGTH = 16 # AES-GCM appends its authentication tag to the ciphertext
+
+def parse_enc_token(token):
+    """Parses an ENC token the way the editor's parseEncPayload does.
+
+    Returns (version, iv, ciphertext); raises ValueError describing why
+    the editor could not decrypt the token.
+    """
+    if not token.startswith("ENC<") or not token.endswith(">"):
+        raise ValueError("not terminated by '>'")
+    body = token[4:-1]
+    if body.startswith("eyJ"): # v1: base64 JSON with byte arrays
+        try:
+            encrypted_data = json.loads(base64.b64decode(body, validate=True))
+            iv = bytes(encrypted_data["iv"])
+            ciphertext = bytes(encrypted_data["ciphertext"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"invalid v1 payload ({e})") from None
+        version = 1
+    else:
+        try:
+            payload = base64.b64decode(body + "=" * (-len(body) % 4), altchars=b"-_", validate=True)
+        except ValueError as e:
+            raise ValueError(f"invalid base64 ({e})") from None
+        if not payload or payload[0] != ENC_TOKEN_VERSION:
+            raise ValueError("unsupported format version")
+        version, iv, ciphertext = payload[0], payload[1:1 + ENC_IV_LENGTH], payload[1 + ENC_IV_LENGTH:]
+    if len(iv) != ENC_IV_LENGTH:
+        raise ValueError(f"IV has {len(iv)} bytes instead of {ENC_IV_LENGTH}")
+    if len(ciphertext) < ENC_TAG_LENGTH:
+        raise ValueError("ciphertext is shorter than the authentication tag")
+    return version, iv, ciphertext
+
+def reencode_enc_token(token):
+    """Converts a v1 ENC token to the compact v2 format.
+
+    No key is needed since only the encoding changes. Tokens that are
+    already v2 or cannot be parsed are returned unchanged.
+    """
+    try:
+        version, iv, ciphertext = parse_enc_token(token)
+    except ValueError:
+        return token
+    if version != 1:
+        return token
+    payload = bytes([ENC_TOKEN_VERSION]) + iv + ciphertext
+    return f"ENC<{base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')}>"
+
+# Skeleton loads: /load?mode=skeleton returns a page with its ENC tokens replaced by
+# [LOCKED_CONTENT_#n] labels, and /blobs returns the tokens the editor needs by index.
+# Saves with "skeleton": true send edits of the skeleton, see skeleton_edits_to_raw.
+ENC_TOKEN_BYTES_PATTERN = re.compile(rb"ENC<[^>]+>")
+SKELETON_LABEL_PATTERN = re.compile(r"\[LOCKED_CONTENT_#(\d+)\]")
+TOKEN_INDEX_MAX_PAGES = 1024
+
+class PageTokenIndex:
+    """Caches the byte offsets of the ENC tokens of recently loaded pages.
+
+    Like PageRevisionCache, entries are keyed by the page's mtime/size
+    stamp, so each version of a page is parsed once.
+    """
+
+    def __init__(self, max_pages=TOKEN_INDEX_MAX_PAGES):
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # page_id -> (stamp, revision, offsets)
+
+    def get(self, page_id, st):
+        """Returns (revision, offsets) if cached for the given stat result, otherwise None."""
+        with self._lock:
+            entry = self._entries.get(page_id)
+            if entry is None or entry[0] != stat_stamp(st):
+                return None
+            self._entries.move_to_end(page_id)
+            return entry[1], entry[2]
+
+    def index(self, page_id, data, st):
+        """Parses raw page content, caches its token offsets and returns (revision, offsets)."""
+        revision = page_revisions.cached(page_id, st) or page_revisions.remember(page_id, st, data)
+        offsets = [match.span() for match in ENC_TOKEN_BYTES_PATTERN.finditer(data)]
+        with self._lock:
+            self._entries[page_id] = (stat_stamp(st), revision, offsets)
+            self._entries.move_to_end(page_id)
+            while len(self._entries) > self.max_pages:
+                self._entries.popitem(last=False)
+        return revision, offsets
+
+    def forget(self, page_id):
+        with self._lock:
+            self._entries.pop(page_id, None)
+
+page_token_index = PageTokenIndex()
+
+def read_page_skeleton(page_id):
+    """Reads a page with its ENC tokens replaced by [LOCKED_CONTENT_#n] labels.
+
+    Returns the skeleton, the list of token sizes (token n has size
+    sizes[n - 1]), the revision and the stat result.
+    """
+    data, st = storage.read_page(page_id)
+    cached = page_token_index.get(page_id, st)
+    revision, offsets = cached if cached else page_token_index.index(page_id, data, st)
+    pieces = []
+    previous = 0
+    for number, (start, end) in enumerate(offsets, 1):
+        pieces.append(data[previous:start])
+        pieces.append(f"[LOCKED_CONTENT_#{number}]".encode("ascii"))
+        previous = end
+    pieces.append(data[previous:])
+    return b"".join(pieces).decode("utf-8"), [end - start for start, end in offsets], revision, st
+
+def read_page_tokens(page_id, numbers):
+    """Returns the current revision of a page and its ENC tokens with the given label numbers.
+
+    Only the requested byte ranges are read if the page's token offsets
+    are cached. The tokens are None if a number is unknown. Raises
+    FileNotFoundError if the page does not exist.
+    """
+    st = storage.page_stat(page_id)
+    if st is None:
+        raise FileNotFoundError(f"Page '{page_id}' not found")
+    data = None
+    cached = page_token_index.get(page_id, st)
+    if cached is None:
+        data, st = storage.read_page(page_id)
+        cached = page_token_index.index(page_id, data, st)
+    revision, offsets = cached
+    if any(not 1 <= number <= len(offsets) for number in numbers):
+        return revision, None
+    ranges = [offsets[number - 1] for number in numbers]
+    if data is not None:
+        chunks = [data[start:end] for start, end in ranges]
+    else:
+        chunks, read_st = storage.read_page_ranges(page_id, ranges)
+        if stat_stamp(read_st) != stat_stamp(st):
+            return read_page_tokens(page_id, numbers) # Changed meanwhile; parse the new version
+    return revision, {number: chunk.decode("utf-8") for number, chunk in zip(numbers, chunks)}
+
+def utf16_length(text):
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+def skeleton_edits_to_raw(page_id, content, edits):
+    """Converts edits of a page's skeleton into edits of its raw content.
+
+    Edit offsets are UTF-16 positions in the skeleton of the page's current
+    ``content`` (see read_page_skeleton), and [LOCKED_CONTENT_#n] labels in
+    edit texts stand for the page's n-th ENC token, so the editor can save
+    without fetching the encrypted sections of the page. Raises ValueError
+    if an edit starts or ends inside a label.
+    """
+    if not isinstance(edits, list) or not all(isinstance(edit, dict) for edit in edits):
+        raise ValueError("Edits must be a list of objects.")
+    data = content.encode("utf-8")
+    st = storage.page_stat(page_id)
+    cached = page_token_index.get(page_id, st)
+    _, offsets = cached if cached else page_token_index.index(page_id, data, st)
+    tokens = [data[start:end].decode("utf-8") for start, end in offsets]
+
+    # Label n spans label_starts[n-1]:label_ends[n-1] in the skeleton; shifts[n-1] is the
+    # difference between raw and skeleton positions after it
+    label_starts, label_ends, shifts = [], [], []
+    position = shift = previous = 0
+    for number, ((start, end), token) in enumerate(zip(offsets, tokens), 1):
+        position += utf16_length(data[previous:start].decode("utf-8"))
+        label_length = len(f"[LOCKED_CONTENT_#{number}]")
+        label_starts.append(position)
+        position += label_length
+        label_ends.append(position)
+        shift += utf16_length(token) - label_length
+        shifts.append(shift)
+        previous = end
+
+    def raw_position(position):
+        if type(position) is not int:
+            raise ValueError("Each edit needs integer 'start'/'end' and string 'text'.")
+        labels_before = bisect.bisect_right(label_starts, position)
+        if labels_before and position < label_ends[labels_before - 1]:
+            if position > label_starts[labels_before - 1]:
+                raise ValueError("Edits must not start or end inside an encrypted section's label.")
+            labels_before -= 1
+        return position + (shifts[labels_before - 1] if labels_before else 0)
+
+    def token_for_label(match):
+        number = int(match.group(1))
+        return tokens[number - 1] if 1 <= number <= len(tokens) else match.group(0)
+
+    raw_edits = []
+    for edit in edits:
+        text = edit.get("text", "")
+        if not isinstance(text, str):
+            raise ValueError("Each edit needs integer 'start'/'end' and string 'text'.")
+        raw_edits.append({
+            "start": raw_position(edit.get("start")),
+            "end": raw_position(edit.get("end")),
+            "text": SKELETON_LABEL_PATTERN.sub(token_for_label, text),
+        })
+    return raw_edits
+
+@app.cli.command("reencode-tokens")
+def reencode_tokens_command():
+    """Rewrites the encrypted sections of all pages in the compact v2 format."""
+    page_count = token_count = bytes_saved = 0
+    for page_id in storage.list_page_ids():
+        converted = [0]
+        def reencode(match):
+            token = reencode_enc_token(match.group(0))
+            if token != match.group(0):
+                converted[0] += 1
+            return token
+        with page_locks.lock(page_id):
+            content, _ = read_page_content(page_id)
+            new_content = ENC_TOKEN_PATTERN.sub(reencode, content)
+            if converted[0]:
+                write_page_content(page_id, new_content)
+        if converted[0]:
+            page_count += 1
+            token_count += converted[0]
+            bytes_saved += len(content.encode("utf-8")) - len(new_content.encode("utf-8"))
+    print(f"Re-encoded {token_count} encrypted sections in {page_count} pages ({bytes_saved} bytes saved).")
+
+# Helper functions for response compression
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/javascript", "text/javascript",
+    "text/css", "text/html", "text/plain", "image/svg+xml",
+}
+COMPRESS_MIN_SIZE = 512
+COMPRESS_MAX_SIZE = 16 * 1024 * 1024
+
+def choose_content_encoding():
+    """Picks the best response encoding supported by both client and server."""
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def compress_body(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+@app.after_request
+def compress_response(response):
+    """Compresses JSON, HTML and static text responses with brotli or gzip."""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code != 200 or request.method == "HEAD":
+        return response
+    length = response.content_length
+    if length is None or not (COMPRESS_MIN_SIZE <= length <= COMPRESS_MAX_SIZE):
+        return response
+    encoding = choose_content_encoding()
+    if encoding is None:
+        return response
+
+    # Static files are sent as a file wrapper; read them so they can be compressed
+    response.direct_passthrough = False
+    response.set_data(compress_body(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body differs byte-wise, so only a weak validator still applies
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Fingerprinted static assets
+ASSET_CACHE_SECONDS = 365 * 24 * 3600
+
+class StaticAsset(collections.namedtuple("StaticAsset", "path url_name mimetype digest variants stamp")):
+    """A static file's content (``variants`` maps None, "gzip" and "br" to bodies) and fingerprinted name."""
+    __slots__ = ()
+
+class StaticAssets:
+    """In-memory copies of the files in static/, served under content-hashed URLs.
+
+    Each file is loaded once and served as /assets/<name>.<hash>.<ext>
+    with precompressed gzip and brotli variants. A changed file gets a new
+    URL, so responses can be cached as immutable. In debug mode changed
+    files are reloaded when their URL is generated.
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self._by_filename = {} # Path relative to static/ -> asset
+        self._by_url_name = {} # Fingerprinted path -> asset
+        self._lock = threading.Lock()
+
+    def _load_file(self, filename):
+        path = os.path.join(self.static_dir, filename)
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = os.path.splitext(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        variants = {None: data}
+        if mimetype in COMPRESSIBLE_MIMETYPES and len(data) >= COMPRESS_MIN_SIZE:
+            for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+                compressed = compress_body(data, encoding)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+        asset = StaticAsset(path, f"{stem}.{digest}{ext}", mimetype, digest, variants, stat_stamp(st))
+        with self._lock:
+            old = self._by_filename.get(filename)
+            if old is not None:
+                self._by_url_name.pop(old.url_name, None)
+            self._by_filename[filename] = asset
+            self._by_url_name[asset.url_name] = asset
+        return asset
+
+    def load(self):
+        """Loads and fingerprints all files in the static directory."""
+        count = size = 0
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                filename = os.path.relpath(os.path.join(root, name), self.static_dir).replace(os.sep, "/")
+                asset = self._load_file(filename)
+                count += 1
+                size += sum(len(body) for body in asset.variants.values())
+        logging.info(f"Loaded {count} static assets ({size} bytes with compressed variants).")
+
+    def url_name(self, filename, check_changed=False):
+        """Returns the fingerprinted path of a static file, or None if it is unknown."""
+        asset = self._by_filename.get(filename)
+        if check_changed:
+            try:
+                if asset is None or stat_stamp(os.stat(os.path.join(self.static_dir, filename))) != asset.stamp:
+                    asset = self._load_file(filename)
+            except OSError:
+                return None
+        return asset.url_name if asset is not None else None
+
+    def get(self, url_name):
+        return self._by_url_name.get(url_name)
+
+static_assets = StaticAssets(app.static_folder)
+static_assets.load()
+
+@app.template_global()
+def asset_url(filename):
+    """Returns the URL of a static file; fingerprinted if it is a known asset, else the plain /static/ URL."""
+    url_name = static_assets.url_name(filename, check_changed=app.debug)
+    if url_name is None:
+        return url_for("static", filename=filename)
+    return url_for("serve_asset", filename=url_name)
+
+@app.route("/assets/<path:filename>")
+def serve_asset(filename):
+    """Serves a fingerprinted static asset from memory, precompressed if the client accepts it."""
+    asset = static_assets.get(filename)
+    if asset is None:
+        return render_template("404.html"), 404
+    encoding = choose_content_encoding()
+    if encoding not in asset.variants:
+        encoding = "gzip" if "gzip" in asset.variants and request.accept_encodings["gzip"] else None
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if len(asset.variants) > 1:
+        response.vary.add("Accept-Encoding")
+    response.set_etag(asset.digest if encoding is None else f"{asset.digest}-{encoding}")
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_CACHE_SECONDS
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+# Helper functions for streaming zip archives
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+class ZipStreamBuffer:
+    """Write-only file object that collects zip output until it is drained.
+
+    zipfile supports unseekable outputs, so the archive can be produced
+    incrementally and handed to the client chunk by chunk.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_page_archive_files(page_id, prefix=""):
+    """Yields (arcname, chunks, date_time, size) entries for a page and its backups.
+
+    Archived pages are read from their pack without restoring them.
+    """
+    st = storage.page_stat(page_id)
+    backups, iter_blob = None, storage.iter_blob
+    if st is not None:
+        chunks = storage.iter_page_chunks(page_id, ZIP_STREAM_CHUNK_SIZE)
+        yield f"{prefix}{page_id}.md", chunks, datetime.fromtimestamp(st.st_mtime), st.st_size
+    else:
+        location = cold_archive.lookup(page_id)
+        if location is not None:
+            record = cold_archive.read_record(location)
+            date_time = datetime.fromtimestamp(record["mtime_ns"] / 1e9)
+            yield f"{prefix}{page_id}.md", cold_archive.iter_content(record), date_time, record["size"]
+            backups, iter_blob = record["backups"], partial(cold_archive.iter_blob, record)
+
+    # Store backups in a 'backups' folder within the zip
+    for entry in storage.list_backups(page_id) if backups is None else backups:
+        backup_filename = f"{page_id}_{entry['timestamp']}.md"
+        date_time = datetime.strptime(entry["timestamp"], BACKUP_TIMESTAMP_FORMAT)
+        yield f"{prefix}backups/{backup_filename}", iter_blob(entry["hash"]), date_time, entry["size"]
+
+def stream_zip(files):
+    """Generates a deflated zip archive of (arcname, chunks, date_time, size) entries in bounded-size chunks."""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname, chunks, date_time, size in files:
+            zinfo = zipfile.ZipInfo(arcname, date_time=date_time.timetuple()[:6])
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.external_attr = 0o644 << 16
+            try:
+                with zf.open(zinfo, "w", force_zip64=size > zipfile.ZIP64_LIMIT) as dest:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            except (OSError, zlib.error) as e:
+                logging.error(f"Could not add {arcname} to zip archive: {e}")
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+def zip_response(files, zip_filename):
+    """Returns a streamed zip download response."""
+    return Response(
+        stream_with_context(stream_zip(files)), # Keeps storage reads attributed to the endpoint
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{zip_filename}"'},
+    )
+
 @app.route("/admin/download_page/<page_id>", methods=["GET"])
 @login_required
 def download_page(page_id):
-    """Packs the page and its backups into a zip file for download."""
-    page_file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-    page_specific_backup_dir = os.path.join(BACKUP_DIR, page_id)
-
-    if not os.path.exists(page_file_path):
+    """Streams the page and its backups as a zip file for download."""
+    if not page_available(page_id):
         flash(f"Page '{page_id}' not found. Cannot download.", "warning")
         return redirect(url_for("admin_panel"))
 
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # Add the main page file
-        zf.write(page_file_path, arcname=f"{page_id}.md")
-
-        # Add backups if the backup directory exists
-        if os.path.exists(page_specific_backup_dir):
-            for backup_file in os.listdir(page_specific_backup_dir):
-                if backup_file.endswith(".md"):
-                    full_backup_path = os.path.join(page_specific_backup_dir, backup_file)
-                    # Store backups in a 'backups' folder within the zip
-                    zf.write(full_backup_path, arcname=os.path.join("backups", backup_file))
-    
-    memory_file.seek(0)
-    zip_filename = f"{page_id}_archive.zip"
-    
-    return send_file(
-        memory_file,
-        as_attachment=True,
-        download_name=zip_filename,
-        mimetype='application/zip'
-    )
+    return zip_response(iter_page_archive_files(page_id), f"{page_id}_archive.zip")
+
+@app.route("/admin/export", methods=["GET"])
+@login_required
+def export_pages():
+    """Streams all pages (optionally filtered by status) and their backups as one zip file."""
+    status = request.args.get("status")
+    if status not in (None, "", "enabled", "disabled"):
+        flash(f"Unknown page status '{status}'.", "warning")
+        return redirect(url_for("admin_panel"))
+    page_ids = page_catalog.page_ids(status or None)
+
+    def files():
+        for page_id in page_ids:
+            yield from iter_page_archive_files(page_id, prefix=f"{page_id}/")
+
+    zip_filename = f"cryptpad_export_{status or 'all'}_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    return zip_response(files(), zip_filename)
 
 @app.route("/admin/create_page", methods=["POST"])
 @login_required
@@ -327,44 +4099,192 @@ def admin_create_page():
         if custom_page_id in RESERVED_ROUTES:
             flash(f"Page ID '{custom_page_id}' is a reserved name and cannot be used.", "danger")
             return redirect(url_for("admin_panel"))
-        if os.path.exists(os.path.join(DATA_DIR, f"{custom_page_id}.md")):
+        if page_exists_or_archived(custom_page_id):
             flash(f"Page ID '{custom_page_id}' is already taken. Please choose another.", "danger")
             return redirect(url_for("admin_panel"))
         page_id_to_create = custom_page_id
-    else:
-        # Generate a random ID if no custom ID is provided
-        page_id_to_create = generate_page_id()
-        # Ensure the generated ID is unique
-        while os.path.exists(os.path.join(DATA_DIR, f"{page_id_to_create}.md")):
-            page_id_to_create = generate_page_id()
-            
-    # Create an empty file for the new page
-    file_path = os.path.join(DATA_DIR, f"{page_id_to_create}.md")
+
+    # Create an empty page
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write("") # Start with empty content
+        if page_id_to_create:
+            with page_locks.lock(page_id_to_create):
+                write_page_content(page_id_to_create, "") # Start with empty content
+            catalog_page_backups_changed(page_id_to_create) # Pick up backups of a previously deleted page
+            page_id_allocator.reserve(page_id_to_create)
+        else:
+            # Generate a random ID if no custom ID is provided
+            page_id_to_create = create_random_pages(1)[0]
         flash(f"Page '{page_id_to_create}' created successfully.", "success")
         return redirect(url_for("editor", page_id=page_id_to_create))
-    except IOError as e:
-        flash(f"Error creating page '{page_id_to_create}': {e}", "danger")
+    except (IOError, sqlite3.Error) as e:
+        flash(f"Error creating page: {e}", "danger")
         return redirect(url_for("admin_panel"))
 
+@app.route("/admin/api/create_pages", methods=["POST"])
+@login_required
+def admin_api_create_pages():
+    """Creates a batch of empty pages with random IDs and returns their IDs as JSON."""
+    data = request.get_json(silent=True) or {}
+    count = data.get("count")
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_BULK_CREATE_PAGES:
+        return jsonify({"success": False, "message": f"count must be a number between 1 and {MAX_BULK_CREATE_PAGES}"}), 400
+    try:
+        page_ids = create_random_pages(count)
+    except (IOError, sqlite3.Error) as e:
+        logging.error(f"Error creating {count} pages: {e}")
+        return jsonify({"success": False, "message": "Error creating pages"}), 500
+    logging.info(f"Created {len(page_ids)} pages via the admin API.")
+    return jsonify({"success": True, "page_ids": page_ids})
+
+# Batch admin operations
+MAX_BATCH_OPERATIONS = int(os.environ.get("MAX_BATCH_OPERATIONS", 10000))
+ADMIN_BATCH_WORKERS = int(os.environ.get("ADMIN_BATCH_WORKERS", 4)) # Backups and deletes run in parallel per process
+BATCH_STATUS_OPERATIONS = ("enable", "disable", "toggle_status", "set_security_mode", "toggle_security_mode")
+BATCH_OPERATIONS = BATCH_STATUS_OPERATIONS + ("backup", "delete")
+
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ADMIN_BATCH_WORKERS, thread_name_prefix="admin-batch")
+
+def parse_batch_operations(data):
+    """Returns the operation items of a batch request body, or raises ValueError.
+
+    The body is either {"operations": [{"page_id", "operation", ...}, ...]}
+    or the shorthand {"page_ids": [...], "operation": ..., ...} that applies
+    one operation to many pages.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object.")
+    if "operations" in data:
+        items = data["operations"]
+    elif isinstance(data.get("page_ids"), list):
+        items = [{"page_id": page_id, "operation": data.get("operation"), "security_mode": data.get("security_mode")}
+                 for page_id in data["page_ids"]]
+    else:
+        raise ValueError('Provide "operations", or "page_ids" and "operation".')
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_OPERATIONS:
+        raise ValueError(f"A batch must contain between 1 and {MAX_BATCH_OPERATIONS} operations.")
+    return [item if isinstance(item, dict) else {} for item in items]
+
+def batch_status_fields(operation, item, current):
+    """Returns the status fields a status operation sets, given the page's current status entry."""
+    if operation == "enable":
+        return {"status": "enabled"}
+    if operation == "disable":
+        return {"status": "disabled"}
+    if operation == "toggle_status":
+        return {"status": "disabled" if current["status"] == "enabled" else "enabled"}
+    if operation == "toggle_security_mode":
+        return {"security_mode": "prompt" if current["security_mode"] == "local" else "local"}
+    security_mode = item.get("security_mode")
+    if security_mode not in ("local", "prompt"):
+        raise ValueError('security_mode must be "local" or "prompt".')
+    return {"security_mode": security_mode}
+
+def run_in_batch_pool(function, results):
+    """Runs function(page_id) for each result on the batch pool and records the outcome in the result."""
+    futures = [(batch_executor.submit(function, result["page_id"]), result) for result in results]
+    for future, result in futures:
+        try:
+            result.update(success=True, **future.result())
+        except FileNotFoundError: # Deleted meanwhile, e.g. by an earlier item of the batch
+            result.update(success=False, message="Page not found.")
+        except Exception as e:
+            result.update(success=False, message=str(e))
+
+def run_batch_operations(items):
+    """Applies a batch of admin operations and returns one result dict per item, in order.
+
+    Backups and then deletes run on a bounded thread pool. All status
+    changes are then computed and written in one locked update of the
+    status store, together with the removal of deleted pages' statuses.
+    """
+    results, backups, deletes, status_items = [], [], [], []
+    for item in items:
+        page_id, operation = item.get("page_id"), item.get("operation")
+        result = {"page_id": page_id, "operation": operation}
+        results.append(result)
+        if operation not in BATCH_OPERATIONS:
+            result.update(success=False, message="Unknown operation.")
+        elif not isinstance(page_id, str) or not re.fullmatch(r"[\w-]+", page_id, re.ASCII) or not page_exists_or_archived(page_id):
+            result.update(success=False, message="Page not found.")
+        elif operation == "backup":
+            backups.append(result)
+        elif operation == "delete":
+            deletes.append(result)
+        else:
+            status_items.append((item, result))
+
+    def backup(page_id):
+        return {"backup": format_backup_timestamp(create_page_backup(page_id)["timestamp"])}
+
+    def delete(page_id):
+        remove_page(page_id)
+        return {}
+
+    run_in_batch_pool(backup, backups)
+    run_in_batch_pool(delete, deletes)
+
+    deleted = {result["page_id"] for result in deletes if result["success"]}
+    changes = {}
+
+    def compute_changes(current):
+        changes.clear()
+        for item, result in status_items:
+            page_id = item["page_id"]
+            # Later operations on the same page see the changes of earlier ones
+            entry = dict(current(page_id), **changes.get(page_id, {}))
+            try:
+                fields = batch_status_fields(item["operation"], item, entry)
+            except ValueError as e:
+                result.update(success=False, message=str(e))
+                continue
+            changes.setdefault(page_id, {}).update(fields)
+            result.update(success=True, **fields)
+        for page_id in deleted:
+            changes.pop(page_id, None)
+        return changes
+
+    new_statuses = {}
+    if status_items or deleted:
+        new_statuses = page_statuses.update_many(compute_changes, removed=deleted)
+    if new_statuses:
+        try:
+            page_catalog.update_statuses(new_statuses)
+        except sqlite3.Error as e:
+            logging.error(f"Error updating catalog statuses for {len(new_statuses)} pages: {e}")
+        for page_id, fields in changes.items():
+            if "status" in fields:
+                page_events.publish(page_id, "status", {"status": fields["status"]})
+    return results
+
+@app.route("/admin/api/batch", methods=["POST"])
+@login_required
+def admin_api_batch():
+    """Applies status, backup and delete operations to many pages and returns per-item results as JSON."""
+    try:
+        items = parse_batch_operations(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    results = run_batch_operations(items)
+    succeeded = sum(1 for result in results if result["success"])
+    logging.info(f"Admin batch: {succeeded} of {len(results)} operations succeeded.")
+    return jsonify({"success": succeeded == len(results), "results": results})
+
 
 @app.route("/<page_id>")
 def editor(page_id):
     """Serves the editor page for a given page_id."""
-    file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-
-    # Primary validation: does the page file exist?
-    # The creation logic in admin_create_page ensures valid ID formats.
-    if not os.path.exists(file_path):
-        return render_template("404.html"), 404
-
-    # Check page status for non-admins
+    # Check page status for non-admins (before restoring an archived page)
     page_status = get_page_status(page_id)
     if page_status == "disabled" and "admin_logged_in" not in session:
+        if not page_exists_or_archived(page_id):
+            return render_template("404.html"), 404
         flash("This page is currently disabled and cannot be accessed.", "warning")
         return render_template("403.html", page_id=page_id), 403
+
+    # Primary validation: does the page exist?
+    # The creation logic in admin_create_page ensures valid ID formats.
+    if not page_available(page_id):
+        return render_template("404.html"), 404
         
     security_mode = get_page_security_mode(page_id)
     return render_template("editor.html", page_id=page_id, security_mode=security_mode)
@@ -377,11 +4297,82 @@ def forbidden_page(e):
     # For now, a generic 403 page.
     return render_template("403.html"), 403
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Answers request bodies over MAX_CONTENT_LENGTH with a JSON error."""
+    return jsonify({"success": False, "message": f"Request body exceeds the limit of {MAX_CONTENT_LENGTH} bytes."}), 413
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Serves the custom 404 page."""
     return render_template("404.html"), 404
 
+# Save rate limits
+SAVE_RATE_PER_PAGE = float(os.environ.get("SAVE_RATE_PER_PAGE", "5")) # Saves per second and page; 0 disables
+SAVE_BURST_PER_PAGE = float(os.environ.get("SAVE_BURST_PER_PAGE", "20"))
+SAVE_RATE_GLOBAL = float(os.environ.get("SAVE_RATE_GLOBAL", "0")) # Saves per second of all pages; 0 disables
+SAVE_BURST_GLOBAL = float(os.environ.get("SAVE_BURST_GLOBAL", "200"))
+RATE_LIMIT_MAX_PAGES = 10000 # Buckets of the least recently saved pages are dropped beyond this
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, in bursts of up to ``burst`` events."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Returns 0 if an event is allowed now, otherwise the seconds until it is."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class SaveRateLimiter:
+    """Per-page and global token buckets limiting saves.
+
+    Limits are kept per process, so with several worker processes each
+    one allows the configured rates.
+    """
+
+    def __init__(self, page_rate, page_burst, global_rate, global_burst):
+        self.page_rate = page_rate
+        self.page_burst = page_burst
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, page_id):
+        """Takes a token for a save of a page.
+
+        Returns (None, 0) if the save is allowed, otherwise the limit that
+        was hit ("page" or "global") and the seconds until a save is allowed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            if self.page_rate > 0:
+                bucket = self._pages.get(page_id)
+                if bucket is None:
+                    bucket = self._pages[page_id] = TokenBucket(self.page_rate, self.page_burst)
+                    if len(self._pages) > RATE_LIMIT_MAX_PAGES:
+                        self._pages.popitem(last=False)
+                self._pages.move_to_end(page_id)
+                buckets.append(("page", bucket))
+            if self._global is not None:
+                buckets.append(("global", self._global))
+            for scope, bucket in buckets:
+                wait = bucket.wait_time(now)
+                if wait:
+                    return scope, wait
+            # Only take tokens once all limits allow the save
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+        return None, 0
+
+save_rate_limiter = SaveRateLimiter(SAVE_RATE_PER_PAGE, SAVE_BURST_PER_PAGE, SAVE_RATE_GLOBAL, SAVE_BURST_GLOBAL)
+
 @app.route("/<page_id>/save", methods=["POST"])
 def save_page(page_id):
     """Saves the content of a page."""
@@ -390,22 +4381,106 @@ def save_page(page_id):
     if page_status == "disabled" and "admin_logged_in" not in session:
         return jsonify({"success": False, "message": "Page is disabled. Cannot save."}), 403
 
-    file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-    if not os.path.exists(os.path.dirname(file_path)): 
-        # This check is more for the directory, page file itself might not exist yet if it's a brand new save
-        # However, our current flow creates empty file on admin_create_page.
-        # If page_id is invalid or dir structure is broken, this could be an issue.
-        return jsonify({"success": False, "message": "Page data directory not found"}), 500 # Internal server error more likely
-    
+    limit, retry_after = save_rate_limiter.acquire(page_id)
+    if limit is not None:
+        metrics.inc("cryptpad_saves_rate_limited_total", scope=limit)
+        retry_after = max(math.ceil(retry_after), 1)
+        message = "This page is saved too often." if limit == "page" else "The server receives too many saves."
+        response = jsonify({"success": False, "message": f"{message} Try again in {retry_after} s.", "retry_after": retry_after})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    # Restores an archived page first, so that its backups are kept
+    page_available(page_id)
+
+    # Plain text bodies are streamed to disk instead of being parsed as JSON
+    if request.mimetype in ("text/plain", "application/octet-stream"):
+        return save_page_raw(page_id)
+
     try:
         data = request.get_json()
-        content = data.get("content", "")
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        return jsonify({"success": True, "message": "Page saved."})
+        base_revision = data.get("base_revision")
+        edits = data.get("edits")
+        skeleton = edits is not None and data.get("skeleton") is True # Edits of the skeleton from a skeleton load
+        appended = None
+        # The revision check and the write must not interleave with other writers of this page
+        with page_locks.lock(page_id):
+            if base_revision is None and edits is None:
+                # Legacy full-content save: last writer wins
+                content = data.get("content", "")
+            else:
+                if not storage.page_exists(page_id):
+                    return jsonify({"success": False, "message": "Page not found"}), 404
+                current_content, current_revision = read_page_content(page_id)
+                if base_revision is not None and base_revision != current_revision:
+                    return jsonify({
+                        "success": False,
+                        "conflict": True,
+                        "revision": current_revision,
+                        "message": "Page was changed by someone else since it was loaded.",
+                    }), 409
+                if edits is None:
+                    content = data.get("content", "")
+                else:
+                    try:
+                        if skeleton:
+                            edits = skeleton_edits_to_raw(page_id, current_content, edits)
+                        content, appended = apply_page_edits(current_content, edits)
+                    except (ValueError, UnicodeError) as e:
+                        return jsonify({"success": False, "message": f"Invalid edits: {e}"}), 400
+            revision = write_page_content(page_id, content, appended=appended, edits=edits)
+        response = {"success": True, "message": "Page saved.", "revision": revision}
+        if skeleton:
+            # Lets the editor check that it numbers the sections of the new skeleton as the server does
+            response["token_count"] = sum(1 for _ in ENC_TOKEN_PATTERN.finditer(content))
+        return jsonify(response)
+    except PageTooLarge as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+    except HTTPException: # e.g. a body over MAX_CONTENT_LENGTH
+        raise
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+def save_page_raw(page_id):
+    """Saves the raw request body as the content of a page.
+
+    The body may be gzip-compressed (Content-Encoding: gzip). It is streamed
+    into a staging file that replaces the page atomically, so memory use does
+    not grow with the page size. An If-Match header with the revision the
+    client started from rejects conflicting saves, like base_revision does
+    for JSON saves.
+    """
+    content_encoding = request.headers.get("Content-Encoding", "identity").lower()
+    if content_encoding not in ("identity", "gzip"):
+        return jsonify({"success": False, "message": f"Unsupported Content-Encoding: {content_encoding}"}), 415
+    try:
+        staged = stage_page_upload(request.stream, content_encoding)
+    except PageTooLarge as e:
+        return jsonify({"success": False, "message": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid request body: {e}"}), 400
+
+    try:
+        with page_locks.lock(page_id):
+            if request.if_match:
+                current_revision = current_page_revision(page_id)
+                if current_revision is None:
+                    return jsonify({"success": False, "message": "Page not found"}), 404
+                if not request.if_match.contains_weak(current_revision):
+                    return jsonify({
+                        "success": False,
+                        "conflict": True,
+                        "revision": current_revision,
+                        "message": "Page was changed by someone else since it was loaded.",
+                    }), 409
+            revision = write_staged_page(page_id, staged)
+        return jsonify({"success": True, "message": "Page saved.", "revision": revision})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        staged.discard() # No-op once the staging file has been moved into place
+
 @app.route("/<page_id>/load", methods=["GET"])
 def load_page(page_id):
     """Loads the content of a page."""
@@ -414,16 +4489,137 @@ def load_page(page_id):
     if page_status == "disabled" and "admin_logged_in" not in session:
         return jsonify({"success": False, "message": "Page is disabled. Cannot load."}), 403
 
-    file_path = os.path.join(DATA_DIR, f"{page_id}.md")
-    if not os.path.exists(file_path):
+    st = storage.page_stat(page_id)
+    if st is None and restore_archived_page(page_id):
+        st = storage.page_stat(page_id)
+    if st is None:
         return jsonify({"success": False, "message": "Page not found"}), 404
-    
+
+    # mode=skeleton: encrypted sections are replaced by labels and fetched from /blobs when needed
+    skeleton = request.args.get("mode") == "skeleton"
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return jsonify({"success": True, "content": content})
+        # Unchanged pages are answered from the revision cache without reading them
+        revision = page_revisions.cached(page_id, st)
+        if revision is not None and is_not_modified(f"{revision}-skeleton" if skeleton else revision, st.st_mtime):
+            response = Response(status=304)
+        elif skeleton:
+            content, token_sizes, revision, st = read_page_skeleton(page_id)
+            response = jsonify({"success": True, "skeleton": content, "token_sizes": token_sizes, "revision": revision})
+        else:
+            data, st = storage.read_page(page_id)
+            revision = page_revisions.remember(page_id, st, data)
+            response = jsonify({"success": True, "content": data.decode("utf-8"), "revision": revision})
+        response.set_etag(f"{revision}-skeleton" if skeleton else revision, weak=True)
+        if is_last_modified_reliable(st.st_mtime):
+            response.last_modified = st.st_mtime
+        response.cache_control.no_cache = True # Always revalidate with the server
+        return response
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/<page_id>/blobs", methods=["GET"])
+def load_page_blobs(page_id):
+    """Returns encrypted sections of a page by their label number in a skeleton load.
+
+    Takes the skeleton's ``revision`` and comma-separated label ``numbers``
+    and answers 409 if the page has changed since, as the numbers then no
+    longer refer to the same sections.
+    """
+    page_status = get_page_status(page_id)
+    if page_status == "disabled" and "admin_logged_in" not in session:
+        return jsonify({"success": False, "message": "Page is disabled. Cannot load."}), 403
+
+    try:
+        numbers = sorted({int(number) for number in request.args.get("numbers", "").split(",") if number})
+    except ValueError:
+        numbers = []
+    if not numbers:
+        return jsonify({"success": False, "message": "numbers must be a comma-separated list of label numbers."}), 400
+    try:
+        revision, tokens = read_page_tokens(page_id, numbers)
+    except FileNotFoundError:
+        return jsonify({"success": False, "message": "Page not found"}), 404
+    if revision != request.args.get("revision"):
+        return jsonify({
+            "success": False,
+            "conflict": True,
+            "revision": revision,
+            "message": "Page was changed by someone else since it was loaded.",
+        }), 409
+    if tokens is None:
+        return jsonify({"success": False, "message": "Unknown encrypted section."}), 400
+    response = jsonify({"success": True, "revision": revision, "tokens": {str(number): token for number, token in tokens.items()}})
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400 # Content for a given revision never changes
+    return response
+
+@app.route("/<page_id>/events", methods=["GET"])
+def page_events_stream(page_id):
+    """Streams change notifications for a page as server-sent events.
+
+    Events carry only metadata: "revision" ({revision, size}) after a save,
+    "status" ({status}) after the page is enabled/disabled and "deleted".
+    Clients fetch the content from /load only when they need it.
+
+    Under serve.py the connection is handed to the event stream hub, so an
+    open editor does not hold a request thread. Other servers stream from
+    the request thread, at most SSE_THREAD_STREAMS at a time per process;
+    beyond that the request is answered with 503 and the editor polls /load.
+    """
+    page_status = get_page_status(page_id)
+    if page_status == "disabled" and "admin_logged_in" not in session:
+        return jsonify({"success": False, "message": "Page is disabled."}), 403
+
+    st = storage.page_stat(page_id)
+    if st is None:
+        return jsonify({"success": False, "message": "Page not found"}), 404
+    last_stamp = stat_stamp(st)
+
+    hand_off = request.environ.get(SSE_HAND_OFF_KEY)
+    if hand_off is not None:
+        # The server passes the socket on once it is done with the request; the hub writes the response
+        hand_off(lambda sock: event_stream_hub.add(page_id, sock, last_stamp))
+        return Response(status=200, mimetype="text/event-stream")
+
+    if thread_event_streams is None or not thread_event_streams.acquire(blocking=False):
+        response = jsonify({"success": False, "message": "Too many open event streams. Poll /load instead."})
+        response.status_code = 503
+        response.retry_after = 60
+        return response
+
+    subscriber = page_events.subscribe(page_id)
+
+    def stream():
+        nonlocal last_stamp
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event, data = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                message, last_stamp = poll_page_change(page_id, last_stamp)
+                yield message or ": keepalive\n\n"
+                if last_stamp is None: # Deleted
+                    return
+                continue
+            if event == "revision":
+                st = storage.page_stat(page_id)
+                if st is not None:
+                    last_stamp = stat_stamp(st)
+            yield format_sse(event, data)
+            if event == "deleted":
+                return
+
+    def release():
+        page_events.unsubscribe(page_id, subscriber)
+        thread_event_streams.release()
+
+    response = Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no", # Disable response buffering in reverse proxies
+    })
+    # Runs even if the server closes the response before iterating it
+    response.call_on_close(release)
+    return response
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', debug=True)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+CryptPad Benchmark Suite
+
+Generates a synthetic instance (pages with plain and ENC<...> content plus
+backups) in a working directory and measures the latency and throughput of
+the main routes, either in-process through the Flask test client or against
+a running server. Results are written as JSON so that runs can be compared.
+
+Usage:
+    python benchmark.py --pages 1000 --backups 3 --output results.json
+    python benchmark.py --pages 10000 --concurrency 8 --compare results.json
+    python benchmark.py --workdir bench/ --pages 10000 --generate-only
+    python benchmark.py --workdir bench/ --skip-generate --target http://127.0.0.1:5000
+
+For --target, start the server from the same working directory with the
+same ADMIN_PASSWORD and STORAGE_BACKEND.
+"""
+
+import argparse
+import base64
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+from pathlib import Path
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+REPO_DIR = Path(__file__).resolve().parent
+SCENARIOS = ["load", "save", "editor", "admin", "download", "decrypt"]
+BENCHMARK_KEY = "benchmark"
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua account password server deploy notes"
+).split()
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process in KiB, if known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def make_enc_tokens(count: int, rng: random.Random) -> tuple:
+    """
+    Create a pool of ENC<...> tokens in both token formats.
+
+    If the cryptography library is installed, the tokens are really
+    encrypted with BENCHMARK_KEY so that decryption can be benchmarked too.
+
+    Returns:
+        Tuple of (list of tokens, whether they are decryptable)
+    """
+    cipher = None
+    if importlib.util.find_spec("cryptography") is not None:
+        import hashlib
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        cipher = AESGCM(hashlib.sha256(BENCHMARK_KEY.encode("utf-8")).digest())
+    tokens = []
+    for i in range(count):
+        plaintext = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))).encode("utf-8")
+        iv = secrets.token_bytes(12)
+        ciphertext = cipher.encrypt(iv, plaintext, None) if cipher else secrets.token_bytes(len(plaintext) + 16)
+        if i % 2:
+            body = base64.b64encode(json.dumps({"iv": list(iv), "ciphertext": list(ciphertext)}).encode("utf-8")).decode("ascii")
+        else:
+            body = base64.urlsafe_b64encode(bytes([2]) + iv + ciphertext).decode("ascii").rstrip("=")
+        tokens.append(f"ENC<{body}>")
+    return tokens, cipher is not None
+
+
+def make_page_content(index: int, size: int, enc_ratio: float, tokens: list, rng: random.Random) -> str:
+    """Build the content of a synthetic page of roughly ``size`` characters."""
+    parts = [f"Benchmark page {index}\n"]
+    length = len(parts[0])
+    encrypted = rng.random() < enc_ratio
+    while length < size:
+        if encrypted and rng.random() < 0.1:
+            part = f"secret: {rng.choice(tokens)}\n"
+        else:
+            part = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))) + "\n"
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def generate_instance(app_module, args, rng: random.Random) -> dict:
+    """
+    Fill the app's storage with synthetic pages and backups.
+
+    Returns:
+        Summary of the generated data
+    """
+    tokens, decryptable = make_enc_tokens(64, rng)
+    storage = app_module.storage
+    now = datetime.now()
+    total_bytes = 0
+    for index in range(args.pages):
+        page_id = f"bench{index:06d}"
+        content = make_page_content(index, args.page_size, args.enc_ratio, tokens, rng)
+        data = content.encode("utf-8")
+        storage.write_page(page_id, data)
+        total_bytes += len(data)
+        for backup in range(args.backups):
+            timestamp = (now - timedelta(hours=backup + 1)).strftime(app_module.BACKUP_TIMESTAMP_FORMAT)
+            app_module.add_backup_entry(page_id, data + f"\nrevision {backup}\n".encode("utf-8"), timestamp)
+        if index and index % 10000 == 0:
+            print(f"  generated {index} pages", file=sys.stderr)
+    app_module.page_catalog.rebuild()
+    return {"pages": args.pages, "backups_per_page": args.backups, "page_bytes": total_bytes, "decryptable": decryptable}
+
+
+class TestClientDriver:
+    """Sends requests through Flask test clients, one logged-in client per thread."""
+
+    def __init__(self, app_module):
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.app.test_client()
+            with client.session_transaction() as session:
+                session["admin_logged_in"] = True
+            self._local.client = client
+        return client
+
+    def request(self, method: str, path: str, payload=None) -> tuple:
+        """Send a request and return (status code, response body size)."""
+        response = self._client().open(path, method=method, json=payload)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+
+class HttpDriver:
+    """Sends requests to a running server, one logged-in cookie jar per thread."""
+
+    def __init__(self, base_url: str, password: str):
+        self.base_url = base_url.rstrip("/")
+        self.password = password
+        self._local = threading.local()
+
+    def _opener(self):
+        opener = getattr(self._local, "opener", None)
+        if opener is None:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+            form = urllib.parse.urlencode({"password": self.password}).encode("ascii")
+            opener.open(f"{self.base_url}/admin/login", data=form).read()
+            self._local.opener = opener
+        return opener
+
+    def request(self, method: str, path: str, payload=None) -> tuple:
+        """Send a request and return (status code, response body size)."""
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method)
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        try:
+            with self._opener().open(req) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+
+def summarize(latencies: list, errors: int, seconds: float, concurrency: int) -> dict:
+    """Compute latency percentiles (nearest rank) and throughput of a scenario."""
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000
+
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "throughput_per_second": round(len(ordered) / seconds, 1) if seconds else None,
+        "latency_ms": {
+            "p50": round(percentile(50), 3),
+            "p95": round(percentile(95), 3),
+            "p99": round(percentile(99), 3),
+            "mean": round(statistics.fmean(ordered) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+        } if ordered else None,
+    }
+
+
+def run_requests(driver, make_request, count: int, concurrency: int) -> dict:
+    """Run ``count`` requests built by ``make_request(i)`` with a thread pool."""
+    # Build all requests up front so the random choices do not depend on thread scheduling
+    planned = [make_request(i) for i in range(count)]
+
+    def timed(request):
+        method, path, payload, expected_status = request
+        started = time.perf_counter()
+        status, _ = driver.request(method, path, payload)
+        return time.perf_counter() - started, status != expected_status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, planned))
+    seconds = time.perf_counter() - started
+    return summarize([latency for latency, _ in results], sum(failed for _, failed in results), seconds, concurrency)
+
+
+def run_decrypt_benchmark(app_module, workdir: Path, page_ids: list, count: int, rng: random.Random) -> dict:
+    """Time decrypt_backup.process_file on generated page files."""
+    import decrypt_backup
+    files = []
+    for page_id in rng.sample(page_ids, min(count, len(page_ids))):
+        data, _ = app_module.storage.read_page(page_id)
+        path = workdir / "decrypt" / f"{page_id}.md"
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(data)
+        files.append(path)
+    latencies = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path in files:
+            file_started = time.perf_counter()
+            decrypt_backup.process_file(path, BENCHMARK_KEY)
+            latencies.append(time.perf_counter() - file_started)
+    return summarize(latencies, 0, time.perf_counter() - started, 1)
+
+
+def compare_results(baseline: dict, results: dict):
+    """Print the latency and throughput changes against an earlier run."""
+    print(f"\nComparison with run from {baseline.get('started_at')}:")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or not previous.get("latency_ms") or not current.get("latency_ms"):
+            continue
+        changes = []
+        for key in ("p50", "p95", "p99"):
+            before, after = previous["latency_ms"][key], current["latency_ms"][key]
+            change = (after - before) / before * 100 if before else 0.0
+            changes.append(f"{key} {before:.2f} -> {after:.2f} ms ({change:+.0f}%)")
+        print(f"  {name:9s} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the CryptPad application on a synthetic instance",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --pages 1000 --backups 3 --output results.json
+  %(prog)s --pages 10000 --concurrency 8 --compare results.json
+  %(prog)s --workdir bench/ --skip-generate --target http://127.0.0.1:5000
+        """
+    )
+    parser.add_argument('--pages', type=int, default=1000, help='Number of pages to generate (default: 1000)')
+    parser.add_argument('--backups', type=int, default=3, help='Backups per page (default: 3)')
+    parser.add_argument('--page-size', type=int, default=2000, help='Approximate page size in characters (default: 2000)')
+    parser.add_argument('--enc-ratio', type=float, default=0.5, help='Share of pages with ENC<...> sections (default: 0.5)')
+    parser.add_argument('--requests', '-n', type=int, default=500, help='Requests per scenario (default: 500)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help='Concurrent clients (default: 4)')
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS), help=f'Comma-separated scenarios (default: {",".join(SCENARIOS)})')
+    parser.add_argument('--storage', choices=['file', 'sqlite'], default='file', help='Storage backend (default: file)')
+    parser.add_argument('--workdir', type=Path, help='Directory for the synthetic instance (default: a temporary directory)')
+    parser.add_argument('--skip-generate', action='store_true', help='Use the existing instance in --workdir')
+    parser.add_argument('--generate-only', action='store_true', help='Only generate the instance in --workdir')
+    parser.add_argument('--target', help='Base URL of a running server started in --workdir (default: in-process test client)')
+    parser.add_argument('--password', default=os.environ.get("ADMIN_PASSWORD", "benchmark"), help='Admin password (default: $ADMIN_PASSWORD or "benchmark")')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    parser.add_argument('--output', '-o', type=Path, help='Write the results as JSON to this file')
+    parser.add_argument('--compare', type=Path, help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if (args.skip_generate or args.generate_only or args.target) and not args.workdir:
+        parser.error('--skip-generate, --generate-only and --target require --workdir')
+    output_path = args.output.resolve() if args.output else None
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+
+    temporary = None
+    if args.workdir:
+        workdir = args.workdir.resolve()
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="cryptpad-bench-")
+        workdir = Path(temporary.name)
+
+    # The app keeps its data relative to the working directory and reads its settings at import
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["ADMIN_PASSWORD"] = args.password
+    os.environ["BACKUP_INTERVAL_SECONDS"] = "0"
+    os.environ.setdefault("SAVE_RATE_PER_PAGE", "0") # Measure the save path, not the rate limiter
+    sys.path.insert(0, str(REPO_DIR))
+    import logging
+    import app as app_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+
+    if not args.skip_generate:
+        print(f"Generating {args.pages} pages with {args.backups} backups each in {workdir}", file=sys.stderr)
+        started = time.perf_counter()
+        results["instance"] = generate_instance(app_module, args, rng)
+        results["generate_seconds"] = round(time.perf_counter() - started, 3)
+    if args.generate_only:
+        print(f"Instance generated in {workdir}", file=sys.stderr)
+        return
+
+    page_ids = sorted(app_module.storage.list_page_ids())
+    if not page_ids:
+        parser.error(f"no pages found in {workdir}")
+    driver = HttpDriver(args.target, args.password) if args.target else TestClientDriver(app_module)
+    admin_pages = max(1, (len(page_ids) + app_module.ADMIN_PAGES_PER_PAGE - 1) // app_module.ADMIN_PAGES_PER_PAGE)
+    save_content = make_page_content(0, args.page_size, args.enc_ratio, make_enc_tokens(8, rng)[0], rng)
+    requests_by_scenario = {
+        "load": lambda i: ("GET", f"/{rng.choice(page_ids)}/load", None, 200),
+        "save": lambda i: ("POST", f"/{rng.choice(page_ids)}/save", {"content": save_content}, 200),
+        "editor": lambda i: ("GET", f"/{rng.choice(page_ids)}", None, 200),
+        "admin": lambda i: ("GET", f"/admin?page={rng.randint(1, admin_pages)}", None, 200),
+        "download": lambda i: ("GET", f"/admin/download_page/{rng.choice(page_ids)}", None, 200),
+    }
+
+    for name in scenarios:
+        print(f"Running {name}...", file=sys.stderr)
+        if name == "decrypt":
+            if importlib.util.find_spec("cryptography") is None:
+                print("  skipped: cryptography is not installed", file=sys.stderr)
+                continue
+            results["scenarios"][name] = run_decrypt_benchmark(app_module, workdir, page_ids, args.requests, rng)
+        else:
+            results["scenarios"][name] = run_requests(driver, requests_by_scenario[name], args.requests, args.concurrency)
+
+    results["peak_rss_kb"] = peak_rss_kb()
+
+    print(f"\n{'scenario':9s} {'requests':>8s} {'errors':>6s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for name, summary in results["scenarios"].items():
+        latency = summary["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}
+        print(f"{name:9s} {summary['requests']:8d} {summary['errors']:6d} {summary['throughput_per_second'] or 0:9.1f} "
+              f"{latency['p50']:8.2f} {latency['p95']:8.2f} {latency['p99']:8.2f}")
+    if results["peak_rss_kb"] is not None:
+        print(f"Peak RSS: {results['peak_rss_kb'] / 1024:.1f} MiB" + (" (benchmark client only)" if args.target else ""))
+
+    if baseline:
+        compare_results(baseline, results)
+    if output_path:
+        output_path.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {output_path}")
+
+    if temporary:
+        os.chdir(REPO_DIR)
+        temporary.cleanup()
+
+
+if __name__ == '__main__':
+    main()
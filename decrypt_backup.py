@@ -9,20 +9,29 @@ using the same AES-GCM encryption algorithm as the web application.
 Usage:
     python decrypt_backup.py <backup_file> --key <encryption_key>
     python decrypt_backup.py <backup_file> --key <encryption_key> --output <output_file>
+    python decrypt_backup.py <backup_file> --key <encryption_key> --stream [--output <output_file>]
+    python decrypt_backup.py <dir_or_glob>... --key <encryption_key> --output-dir <dir>
 
 Example:
     python decrypt_backup.py backup/qkjf/qkjf_20250518141635.md --key "mypassword"
+    python decrypt_backup.py backup/ --key "mypassword" --output-dir restored/
 """
 
 import argparse
 import base64
+import glob
 import json
 import hashlib
+import os
 import re
 import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 try:
+    from cryptography.exceptions import InvalidTag
     from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 except ImportError:
     print("Error: cryptography library not found.")
@@ -38,13 +47,48 @@ def derive_key(password: str) -> bytes:
     return hashlib.sha256(password.encode('utf-8')).digest()
 
 
-def decrypt_enc_string(enc_string: str, key: bytes) -> str:
+ENC_PATTERN = re.compile(r'ENC<[^>]+>')
+ENC_TOKEN_VERSION = 2
+ENC_IV_LENGTH = 12
+ENC_BODY_CHARS = rb'[A-Za-z0-9+/=_-]'  # base64 (v1 tokens) and base64url (v2 tokens)
+ENC_BODY_RUN_BYTES = re.compile(ENC_BODY_CHARS + rb'*')
+ENC_STREAM_PATTERN_BYTES = re.compile(rb'ENC<' + ENC_BODY_CHARS + rb'+>')
+ENC_UNFINISHED_PATTERN_BYTES = re.compile(rb'ENC<' + ENC_BODY_CHARS + rb'*\Z')
+STREAM_CHUNK_SIZE = 1024 * 1024
+MAX_TOKEN_SIZE = 64 * 1024 * 1024
+
+
+def parse_enc_payload(base64_data: str) -> tuple:
+    """
+    Extract the IV and ciphertext from the body of an ENC<...> string.
+    
+    Version 1 bodies are base64-encoded JSON with the IV and ciphertext as
+    integer lists (they always start with "eyJ"). Version 2 bodies are
+    unpadded base64url of a version byte, the 12-byte IV and the ciphertext.
+    
+    Returns:
+        Tuple of (iv, ciphertext) bytes
+        
+    Raises:
+        ValueError: If the body is not a valid token of either version
+    """
+    if base64_data.startswith('eyJ'):
+        encrypted_data = json.loads(base64.b64decode(base64_data).decode('utf-8'))
+        return bytes(encrypted_data['iv']), bytes(encrypted_data['ciphertext'])
+    
+    data = base64.urlsafe_b64decode(base64_data + '=' * (-len(base64_data) % 4))
+    if len(data) <= 1 + ENC_IV_LENGTH or data[0] != ENC_TOKEN_VERSION:
+        raise ValueError("unsupported token version or truncated token")
+    return data[1:1 + ENC_IV_LENGTH], data[1 + ENC_IV_LENGTH:]
+
+
+def decrypt_enc_string(enc_string: str, key) -> str:
     """
     Decrypt a single ENC<...> string.
     
     Args:
-        enc_string: The encrypted string in format ENC<base64_json>
-        key: The derived AES key (32 bytes)
+        enc_string: The encrypted string in format ENC<base64_json> or ENC<base64url>
+        key: The derived AES key (32 bytes), or an AESGCM cipher to reuse
         
     Returns:
         Decrypted plaintext string
@@ -60,23 +104,53 @@ def decrypt_enc_string(enc_string: str, key: bytes) -> str:
     base64_data = enc_string[4:-1]  # Remove ENC< and >
     
     try:
-        # Decode base64 and parse JSON
-        encrypted_data = json.loads(base64.b64decode(base64_data).decode('utf-8'))
-        
         # Extract IV and ciphertext
-        iv = bytes(encrypted_data['iv'])
-        ciphertext = bytes(encrypted_data['ciphertext'])
+        iv, ciphertext = parse_enc_payload(base64_data)
         
         # Decrypt using AES-GCM
-        aesgcm = AESGCM(key)
+        aesgcm = key if isinstance(key, AESGCM) else AESGCM(key)
         plaintext = aesgcm.decrypt(iv, ciphertext, None)
         
         return plaintext.decode('utf-8')
         
-    except (json.JSONDecodeError, KeyError, ValueError) as e:
+    except InvalidTag:
+        raise ValueError("Failed to decrypt ENC string: wrong key or corrupted data")
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
         raise ValueError(f"Failed to decrypt ENC string: {e}")
 
 
+def decrypt_text(content: str, cipher: AESGCM, on_section=None) -> tuple:
+    """
+    Decrypt all ENC<...> strings of a text in a single pass.
+    
+    Args:
+        content: Text containing encrypted strings
+        cipher: AESGCM cipher for the derived key
+        on_section: Optional callback called with None on success or the
+            error of a section that could not be decrypted
+        
+    Returns:
+        Tuple of (decrypted text, number of sections, number decrypted)
+    """
+    counts = [0, 0]
+
+    def replace(match):
+        counts[0] += 1
+        try:
+            decrypted_text = decrypt_enc_string(match.group(0), cipher)
+        except ValueError as e:
+            if on_section:
+                on_section(e)
+            # Keep the original ENC string in the output
+            return match.group(0)
+        counts[1] += 1
+        if on_section:
+            on_section(None)
+        return decrypted_text
+
+    return ENC_PATTERN.sub(replace, content), counts[0], counts[1]
+
+
 def process_file(file_path: Path, encryption_key: str) -> str:
     """
     Process a backup file and decrypt all ENC<...> strings.
@@ -89,7 +163,7 @@ def process_file(file_path: Path, encryption_key: str) -> str:
         File content with all encrypted strings decrypted
     """
     # Derive key from password
-    key = derive_key(encryption_key)
+    cipher = AESGCM(derive_key(encryption_key))
     
     # Read file content
     try:
@@ -98,32 +172,278 @@ def process_file(file_path: Path, encryption_key: str) -> str:
     except IOError as e:
         raise IOError(f"Failed to read file {file_path}: {e}")
     
-    # Find all ENC<...> patterns
-    enc_pattern = re.compile(r'ENC<[^>]+>')
-    matches = enc_pattern.findall(content)
+    decryption_count = 0
+
+    def report(error):
+        nonlocal decryption_count
+        if error is None:
+            decryption_count += 1
+            print(f"  ✓ Decrypted section {decryption_count}")
+        else:
+            print(f"  ✗ Failed to decrypt section: {error}")
+
+    decrypted_content, section_count, _ = decrypt_text(content, cipher, report)
     
-    if not matches:
+    if not section_count:
         print(f"No encrypted content found in {file_path}")
         return content
     
-    print(f"Found {len(matches)} encrypted sections in {file_path}")
+    print(f"Successfully decrypted {decryption_count}/{section_count} sections in {file_path}")
+    return decrypted_content
+
+
+def stream_decrypt(source, destination, cipher: AESGCM, chunk_size: int = STREAM_CHUNK_SIZE) -> tuple:
+    """
+    Decrypt ENC<...> strings while copying a binary stream.
     
-    # Decrypt each ENC string
-    decrypted_content = content
-    decryption_count = 0
+    The input is read in fixed-size chunks and text is written as soon as
+    it cannot be part of a token. An ENC< marker is only held back while
+    the bytes after it are base64 characters, up to MAX_TOKEN_SIZE, so
+    memory use does not depend on the file size. Tokens must therefore be
+    ENC< followed by base64 (or base64url) characters and >, as the web
+    application writes them.
     
-    for enc_string in matches:
+    Args:
+        source: Binary file object to read from
+        destination: Binary file object to write to
+        cipher: AESGCM cipher for the derived key
+        chunk_size: Number of bytes read at a time
+        
+    Returns:
+        Tuple of (bytes read, number of sections, number decrypted)
+    """
+    counts = [0, 0]
+
+    def replace(match):
+        counts[0] += 1
         try:
-            decrypted_text = decrypt_enc_string(enc_string, key)
-            decrypted_content = decrypted_content.replace(enc_string, decrypted_text)
-            decryption_count += 1
-            print(f"  ✓ Decrypted section {decryption_count}")
-        except ValueError as e:
-            print(f"  ✗ Failed to decrypt section: {e}")
+            decrypted_text = decrypt_enc_string(match.group(0).decode('ascii'), cipher)
+        except ValueError:
             # Keep the original ENC string in the output
+            return match.group(0)
+        counts[1] += 1
+        return decrypted_text.encode('utf-8')
+
+    bytes_read = 0
+    token = []  # Parts of an unfinished token, starting with its ENC< marker
+    token_size = 0
+    carry = b''  # A trailing 'E', 'EN' or 'ENC' that may start a token
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        bytes_read += len(chunk)
+        if token:
+            end = ENC_BODY_RUN_BYTES.match(chunk).end()
+            if end == len(chunk):
+                token.append(chunk)
+                token_size += len(chunk)
+                if token_size > MAX_TOKEN_SIZE:
+                    # Too long to be a real token: pass it through
+                    text = b''.join(token)
+                    destination.write(text[:-3])
+                    carry = text[-3:]
+                    token = []
+                continue
+            if chunk[end:end + 1] == b'>':
+                token.append(chunk[:end + 1])
+                destination.write(ENC_STREAM_PATTERN_BYTES.sub(replace, b''.join(token)))
+                chunk = chunk[end + 1:]
+            else:
+                # Not a token: the marker is followed by a non-base64 character, which
+                # may end another marker that starts in the token's last bytes
+                text = b''.join(token)
+                destination.write(text[:-3])
+                chunk = text[-3:] + chunk
+            token = []
+        elif carry:
+            chunk = carry + chunk
+            carry = b''
+
+        # Every marker but one followed only by base64 characters up to the end is settled
+        unfinished = ENC_UNFINISHED_PATTERN_BYTES.search(chunk)
+        if unfinished:
+            cut = unfinished.start()
+            token = [chunk[cut:]]
+            token_size = len(token[0])
+        else:
+            cut = len(chunk)
+            for prefix_length in (3, 2, 1):
+                if chunk.endswith(b'ENC<'[:prefix_length]):
+                    cut -= prefix_length
+                    break
+            carry = chunk[cut:]
+        destination.write(ENC_STREAM_PATTERN_BYTES.sub(replace, chunk[:cut]))
+    # An unterminated marker at the end is not a token
+    destination.write(b''.join(token) + carry)
+    return bytes_read, counts[0], counts[1]
+
+
+def process_file_streaming(file_path: Path, encryption_key: str, output_path: Path = None) -> tuple:
+    """
+    Decrypt a file of any size to an output file or stdout in constant memory.
     
-    print(f"Successfully decrypted {decryption_count}/{len(matches)} sections")
-    return decrypted_content
+    Args:
+        file_path: Path to the backup file
+        encryption_key: The encryption password
+        output_path: Output file path (stdout if None)
+        
+    Returns:
+        Tuple of (bytes read, number of sections, number decrypted, seconds)
+    """
+    cipher = AESGCM(derive_key(encryption_key))
+    start = time.perf_counter()
+    with open(file_path, 'rb') as source:
+        if output_path is None:
+            result = stream_decrypt(source, sys.stdout.buffer, cipher)
+            sys.stdout.buffer.flush()
+        else:
+            with open(output_path, 'wb') as destination:
+                result = stream_decrypt(source, destination, cipher)
+    return result + (time.perf_counter() - start,)
+
+
+def find_batch_jobs(inputs: list, output_dir: Path) -> list:
+    """
+    Collect the files to decrypt from files, directories and glob patterns.
+    
+    Directories are searched recursively for page files (*.md) and backup
+    manifests. Every backup listed in a ``backup/<page_id>/manifest.json``
+    is read from the blob store next to it (``backup/.blobs``) and written as
+    ``<page_id>/<page_id>_<timestamp>.md``. Outputs mirror the input tree
+    below ``output_dir``.
+    
+    Args:
+        inputs: Paths or glob patterns (e.g. ``backup/**``)
+        output_dir: Root of the output tree
+        
+    Returns:
+        List of (source, blob_hash, output_path) jobs; blob_hash is None for
+        plain files
+    """
+    jobs = []
+    seen = set()
+
+    def add_file(path: Path, base: Path):
+        if path in seen:
+            return
+        seen.add(path)
+        relative = path.relative_to(base)
+        if path.name == 'manifest.json':
+            with open(path, 'r', encoding='utf-8') as f:
+                backups = json.load(f).get('backups', [])
+            page_id = path.parent.name
+            blob_dir = path.parent.parent / '.blobs'
+            for entry in backups:
+                digest = entry['hash']
+                jobs.append((
+                    blob_dir / digest[:2] / f"{digest}.z",
+                    digest,
+                    output_dir / relative.parent / f"{page_id}_{entry['timestamp']}.md",
+                ))
+        elif path.suffix == '.md':
+            jobs.append((path, None, output_dir / relative))
+
+    def add_tree(path: Path, base: Path):
+        if path.is_file():
+            add_file(path, base)
+            return
+        for root, dirs, files in os.walk(path):
+            # Blobs are only read through their manifests
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                add_file(Path(root) / name, base)
+
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            # Mirror the tree below the part of the pattern without wildcards
+            base_parts = []
+            for part in Path(pattern).parts:
+                if glob.has_magic(part):
+                    break
+                base_parts.append(part)
+            base = Path(*base_parts) if base_parts else Path('.')
+            for match in sorted(glob.glob(pattern, recursive=True)):
+                add_tree(Path(match), base)
+        else:
+            path = Path(pattern)
+            if not path.exists():
+                raise IOError(f"File {path} does not exist")
+            add_tree(path, path if path.is_dir() else path.parent)
+    return jobs
+
+
+_worker_cipher = None
+
+
+def _init_worker(encryption_key: str):
+    """Derive the key once per worker process."""
+    global _worker_cipher
+    _worker_cipher = AESGCM(derive_key(encryption_key))
+
+
+def decrypt_job(job: tuple) -> tuple:
+    """
+    Decrypt one batch job and write its output file.
+    
+    Returns:
+        Tuple of (output path, number of sections, number decrypted, error
+        message or None)
+    """
+    source, blob_hash, output_path = job
+    try:
+        with open(source, 'rb') as f:
+            data = f.read()
+        if blob_hash is not None:
+            data = zlib.decompress(data)
+            if hashlib.sha256(data).hexdigest() != blob_hash:
+                raise ValueError(f"backup blob {blob_hash} is corrupted")
+        decrypted_content, section_count, decryption_count = decrypt_text(data.decode('utf-8'), _worker_cipher)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(decrypted_content)
+    except (IOError, ValueError, zlib.error) as e:
+        return str(output_path), 0, 0, f"{source}: {e}"
+    return str(output_path), section_count, decryption_count, None
+
+
+def process_batch(inputs: list, encryption_key: str, output_dir: Path, jobs: int = None) -> bool:
+    """
+    Decrypt many files in parallel into a mirrored output tree.
+    
+    Args:
+        inputs: Files, directories or glob patterns
+        encryption_key: The encryption password
+        output_dir: Root of the output tree
+        jobs: Number of worker processes (default: number of CPUs)
+        
+    Returns:
+        True if every file was processed without errors
+    """
+    batch_jobs = find_batch_jobs(inputs, output_dir)
+    if not batch_jobs:
+        print("No files to decrypt found")
+        return True
+    
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(batch_jobs)))
+    print(f"Decrypting {len(batch_jobs)} files with {workers} worker process{'es' if workers != 1 else ''} into {output_dir}")
+    
+    failed_files = total_sections = total_decrypted = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(encryption_key,)) as executor:
+        chunksize = max(1, len(batch_jobs) // (workers * 4))
+        for output_path, section_count, decryption_count, error in executor.map(decrypt_job, batch_jobs, chunksize=chunksize):
+            if error:
+                failed_files += 1
+                print(f"  ✗ {error}")
+                continue
+            total_sections += section_count
+            total_decrypted += decryption_count
+            if decryption_count < section_count:
+                print(f"  ✗ {output_path}: decrypted {decryption_count}/{section_count} sections")
+    
+    print(f"Processed {len(batch_jobs) - failed_files}/{len(batch_jobs)} files, "
+          f"decrypted {total_decrypted}/{total_sections} sections")
+    return failed_files == 0
 
 
 def main():
@@ -134,13 +454,17 @@ def main():
 Examples:
   %(prog)s backup/qkjf/qkjf_20250518141635.md --key "mypassword"
   %(prog)s backup/qkjf/qkjf_20250518141635.md --key "mypassword" --output decrypted.txt
+  %(prog)s huge_page.md --key "mypassword" --stream --output decrypted.txt
+  %(prog)s backup/ --key "mypassword" --output-dir restored/
+  %(prog)s 'export/**/*.md' --key "mypassword" --output-dir restored/ --jobs 8
         """
     )
     
     parser.add_argument(
-        'file',
-        type=Path,
-        help='Path to the backup file to decrypt'
+        'files',
+        nargs='+',
+        metavar='file',
+        help='Path to the backup file to decrypt; with --output-dir also directories or glob patterns'
     )
     
     parser.add_argument(
@@ -155,8 +479,42 @@ Examples:
         help='Output file path (if not specified, prints to stdout)'
     )
     
+    parser.add_argument(
+        '--output-dir', '-d',
+        type=Path,
+        help='Batch mode: decrypt all given files, directories and globs into a mirrored tree below this directory'
+    )
+    
+    parser.add_argument(
+        '--stream', '-s',
+        action='store_true',
+        help='Decrypt a single file chunk by chunk in constant memory and report throughput'
+    )
+    
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        help='Batch mode: number of worker processes (default: number of CPUs)'
+    )
+    
     args = parser.parse_args()
     
+    if args.output_dir:
+        if args.output:
+            parser.error('--output cannot be combined with --output-dir')
+        if args.stream:
+            parser.error('--stream cannot be combined with --output-dir')
+        try:
+            success = process_batch(args.files, args.key, args.output_dir, args.jobs)
+        except (IOError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit(0 if success else 1)
+    
+    if len(args.files) > 1:
+        parser.error('multiple inputs require --output-dir')
+    args.file = Path(args.files[0])
+    
     # Validate input file
     if not args.file.exists():
         print(f"Error: File {args.file} does not exist")
@@ -166,6 +524,22 @@ Examples:
         print(f"Error: {args.file} is not a file")
         sys.exit(1)
     
+    if args.stream:
+        # Keep stdout clean for the decrypted content when no output file is given
+        log = sys.stdout if args.output else sys.stderr
+        try:
+            bytes_read, section_count, decryption_count, seconds = process_file_streaming(args.file, args.key, args.output)
+        except IOError as e:
+            print(f"Error: {e}", file=log)
+            sys.exit(1)
+        seconds = max(seconds, 1e-9)
+        megabytes = bytes_read / (1024 * 1024)
+        print(f"Decrypted {decryption_count}/{section_count} sections from {megabytes:.1f} MB in {seconds:.2f}s "
+              f"({megabytes / seconds:.1f} MB/s, {section_count / seconds:.0f} sections/s)", file=log)
+        if args.output:
+            print(f"Decrypted content saved to: {args.output}")
+        return
+    
     try:
         # Process the file
         print(f"Processing: {args.file}")
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+CryptPad Production Server
+
+Runs the application on several worker processes that share one listening
+socket, each handling requests on a fixed pool of threads with HTTP/1.1
+keep-alive. Connections wait for their next request outside the pool, and
+page change notification streams are handed to the app's event stream hub,
+so neither holds a thread. The
+master process restarts workers that die and reloads all workers without
+dropping connections on SIGHUP.
+
+Usage:
+    python serve.py --workers 4 --threads 16 --port 5000
+
+Signals (sent to the master process):
+    SIGHUP           start new workers with freshly loaded code, then stop the old ones
+    SIGTERM, SIGINT  stop gracefully
+
+Set ADMIN_PASSWORD and FLASK_SECRET_KEY in production. If they are not
+set, the generated values in data/.secrets.json are shared by all workers.
+"""
+
+import argparse
+import collections
+import io
+import logging
+import os
+import queue
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+LISTEN_FD_ENV = "CRYPTPAD_SERVE_FD"
+OLD_WORKERS_ENV = "CRYPTPAD_SERVE_OLD_WORKERS"
+HAND_OFF_ENVIRON_KEY = "cryptpad.hand_off" # Must match SSE_HAND_OFF_KEY in app.py
+
+
+def load_app():
+    """Import the Flask application from app.py next to this script."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import app
+    return app
+
+
+class RequestBody(io.RawIOBase):
+    """Reads a request body of known length from a connection, and nothing after it.
+
+    werkzeug reads whatever the client sent after its response, which would
+    swallow the next request on a kept-alive connection.
+    """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.rfile.read1(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+class RequestHandler(WSGIRequestHandler):
+    """HTTP/1.1 request handler with keep-alive that lets the app take over a connection.
+
+    Unlike socketserver's handlers, one instance serves all requests of a
+    connection: the server calls handle() once per request and parks the
+    connection in between (see PooledWSGIServer), and calls finish() when
+    it closes the connection. werkzeug's "Connection: close" is dropped
+    while the request allows keep-alive and its body has a known length.
+
+    The app can call environ[HAND_OFF_ENVIRON_KEY](callback) to get the
+    connection instead: nothing of its response is written, and the server
+    passes the socket to callback(sock) once the request is done, without
+    closing it.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = 15 # Seconds a request may take to arrive once it has started
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.hand_off_callback = None
+        self.keep_alive = False
+        self.setup()
+
+    def handle_one_request(self):
+        self.keep_alive = False
+        super().handle_one_request()
+        keep_alive = self.keep_alive and not self.close_connection and self.hand_off_callback is None
+        self.keep_alive = keep_alive
+        self.close_connection = True # Leaves werkzeug's request loop; the server waits for the next request
+
+    def run_wsgi(self):
+        # parse_request() has set close_connection from the request's version and Connection header
+        length = self.headers.get("Content-Length", "0")
+        if self.close_connection or "chunked" in self.headers.get("Transfer-Encoding", "").lower() or not length.isdigit():
+            super().run_wsgi()
+            return
+        rfile, body = self.rfile, RequestBody(self.rfile, int(length))
+        self.keep_alive = True
+        self.rfile = io.BufferedReader(body)
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = rfile
+        if body.remaining > 0: # The app did not read the whole body
+            self.keep_alive = False
+
+    def send_header(self, keyword, value):
+        if self.keep_alive and keyword.lower() == "connection" and value.lower() == "close":
+            return
+        super().send_header(keyword, value)
+
+    def has_buffered_request(self):
+        """Whether the next request has been read into the buffer already (e.g. pipelined)."""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[HAND_OFF_ENVIRON_KEY] = self.hand_off
+        return environ
+
+    def hand_off(self, callback):
+        self.hand_off_callback = callback
+        self.close_connection = True
+        self.keep_alive = False
+        self.wfile = io.BytesIO() # Discards the response werkzeug still writes
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server that handles requests on a fixed pool of threads.
+
+    New connections, and kept-alive connections between their requests,
+    wait in a selector until a request arrives, and only then take a pool
+    thread. Connections that send nothing for ``idle_timeout`` seconds are
+    closed.
+    """
+
+    multithread = True
+
+    def __init__(self, *args, threads=8, idle_timeout=15, **kwargs):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+        self.idle_timeout = idle_timeout
+        self._parked = queue.SimpleQueue()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_writer.setblocking(False)
+        self._waiting = selectors.DefaultSelector()
+        self._waiting.register(self._wake_reader, selectors.EVENT_READ)
+        self._stop_waiting = False
+        kwargs.setdefault("handler", RequestHandler)
+        super().__init__(*args, **kwargs)
+        self._waiter = threading.Thread(target=self._wait_for_requests, name="connections", daemon=True)
+        self._waiter.start()
+
+    def process_request(self, request, client_address):
+        self._park(request, client_address, None)
+
+    def _park(self, request, client_address, handler):
+        """Lets a connection wait for its next request without holding a thread."""
+        if self._stop_waiting:
+            self._close(request, handler)
+            return
+        self._parked.put((request, client_address, handler))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass # A wake-up is pending already
+
+    def _close(self, request, handler):
+        if handler is not None:
+            try:
+                handler.finish()
+            except OSError:
+                pass
+        self.shutdown_request(request)
+
+    def _wait_for_requests(self):
+        """Dispatches connections to the pool once they are readable."""
+        deadlines = collections.deque() # (deadline, request) in the order the connections were parked
+        while not self._stop_waiting:
+            timeout = max(deadlines[0][0] - time.monotonic(), 0) if deadlines else None
+            for key, _ in self._waiting.select(timeout):
+                if key.fileobj is self._wake_reader:
+                    self._wake_reader.recv(4096)
+                    continue
+                self._waiting.unregister(key.fileobj)
+                client_address, handler, _ = key.data
+                self._pool.submit(self._process_request_thread, key.fileobj, client_address, handler)
+            while True:
+                try:
+                    request, client_address, handler = self._parked.get_nowait()
+                except queue.Empty:
+                    break
+                deadline = time.monotonic() + self.idle_timeout
+                self._waiting.register(request, selectors.EVENT_READ, (client_address, handler, deadline))
+                deadlines.append((deadline, request))
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                deadline, request = deadlines.popleft()
+                key = self._waiting.get_map().get(request) if request.fileno() != -1 else None
+                # Still waiting since it was parked with this deadline
+                if key is not None and key.fileobj is request and key.data[2] == deadline:
+                    self._waiting.unregister(request)
+                    self._close(request, key.data[1])
+        for key in list(self._waiting.get_map().values()):
+            if key.fileobj is not self._wake_reader:
+                self._close(key.fileobj, key.data[1])
+        self._waiting.close()
+
+    def _process_request_thread(self, request, client_address, handler=None):
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            while True:
+                handler.handle()
+                if not handler.keep_alive or not handler.has_buffered_request():
+                    break
+        except Exception:
+            self.handle_error(request, client_address)
+            self._close(request, handler)
+            return
+        if handler.keep_alive:
+            self._park(request, client_address, handler)
+            return
+        hand_off_callback = handler.hand_off_callback
+        if hand_off_callback is None:
+            self._close(request, handler)
+            return
+        handler.finish()
+        try:
+            hand_off_callback(request)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stop_waiting = True
+            self._wake()
+            self._waiter.join()
+            # Let requests in progress finish
+            self._pool.shutdown(wait=True)
+
+
+def run_worker(listen_socket: socket.socket, app, args):
+    """Serve requests in a worker process until SIGTERM."""
+    if hasattr(os, "fork"):
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # The master handles Ctrl+C
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    if app is None:
+        app = load_app()
+    RequestHandler.timeout = args.idle_timeout
+    host, port = listen_socket.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, handler=RequestHandler, threads=args.threads,
+                              idle_timeout=args.idle_timeout, fd=listen_socket.fileno())
+    # Another worker may accept a connection first; don't block in accept() then
+    server.socket.setblocking(False)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    logging.info(f"Worker {os.getpid()} serving on {host}:{port} with {args.threads} threads")
+    server.serve_forever()
+
+
+class Master:
+    """Starts and supervises the worker processes."""
+
+    def __init__(self, listen_socket: socket.socket, app, args):
+        self.listen_socket = listen_socket
+        self.app = app
+        self.args = args
+        self.workers = set()
+        self.retiring = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.listen_socket, self.app, self.args)
+            except Exception:
+                logging.exception("Worker failed")
+                os._exit(1)
+            os._exit(0)
+        self.workers.add(pid)
+
+    def signal_workers(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """Collect exited workers; returns the pids of workers that died unexpectedly."""
+        died = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.workers:
+                self.workers.discard(pid)
+                died.append(pid)
+                if not self.stopping:
+                    logging.warning(f"Worker {pid} exited with status {status}, starting a new one")
+            self.retiring.discard(pid)
+        return died
+
+    def reload(self):
+        """Re-executes the master with the same socket; the new master then retires these workers."""
+        logging.info("Reloading: starting a new master with fresh code")
+        os.environ[LISTEN_FD_ENV] = str(self.listen_socket.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(str(pid) for pid in self.workers | self.retiring)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        for _ in range(self.args.workers):
+            self.spawn_worker()
+
+        # Workers of the previous master (after a reload) are still our children; stop them
+        # only now that the new workers are accepting connections
+        old_workers = {int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid}
+        os.environ.pop(LISTEN_FD_ENV, None)
+        if old_workers:
+            self.retiring.update(old_workers)
+            self.signal_workers(old_workers, signal.SIGTERM)
+
+        host, port = self.listen_socket.getsockname()[:2]
+        logging.info(f"Master {os.getpid()} listening on http://{host}:{port} with {self.args.workers} workers")
+        while not self.stopping:
+            if self.reloading:
+                self.reload()
+            for _ in self.reap():
+                self.spawn_worker()
+                time.sleep(0.1) # Avoid a tight loop if workers keep failing at startup
+            time.sleep(0.2)
+
+        logging.info("Stopping workers")
+        self.signal_workers(self.workers | self.retiring, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if self.workers or self.retiring:
+            logging.warning("Workers did not stop in time, killing them")
+            self.signal_workers(self.workers | self.retiring, signal.SIGKILL)
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reloading = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run CryptPad with several worker processes",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s --workers 4 --threads 16
+  %(prog)s --host 127.0.0.1 --port 8000 --no-preload
+        """
+    )
+    parser.add_argument('--host', default=os.environ.get("HOST", "0.0.0.0"), help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', '-p', type=int, default=int(os.environ.get("PORT", 5000)), help='Port to listen on (default: 5000)')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--threads', '-t', type=int, default=16, help='Threads per worker for requests being handled (default: 16); idle connections and open change notification streams do not hold one')
+    parser.add_argument('--keepalive', '--idle-timeout', dest='idle_timeout', type=float, default=15, help='Seconds an idle connection, new or kept alive after a response, is kept open (default: 15)')
+    parser.add_argument('--backlog', type=int, default=1024, help='Listen backlog (default: 1024)')
+    parser.add_argument('--graceful-timeout', type=float, default=30, help='Seconds to wait for workers to finish on shutdown (default: 30)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false', help='Import the app in each worker instead of once in the master')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if LISTEN_FD_ENV in os.environ:
+        listen_socket = socket.socket(fileno=int(os.environ[LISTEN_FD_ENV]))
+    else:
+        listen_socket = socket.create_server((args.host, args.port), backlog=args.backlog)
+    listen_socket.set_inheritable(True)
+
+    # Importing once in the master lets workers share its memory and fail fast on errors
+    app = load_app() if args.preload else None
+
+    if not hasattr(os, "fork"):
+        logging.warning("Multiple worker processes are not supported on this platform; running a single process")
+        run_worker(listen_socket, app or load_app(), args)
+        return
+
+    Master(listen_socket, app, args).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -65,9 +65,19 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     const KEY_STORAGE_ID = 'encryptionKey';
+    const GZIP_SAVE_THRESHOLD = 64 * 1024; // Characters; full saves of larger pages are compressed
+    const PAGE_POLL_INTERVAL = 15000; // Milliseconds between change checks when no event stream is available
 
     let encryptedTextMap = {}; // Stores mapping from labelPlaceholder to ENC<data>
     let encryptedTextCounter = 0; // Used to generate unique label IDs
+    let serverTokenNumbers = {}; // Labels of encrypted sections stored on the server -> label number in the skeleton of serverRevision
+    let serverTokenCount = 0; // Number of encrypted sections in the skeleton of serverRevision
+
+    let serverRevision = null; // Revision of the page content last loaded from or saved to the server
+    let lastSavedSkeleton = null; // Skeleton of serverRevision, used to compute delta saves
+    let lastSyncedDisplayContent = null; // Textarea content at the last load/save, to detect local edits
+    let saveInProgress = false;
+    let remoteRevisionDuringSave = null; // Revision announced by the server while our own save was running
 
     // Security mode handling functions
     function getStorageKey() {
@@ -145,17 +155,25 @@ document.addEventListener('DOMContentLoaded', () => {
     async function loadPageContent() {
         if (typeof currentPageId === 'undefined') return; // currentPageId should be defined in editor.html
         try {
-            const response = await fetch(`/${currentPageId}/load`);
+            // The server replaces encrypted sections with labels; their ENC<data> is fetched when needed
+            const response = await fetch(`/${currentPageId}/load?mode=skeleton`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             const data = await response.json();
             if (data.success) {
+                serverRevision = data.revision || null;
+                encryptedTextMap = {};
+                serverTokenNumbers = {};
+                serverTokenCount = data.token_sizes.length;
+                encryptedTextCounter = serverTokenCount;
+                for (let number = 1; number <= serverTokenCount; number++) {
+                    serverTokenNumbers[`[LOCKED_CONTENT_#${number}]`] = number;
+                }
+                lastSavedSkeleton = data.skeleton;
                 if (markdownTextArea) {
-                    const displayContent = transformContentForDisplay(data.content);
-                    markdownTextArea.value = displayContent;
-                    // The event listeners will handle finding these new labels
-                    // processForEncryptedPlaceholders might not be strictly needed for textarea
+                    markdownTextArea.value = data.skeleton;
+                    lastSyncedDisplayContent = data.skeleton;
                 }
             } else {
                 console.error('Failed to load page:', data.message);
@@ -167,7 +185,129 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Fetches the ENC<data> of server-side labels that have not been loaded yet; returns false if that failed
+    async function fetchEncryptedSections(labels) {
+        const pending = {}; // Label number -> label
+        for (const label of labels) {
+            if (label in serverTokenNumbers && !(label in encryptedTextMap)) {
+                pending[serverTokenNumbers[label]] = label;
+            }
+        }
+        const numbers = Object.keys(pending);
+        if (numbers.length === 0) return true;
+        try {
+            const response = await fetch(`/${currentPageId}/blobs?revision=${encodeURIComponent(serverRevision)}&numbers=${numbers.join(',')}`);
+            const data = await response.json();
+            if (!data.success) {
+                if (data.conflict) {
+                    showToast('This page was changed by someone else. Reload the page to access its encrypted sections.', 'error');
+                } else {
+                    showToast(`Failed to load encrypted sections: ${data.message}`, 'error');
+                }
+                return false;
+            }
+            for (const [number, token] of Object.entries(data.tokens)) {
+                encryptedTextMap[pending[number]] = token;
+            }
+            return true;
+        } catch (error) {
+            console.error('Error loading encrypted sections:', error);
+            showToast('Error loading encrypted sections.', 'error');
+            return false;
+        }
+    }
+
+    // Computes the edits that turn oldText into newText as a single replaced range.
+    // Offsets are JavaScript string (UTF-16) positions, which is what the server expects.
+    function computeEdits(oldText, newText) {
+        if (oldText === newText) return [];
+        const maxPrefix = Math.min(oldText.length, newText.length);
+        let prefix = 0;
+        while (prefix < maxPrefix && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) {
+            prefix++;
+        }
+        const maxSuffix = maxPrefix - prefix;
+        let suffix = 0;
+        while (suffix < maxSuffix &&
+               oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)) {
+            suffix++;
+        }
+        return [{
+            start: prefix,
+            end: oldText.length - suffix,
+            text: newText.substring(prefix, newText.length - suffix)
+        }];
+    }
+
+    // Converts the textarea content into the form a skeleton save sends: sections stored on the server
+    // keep a label with their number in the skeleton of serverRevision, which the server maps back to the
+    // section, and sections encrypted since then are sent as ENC<data>. Also returns the skeleton the server
+    // will have after the save and the textarea label of each of its sections (null for ENC<data> typed as text).
+    function toSkeletonForm(contentWithLabels) {
+        const tokenRegex = /\[LOCKED_CONTENT_#(\d+)\]|ENC<[^>]+>/g;
+        const formPieces = [];
+        const skeletonPieces = [];
+        const labels = [];
+        let previous = 0;
+        let match;
+        while ((match = tokenRegex.exec(contentWithLabels)) !== null) {
+            const label = match[0];
+            let piece = label;
+            let isToken = true;
+            if (label in serverTokenNumbers) {
+                piece = `[LOCKED_CONTENT_#${serverTokenNumbers[label]}]`;
+                labels.push(label);
+            } else if (encryptedTextMap[label]) {
+                piece = encryptedTextMap[label];
+                labels.push(label);
+            } else if (match[1] === undefined || Number(match[1]) <= serverTokenCount) {
+                labels.push(null); // The server reads these as sections, too
+            } else {
+                isToken = false;
+            }
+            const text = contentWithLabels.substring(previous, match.index);
+            formPieces.push(text, piece);
+            skeletonPieces.push(text, isToken ? `[LOCKED_CONTENT_#${labels.length}]` : piece);
+            previous = match.index + label.length;
+        }
+        formPieces.push(contentWithLabels.substring(previous));
+        skeletonPieces.push(contentWithLabels.substring(previous));
+        return { form: formPieces.join(''), skeleton: skeletonPieces.join(''), labels };
+    }
+
+    // Computes the edits that turn a skeleton into newForm; the server rejects edits that start or end inside a label
+    function computeSkeletonEdits(skeleton, newForm) {
+        const edits = computeEdits(skeleton, newForm);
+        if (edits.length === 0) return edits;
+        const edit = edits[0];
+        const labelRegex = /\[LOCKED_CONTENT_#\d+\]/g;
+        let match;
+        while ((match = labelRegex.exec(skeleton)) !== null && match.index < edit.end) {
+            const labelEnd = match.index + match[0].length;
+            if (edit.start > match.index && edit.start < labelEnd) {
+                edit.text = skeleton.substring(match.index, edit.start) + edit.text;
+                edit.start = match.index;
+            }
+            if (edit.end > match.index && edit.end < labelEnd) {
+                edit.text += skeleton.substring(edit.end, labelEnd);
+                edit.end = labelEnd;
+            }
+        }
+        return edits;
+    }
+
     // Function to save page content
+    // Full content is sent as plain text, which the server streams to disk; large pages are gzip-compressed
+    async function buildFullSaveRequest(rawContent) {
+        const headers = { 'Content-Type': 'text/plain; charset=utf-8' };
+        if (rawContent.length < GZIP_SAVE_THRESHOLD || typeof CompressionStream === 'undefined') {
+            return { headers, body: rawContent };
+        }
+        const compressed = new Blob([rawContent]).stream().pipeThrough(new CompressionStream('gzip'));
+        headers['Content-Encoding'] = 'gzip';
+        return { headers, body: await new Response(compressed).blob() };
+    }
+
     async function savePageContent() {
         if (typeof currentPageId === 'undefined') return;
         
@@ -175,32 +315,174 @@ document.addEventListener('DOMContentLoaded', () => {
         if (markdownTextArea) {
             contentWithLabels = markdownTextArea.value;
         }
-        const rawContent = transformContentForSaving(contentWithLabels);
+        const deltaSave = serverRevision !== null && lastSavedSkeleton !== null;
+        // Only a full save needs the encrypted sections that have not been fetched; a delta save sends their labels
+        if (!deltaSave && !await fetchEncryptedSections(contentWithLabels.match(/\[LOCKED_CONTENT_#\d+\]/g) || [])) return;
+        const saved = toSkeletonForm(contentWithLabels);
 
+        saveInProgress = true;
+        remoteRevisionDuringSave = null;
         try {
-            const response = await fetch(`/${currentPageId}/save`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ content: rawContent }),
-            });
+            // Send only the changed range of the skeleton when we know which revision the server has
+            let saveRequest;
+            if (deltaSave) {
+                const payload = { base_revision: serverRevision, skeleton: true, edits: computeSkeletonEdits(lastSavedSkeleton, saved.form) };
+                saveRequest = {
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(payload),
+                };
+            } else {
+                saveRequest = await buildFullSaveRequest(transformContentForSaving(contentWithLabels));
+            }
+            const response = await fetch(`/${currentPageId}/save`, { method: 'POST', ...saveRequest });
             const data = await response.json();
             if (data.success) {
+                serverRevision = data.revision || null;
+                lastSyncedDisplayContent = contentWithLabels;
+                serverTokenNumbers = {};
+                saved.labels.forEach((label, index) => {
+                    if (label !== null) serverTokenNumbers[label] = index + 1;
+                });
+                serverTokenCount = saved.labels.length;
+                lastSavedSkeleton = saved.skeleton;
+                if (deltaSave && data.token_count !== saved.labels.length) {
+                    // The server numbers the sections differently, so labels sent from now on would be wrong
+                    lastSavedSkeleton = null;
+                    serverRevision = null;
+                    if (markdownTextArea && markdownTextArea.value === contentWithLabels) {
+                        await loadPageContent();
+                    } else {
+                        showToast('Saved, but the encrypted sections could not be matched. Copy your changes and reload the page before saving.', 'warning');
+                        return;
+                    }
+                }
                 showToast('Page saved successfully!', 'success');
+            } else if (data.conflict) {
+                showToast('This page was changed by someone else. Copy your changes and reload the page before saving.', 'error');
+            } else if (response.status === 429) {
+                showToast(`Not saved: ${data.message}`, 'warning');
             } else {
                 showToast(`Failed to save page: ${data.message}`, 'error');
             }
         } catch (error) {
             console.error('Error saving page content:', error);
             showToast('Error saving page content.', 'error');
+        } finally {
+            saveInProgress = false;
+            if (remoteRevisionDuringSave !== null) {
+                handleRemoteRevision(remoteRevisionDuringSave);
+                remoteRevisionDuringSave = null;
+            }
+        }
+    }
+
+    // Reacts to a revision announced by the server: reload if there are no local edits, otherwise warn
+    function handleRemoteRevision(revision) {
+        if (saveInProgress) {
+            remoteRevisionDuringSave = revision;
+            return;
         }
+        if (revision === serverRevision) return; // Our own save, or already loaded
+        if (markdownTextArea && markdownTextArea.value === lastSyncedDisplayContent) {
+            loadPageContent();
+            showToast('Page updated with changes from another editor.', 'info');
+        } else {
+            showToast('This page was changed by someone else. Copy your changes and reload the page before saving.', 'warning');
+        }
+    }
+
+    // Subscribe to change notifications so collaborators see each other's saves without polling
+    function subscribeToPageEvents() {
+        if (typeof currentPageId === 'undefined' || typeof EventSource === 'undefined') return;
+        const events = new EventSource(`/${currentPageId}/events`);
+        events.addEventListener('revision', (event) => {
+            handleRemoteRevision(JSON.parse(event.data).revision);
+        });
+        events.addEventListener('status', (event) => {
+            if (JSON.parse(event.data).status === 'disabled') {
+                showToast('This page has been disabled by an administrator.', 'warning');
+            }
+        });
+        events.addEventListener('deleted', () => {
+            showToast('This page has been deleted.', 'error');
+            events.close();
+        });
+        events.addEventListener('error', () => {
+            // The browser retries dropped streams itself; a refused one (e.g. 503 when the server
+            // has too many open) is closed for good
+            if (events.readyState === EventSource.CLOSED) {
+                pollPageRevision();
+            }
+        });
+    }
+
+    // Without an event stream, check the page's revision with conditional /load requests, which the
+    // server answers with 304 while the page is unchanged
+    function pollPageRevision() {
+        setInterval(async () => {
+            if (serverRevision === null || saveInProgress) return;
+            try {
+                const response = await fetch(`/${currentPageId}/load?mode=skeleton`, {
+                    cache: 'no-store',
+                    headers: { 'If-None-Match': `W/"${serverRevision}-skeleton"` },
+                });
+                if (response.status !== 200) return;
+                const data = await response.json();
+                if (data.success) {
+                    handleRemoteRevision(data.revision);
+                }
+            } catch (error) {
+                console.error('Error checking page for changes:', error);
+            }
+        }, PAGE_POLL_INTERVAL);
     }
     
     if (saveButton) {
         saveButton.addEventListener('click', savePageContent);
     }
 
+    // ENC token formats: v1 is base64 of JSON {iv: [...], ciphertext: [...]} (always starts with "eyJ"),
+    // v2 is unpadded base64url of a version byte, the 12-byte IV and the ciphertext
+    const ENC_TOKEN_VERSION = 2;
+    const ENC_IV_LENGTH = 12;
+
+    function bytesToBase64Url(bytes) {
+        let binary = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        return btoa(binary).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+    }
+
+    function base64UrlToBytes(base64Url) {
+        const base64 = base64Url.replace(/-/g, '+').replace(/_/g, '/');
+        const binary = atob(base64 + '='.repeat((4 - base64.length % 4) % 4));
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return bytes;
+    }
+
+    // Returns {iv, ciphertext} of an ENC token body in either format
+    function parseEncPayload(base64Data) {
+        if (base64Data.startsWith('eyJ')) {
+            const encryptedData = JSON.parse(atob(base64Data));
+            return {
+                iv: new Uint8Array(encryptedData.iv),
+                ciphertext: new Uint8Array(encryptedData.ciphertext)
+            };
+        }
+        const bytes = base64UrlToBytes(base64Data);
+        if (bytes[0] !== ENC_TOKEN_VERSION || bytes.length <= 1 + ENC_IV_LENGTH) {
+            throw new Error('Unsupported encrypted data format');
+        }
+        return {
+            iv: bytes.subarray(1, 1 + ENC_IV_LENGTH),
+            ciphertext: bytes.subarray(1 + ENC_IV_LENGTH)
+        };
+    }
+
     // Encryption logic: returns a label placeholder, stores mapping
     async function encryptText(text, key) {
         if (!key) {
@@ -208,7 +490,7 @@ document.addEventListener('DOMContentLoaded', () => {
             return null;
         }
         try {
-            const iv = crypto.getRandomValues(new Uint8Array(12));
+            const iv = crypto.getRandomValues(new Uint8Array(ENC_IV_LENGTH));
             const encodedText = new TextEncoder().encode(text);
             const cryptoKey = await getCryptoKey(key);
 
@@ -218,11 +500,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 encodedText
             );
             
-            const encryptedData = {
-                iv: Array.from(iv),
-                ciphertext: Array.from(new Uint8Array(encryptedContent))
-            };
-            const encryptedDataString = `ENC<${btoa(JSON.stringify(encryptedData))}>`;
+            const ciphertext = new Uint8Array(encryptedContent);
+            const tokenBytes = new Uint8Array(1 + iv.length + ciphertext.length);
+            tokenBytes[0] = ENC_TOKEN_VERSION;
+            tokenBytes.set(iv, 1);
+            tokenBytes.set(ciphertext, 1 + iv.length);
+            const encryptedDataString = `ENC<${bytesToBase64Url(tokenBytes)}>`;
 
             encryptedTextCounter++;
             const labelPlaceholder = `[LOCKED_CONTENT_#${encryptedTextCounter}]`;
@@ -249,9 +532,7 @@ document.addEventListener('DOMContentLoaded', () => {
         
         const base64Data = encryptedDataString.substring(4, encryptedDataString.length - 1);
         try {
-            const encryptedData = JSON.parse(atob(base64Data));
-            const iv = new Uint8Array(encryptedData.iv);
-            const ciphertext = new Uint8Array(encryptedData.ciphertext);
+            const { iv, ciphertext } = parseEncPayload(base64Data);
             const cryptoKey = await getCryptoKey(key);
 
             const decryptedContent = await crypto.subtle.decrypt(
@@ -335,21 +616,6 @@ document.addEventListener('DOMContentLoaded', () => {
         // Event listeners handle interactions.
     }
 
-    function transformContentForDisplay(rawContent) {
-        encryptedTextMap = {}; // Reset map for fresh load
-        encryptedTextCounter = 0; // Reset counter
-        const encRegex = /ENC<[^>]+>/g;
-        
-        // Replace ENC<data> with labels and populate the map
-        const displayContent = rawContent.replace(encRegex, (encryptedDataString) => {
-            encryptedTextCounter++;
-            const labelPlaceholder = `[LOCKED_CONTENT_#${encryptedTextCounter}]`;
-            encryptedTextMap[labelPlaceholder] = encryptedDataString;
-            return labelPlaceholder;
-        });
-        return displayContent;
-    }
-
     function transformContentForSaving(contentWithLabels) {
         const labelRegex = /\[LOCKED_CONTENT_#\d+\]/g;
         // Replace labels back with their original ENC<data> strings
@@ -386,6 +652,7 @@ document.addEventListener('DOMContentLoaded', () => {
             }
 
             if (labelToDecrypt) {
+                if (!await fetchEncryptedSections([labelToDecrypt])) return;
                 const encryptedDataString = encryptedTextMap[labelToDecrypt];
                 if (!encryptedDataString) {
                     showToast('Could not find encrypted data for this label. It might have been already decrypted or an error occurred.', 'error');
@@ -439,6 +706,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Iterate over selected text to find and decrypt labels
                 // Create a new regex for each iteration within the loop to avoid issues with 'g' flag and lastIndex
                 const localLabelRegex = /\[LOCKED_CONTENT_#\d+\]/g; 
+                if (currentKey) {
+                    await fetchEncryptedSections(selectedText.match(localLabelRegex) || []);
+                }
 
                 while ((match = localLabelRegex.exec(selectedText)) !== null) {
                     resultText += selectedText.substring(lastIndex, match.index); // Append text before label
@@ -502,6 +772,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
 
                 if (labelToCopy) {
+                    if (!await fetchEncryptedSections([labelToCopy])) return;
                     const encryptedDataString = encryptedTextMap[labelToCopy];
                     if (!encryptedDataString) {
                         showToast('Could not find encrypted data for this label.', 'error');
@@ -531,5 +802,6 @@ document.addEventListener('DOMContentLoaded', () => {
     // Initial load of page content
     if (markdownTextArea) { // Check if editor element exists
         loadPageContent();
+        subscribeToPageEvents();
     }
 });
@@ -0,0 +1,71 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Configuration for every test app; tests override single values
+DEFAULT_ENV = {
+    "ADMIN_PASSWORD": "test-password",
+    "FLASK_SECRET_KEY": "test-secret",
+    "SAVE_COALESCE_SECONDS": "0",
+    "SAVE_RATE_PER_PAGE": "0",
+    "BACKUP_INTERVAL_SECONDS": "0",
+    "SCRUB_INTERVAL_SECONDS": "0",
+    "ARCHIVE_AFTER_DAYS": "0",
+}
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """Returns a function that imports a fresh app module with its data in tmp_path.
+
+    app.py reads its configuration when it is imported and keeps its data
+    relative to the working directory, so each test gets its own import.
+    Background threads are not started; tests run that work explicitly.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(ROOT)
+
+    def make(**env):
+        for name, value in {**DEFAULT_ENV, **env}.items():
+            monkeypatch.setenv(name, str(value))
+        sys.modules.pop("app", None)
+        module = importlib.import_module("app")
+        module._background_services_pid = os.getpid()
+        return module
+
+    yield make
+    sys.modules.pop("app", None)
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def app_module(make_app, backend):
+    return make_app(STORAGE_BACKEND=backend)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session["admin_logged_in"] = True
+    return client
+
+
+def create_page(app_module, page_id, content=""):
+    """Creates a page with the given content, as the admin panel does."""
+    with app_module.page_locks.lock(page_id):
+        app_module.write_page_content(page_id, content)
+    app_module.page_id_allocator.reserve(page_id)
@@ -0,0 +1,81 @@
+import time
+
+from conftest import create_page
+
+DAY_NS = 86400 * 10**9
+
+
+def make_idle(app_module, page_id, days):
+    """Sets a page's modification time ``days`` days into the past."""
+    storage = app_module.storage
+    data, _ = storage.read_page(page_id)
+    st = storage.import_page(page_id, data, time.time_ns() - days * DAY_NS)
+    app_module.catalog_page_written(page_id, data.decode("utf-8"), st, app_module.compute_revision(data))
+    return st
+
+
+def archive_page(app_module, page_id, content):
+    create_page(app_module, page_id, content)
+    app_module.create_page_backup(page_id)
+    st = make_idle(app_module, page_id, 10)
+    assert app_module.archive_idle_pages(5)["pages_archived"] == 1
+    return st
+
+
+def test_pack_lookup_skips_tombstones(app_module):
+    archive = app_module.cold_archive
+    writer = archive.new_pack()
+    page_ids = [f"page{number}" for number in range(200)]
+    for page_id in page_ids:
+        writer.add_page(page_id, [page_id.encode()], app_module.PageStat(1, len(page_id)), [], None)
+    pack = writer.commit()
+    for page_id in page_ids[::2]:
+        archive.discard(page_id, pack=pack)
+
+    # Another process sees the same tombstones
+    for reader in (archive, app_module.ColdArchive(app_module.ARCHIVE_DIR)):
+        for page_id in page_ids[::2]:
+            assert not reader.contains(page_id)
+        for page_id in page_ids[1::2]:
+            assert b"".join(reader.iter_content(reader.read_record(reader.lookup(page_id)))) == page_id.encode()
+        assert reader.lookup("missing") is None
+
+
+def test_restore_keeps_content_backups_and_modification_time(app_module, client):
+    st = archive_page(app_module, "idle", "old content")
+    storage = app_module.storage
+    assert not storage.page_exists("idle")
+    assert storage.list_backups("idle") == []
+    assert app_module.page_exists_or_archived("idle")
+
+    response = client.get("/idle/load")
+    assert response.status_code == 200
+    assert response.get_json()["content"] == "old content"
+    assert not app_module.cold_archive.contains("idle")
+    assert storage.page_stat("idle").st_mtime_ns == st.st_mtime_ns
+    assert app_module.page_catalog.page_checksum("idle")["mtime"] == st.st_mtime
+    assert [b"".join(storage.iter_blob(entry["hash"])) for entry in storage.list_backups("idle")] == [b"old content"]
+
+    # Restored pages are not archived again until they have been idle for the whole period
+    assert app_module.archive_idle_pages(5)["pages_archived"] == 0
+
+
+def test_restored_backups_survive_blob_collection(app_module, client):
+    archive_page(app_module, "idle", "backed up")
+    assert client.get("/idle/load").status_code == 200
+    app_module.collect_unreferenced_blobs(time.time() + 3600)
+    entry, = app_module.storage.list_backups("idle")
+    assert b"".join(app_module.storage.iter_blob(entry["hash"])) == b"backed up"
+
+
+def test_disabled_archived_page_is_not_restored_by_anonymous_requests(app_module, client, admin_client):
+    archive_page(app_module, "hidden", "secret")
+    app_module.set_page_status("hidden", "disabled")
+    assert client.get("/hidden").status_code == 403
+    assert client.get("/hidden/load").status_code == 403
+    assert client.post("/hidden/save", json={"content": "x"}).status_code == 403
+    assert app_module.cold_archive.contains("hidden")
+
+    assert admin_client.get("/hidden").status_code == 200
+    assert not app_module.cold_archive.contains("hidden")
+    assert app_module.storage.read_page("hidden")[0] == b"secret"
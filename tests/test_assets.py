@@ -0,0 +1,50 @@
+import gzip
+import os
+
+
+def script_url(app_module):
+    with app_module.app.test_request_context():
+        return app_module.asset_url("js/script.js")
+
+
+def test_fingerprinted_assets_are_cached_as_immutable(app_module, client):
+    url = script_url(app_module)
+    assert url.startswith("/assets/js/script.") and url.endswith(".js")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype in ("application/javascript", "text/javascript")
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == app_module.ASSET_CACHE_SECONDS
+    with open(os.path.join(app_module.app.static_folder, "js", "script.js"), "rb") as f:
+        assert response.data == f.read()
+    assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_compressed_variant_is_served_to_clients_that_accept_it(app_module, client):
+    url = script_url(app_module)
+    plain = client.get(url)
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert "Accept-Encoding" in plain.headers["Vary"]
+    assert response.headers["ETag"] != plain.headers["ETag"]
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_changed_files_get_a_new_url(app_module, client, tmp_path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    (static_dir / "app.css").write_text("body { color: red; }")
+    assets = app_module.StaticAssets(str(static_dir))
+    assets.load()
+    old_name = assets.url_name("app.css")
+
+    (static_dir / "app.css").write_text("body { color: blue; }")
+    new_name = assets.url_name("app.css", check_changed=True)
+    assert new_name != old_name
+    assert assets.get(old_name) is None
+    assert assets.get(new_name).variants[None] == b"body { color: blue; }"
+
+    # A URL with a stale or unknown fingerprint is not served
+    stale = script_url(app_module).rsplit(".", 2)[0] + ".0000000000000000.js"
+    assert client.get(stale).status_code == 404
@@ -0,0 +1,138 @@
+import io
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+
+from conftest import create_page
+
+
+def make_old(app_module, digest, seconds):
+    """Moves a blob's stored/deduplicated time ``seconds`` into the past."""
+    storage = app_module.storage
+    if app_module.STORAGE_BACKEND == "sqlite":
+        conn = storage._db.get()
+        with conn:
+            conn.execute("UPDATE blobs SET created = created - ? WHERE hash = ?", (seconds, digest))
+    else:
+        path = storage.blob_path(digest)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_store_blob_deduplicates(app_module):
+    digest, written = app_module.storage.store_blob(b"same content" * 100)
+    assert written > 0
+    assert app_module.storage.store_blob(b"same content" * 100) == (digest, 0)
+    assert b"".join(app_module.storage.iter_blob(digest)) == b"same content" * 100
+
+
+def test_unchanged_pages_share_one_compressed_blob(app_module):
+    content = "same text\n" * 1000
+    for page_id in ("first", "second"):
+        create_page(app_module, page_id, content)
+    entry, written = app_module.add_backup_entry("first", content.encode(), "20240101100000")
+    assert 0 < written < len(content) // 10
+    assert app_module.add_backup_entry("first", content.encode(), "20240101110000") == ({**entry, "timestamp": "20240101110000"}, 0)
+    assert app_module.add_backup_entry("second", content.encode(), "20240101100000")[1] == 0
+    assert [e["hash"] for e in app_module.storage.list_backups("first")] == [entry["hash"]] * 2
+    assert app_module.storage.list_backups("second") == [entry]
+
+
+def test_legacy_backups_are_migrated(app_module, admin_client):
+    create_page(app_module, "legacy", "current")
+    legacy_dir = os.path.join(app_module.BACKUP_DIR, "legacy")
+    os.makedirs(legacy_dir, exist_ok=True)
+    for timestamp, content in (("20240101100000", b"old"), ("20240102100000", b"older edit")):
+        with open(os.path.join(legacy_dir, f"legacy_{timestamp}.md"), "wb") as f:
+            f.write(content)
+
+    result = app_module.app.test_cli_runner().invoke(args=["migrate-backups"])
+    assert "Migrated 2 backup files of 1 pages" in result.output
+    assert [name for name in os.listdir(legacy_dir) if name.endswith(".md")] == []
+    entries = app_module.storage.list_backups("legacy")
+    assert [(e["timestamp"], e["size"]) for e in entries] == [("20240101100000", 3), ("20240102100000", 10)]
+
+    # Downloads read the backups from the manifest and blob store
+    response = admin_client.get("/admin/download_page/legacy")
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.read("legacy.md") == b"current"
+        assert archive.read("backups/legacy_20240101100000.md") == b"old"
+        assert archive.read("backups/legacy_20240102100000.md") == b"older edit"
+
+
+def test_collection_keeps_blob_deduplicated_during_the_run(app_module):
+    digest, _ = app_module.storage.store_blob(b"backup")
+    make_old(app_module, digest, 3600)
+    run_started = time.time()
+    # A backup of the same content starts after the collection run did
+    assert app_module.storage.store_blob(b"backup") == (digest, 0)
+    assert app_module.collect_unreferenced_blobs(run_started) == (0, 0)
+    assert b"".join(app_module.storage.iter_blob(digest)) == b"backup"
+
+
+def test_collection_removes_old_unreferenced_blobs(app_module):
+    create_page(app_module, "kept", "kept")
+    kept = app_module.create_page_backup("kept")
+    orphan, _ = app_module.storage.store_blob(b"orphan")
+    make_old(app_module, orphan, 3600)
+    make_old(app_module, kept["hash"], 3600)
+    removed, removed_bytes = app_module.collect_unreferenced_blobs(time.time())
+    assert removed == 1 and removed_bytes > 0
+    with pytest.raises(FileNotFoundError):
+        b"".join(app_module.storage.iter_blob(orphan))
+    assert b"".join(app_module.storage.iter_blob(kept["hash"])) == b"kept"
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs fcntl locks")
+def test_collection_waits_for_manifest_writes(app_module):
+    finished = threading.Event()
+
+    def collect():
+        app_module.collect_unreferenced_blobs(time.time())
+        finished.set()
+
+    with app_module.blob_store_lock():
+        thread = threading.Thread(target=collect)
+        thread.start()
+        assert not finished.wait(0.2)
+    assert finished.wait(5)
+    thread.join()
+
+
+def test_select_backups_to_keep(make_app):
+    select_backups_to_keep = make_app().select_backups_to_keep
+    timestamps = [
+        "20240101100000", "20240101103000", # Same hour: only the newer is an hourly backup
+        "20240101110000",
+        "20240102090000",
+        "20240108090000", # Another ISO week
+        "20240108091500",
+    ]
+    entries = [{"timestamp": timestamp} for timestamp in timestamps]
+    keep = select_backups_to_keep(entries, keep_hourly=2, keep_daily=2, keep_weekly=2)
+    # Hourly and daily: 08 09:15 and 02 09:00; weekly: the newest of each week, the same two
+    assert keep == {"20240108091500", "20240102090000"}
+    keep = select_backups_to_keep(entries, keep_hourly=4, keep_daily=0, keep_weekly=0)
+    assert keep == {"20240108091500", "20240102090000", "20240101110000", "20240101103000"}
+    assert select_backups_to_keep(entries, 0, 0, 0) == {"20240108091500"}
+    assert select_backups_to_keep([], 1, 1, 1) == set()
+
+
+def test_scheduled_run_prunes_backups_and_their_blobs(app_module):
+    create_page(app_module, "pruned", "v1")
+    storage = app_module.storage
+    old_entries = []
+    for hour, content in ((8, b"v0"), (9, b"v1")):
+        entry, _ = app_module.add_backup_entry("pruned", content, f"20240101{hour:02d}0000")
+        make_old(app_module, entry["hash"], 3600)
+        old_entries.append(entry)
+    scheduler = app_module.BackupScheduler(3600, 0, keep_hourly=1, keep_daily=0, keep_weekly=0)
+    stats = scheduler.run_once(pace=False)
+    # The page equals the newest backup's content and is not backed up again
+    assert stats["pages_unchanged"] == 1
+    assert stats["backups_pruned"] == 1
+    assert stats["blobs_removed"] == 1
+    assert [entry["hash"] for entry in storage.list_backups("pruned")] == [old_entries[1]["hash"]]
@@ -0,0 +1,36 @@
+from conftest import create_page
+
+
+def test_batch_applies_operations_in_order(app_module, admin_client):
+    for page_id in ("one", "two"):
+        create_page(app_module, page_id, page_id)
+    response = admin_client.post("/admin/api/batch", json={"operations": [
+        {"page_id": "one", "operation": "disable"},
+        {"page_id": "one", "operation": "toggle_status"},
+        {"page_id": "two", "operation": "toggle_security_mode"},
+        {"page_id": "two", "operation": "set_security_mode", "security_mode": "bogus"},
+        {"page_id": "missing", "operation": "enable"},
+    ]})
+    results = response.get_json()["results"]
+    assert [result["success"] for result in results] == [True, True, True, False, False]
+    assert app_module.page_statuses.get("one") == {"status": "enabled", "security_mode": "prompt"}
+    assert app_module.page_statuses.get("two") == {"status": "enabled", "security_mode": "local"}
+
+
+def test_batch_toggle_keeps_concurrent_toggle(app_module, admin_client, monkeypatch):
+    create_page(app_module, "busy", "busy")
+    create_page(app_module, "other", "other")
+    create_page_backup = app_module.create_page_backup
+
+    def backup_while_toggled(page_id):
+        # Another admin disables the page while the batch is running
+        app_module.set_page_status("busy", "disabled")
+        return create_page_backup(page_id)
+
+    monkeypatch.setattr(app_module, "create_page_backup", backup_while_toggled)
+    response = admin_client.post("/admin/api/batch", json={"operations": [
+        {"page_id": "other", "operation": "backup"},
+        {"page_id": "busy", "operation": "toggle_status"},
+    ]})
+    assert response.get_json()["results"][1]["status"] == "enabled"
+    assert app_module.get_page_status("busy") == "enabled"
@@ -0,0 +1,89 @@
+import contextlib
+
+import flask
+import pytest
+
+from conftest import create_page
+
+
+@pytest.fixture
+def search_app(app_module):
+    if not app_module.page_catalog.search_available:
+        pytest.skip("SQLite has no FTS5")
+    return app_module
+
+
+def search(app_module, query):
+    return [row["page_id"] for row in app_module.page_catalog.search(query)]
+
+
+def test_saved_pages_are_found_by_their_words(search_app, client):
+    create_page(search_app, "notes", "Meeting notes\nthe roadmap for spring")
+    create_page(search_app, "other", "unrelated")
+    assert search(search_app, "roadmap") == ["notes"]
+    # Words match as prefixes
+    assert search(search_app, "road spr") == ["notes"]
+
+    client.post("/other/save", json={"content": "another roadmap"})
+    assert sorted(search(search_app, "roadmap")) == ["notes", "other"]
+
+
+def test_encrypted_sections_are_not_indexed(search_app):
+    create_page(search_app, "secret", "visible ENC<c2VjcmV0d29yZA==> text")
+    assert search(search_app, "visible") == ["secret"]
+    assert search(search_app, "c2VjcmV0d29yZA") == []
+    assert search(search_app, "ENC") == []
+
+
+def test_rewritten_and_deleted_pages_drop_their_old_words(search_app, client, admin_client):
+    create_page(search_app, "page", "old words")
+    client.post("/page/save", json={"content": "new words"})
+    assert search(search_app, "old") == []
+    assert search(search_app, "new") == ["page"]
+
+    assert admin_client.post("/admin/delete_page/page").status_code == 302
+    assert search(search_app, "words") == []
+
+
+@contextlib.contextmanager
+def rendered_pagination(app_module):
+    """Collects the pagination context of each rendered admin dashboard."""
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append((context["pagination"], [page["id"] for page in context["pages"]]))
+
+    flask.template_rendered.connect(record, app_module.app)
+    try:
+        yield rendered
+    finally:
+        flask.template_rendered.disconnect(record, app_module.app)
+
+
+@pytest.mark.parametrize("page, per_page, expected_page, expected_ids", [
+    (1, 2, 1, ["p1", "p2"]),
+    (3, 2, 3, ["p5"]),
+    # Out of range page numbers are clamped to the first and last page
+    (9, 2, 3, ["p5"]),
+    (0, 2, 1, ["p1", "p2"]),
+    (2, 5, 1, ["p1", "p2", "p3", "p4", "p5"]),
+])
+def test_admin_dashboard_pages_through_the_catalog(app_module, admin_client, page, per_page, expected_page, expected_ids):
+    for number in range(1, 6):
+        create_page(app_module, f"p{number}", f"page {number}")
+    with rendered_pagination(app_module) as rendered:
+        assert admin_client.get(f"/admin?page={page}&per_page={per_page}").status_code == 200
+    pagination, page_ids = rendered[0]
+    assert page_ids == expected_ids
+    assert (pagination["page"], pagination["page_count"], pagination["total"]) == (expected_page, (5 + per_page - 1) // per_page, 5)
+
+
+def test_admin_search_results_are_paged(search_app, admin_client):
+    for number in range(1, 4):
+        create_page(search_app, f"p{number}", f"match {number}")
+    create_page(search_app, "skip", "nothing")
+    with rendered_pagination(search_app) as rendered:
+        admin_client.get("/admin?q=match&sort=id&per_page=2&page=2")
+    pagination, page_ids = rendered[0]
+    assert page_ids == ["p3"]
+    assert (pagination["page"], pagination["page_count"], pagination["total"]) == (2, 2, 3)
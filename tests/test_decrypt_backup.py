@@ -0,0 +1,89 @@
+import base64
+import io
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from conftest import ROOT, create_page
+
+pytest.importorskip("cryptography")
+AESGCM = pytest.importorskip("cryptography.hazmat.primitives.ciphers.aead").AESGCM
+
+KEY = "test-key"
+
+
+@pytest.fixture
+def decrypt_backup(monkeypatch):
+    monkeypatch.syspath_prepend(ROOT)
+    import decrypt_backup
+    return decrypt_backup
+
+
+def encrypt_v2(decrypt_backup, text):
+    """Encrypts text as the editor does: a version byte, the IV and the ciphertext in unpadded base64url."""
+    iv = os.urandom(decrypt_backup.ENC_IV_LENGTH)
+    ciphertext = AESGCM(decrypt_backup.derive_key(KEY)).encrypt(iv, text.encode("utf-8"), None)
+    body = base64.urlsafe_b64encode(bytes([decrypt_backup.ENC_TOKEN_VERSION]) + iv + ciphertext)
+    return f"ENC<{body.decode('ascii').rstrip('=')}>"
+
+
+def encrypt_v1(decrypt_backup, text):
+    """Encrypts text as older editors did: base64 of JSON with the IV and ciphertext as integer lists."""
+    iv = os.urandom(decrypt_backup.ENC_IV_LENGTH)
+    ciphertext = AESGCM(decrypt_backup.derive_key(KEY)).encrypt(iv, text.encode("utf-8"), None)
+    body = json.dumps({"iv": list(iv), "ciphertext": list(ciphertext)})
+    return f"ENC<{base64.b64encode(body.encode('utf-8')).decode('ascii')}>"
+
+
+def test_both_token_versions_are_decrypted(decrypt_backup):
+    key = decrypt_backup.derive_key(KEY)
+    for encrypt in (encrypt_v1, encrypt_v2):
+        token = encrypt(decrypt_backup, "secret ✓")
+        assert decrypt_backup.decrypt_enc_string(token, key) == "secret ✓"
+        with pytest.raises(ValueError):
+            decrypt_backup.decrypt_enc_string(token, decrypt_backup.derive_key("wrong"))
+    with pytest.raises(ValueError):
+        decrypt_backup.decrypt_enc_string("ENC<AQ>", key)
+
+
+def test_batch_jobs_read_backups_through_their_manifests(make_app, decrypt_backup):
+    app_module = make_app(STORAGE_BACKEND="file")
+    create_page(app_module, "page", f"before {encrypt_v2(decrypt_backup, 'secret')} after")
+    entry = app_module.create_page_backup("page")
+
+    output_dir = Path("restored")
+    jobs = decrypt_backup.find_batch_jobs(["backup", "data/*.md"], output_dir)
+    assert jobs == [
+        (Path("backup/.blobs") / entry["hash"][:2] / f"{entry['hash']}.z", entry["hash"], output_dir / "page" / f"page_{entry['timestamp']}.md"),
+        (Path("data/page.md"), None, output_dir / "page.md"),
+    ]
+
+    decrypt_backup._init_worker(KEY)
+    for job in jobs:
+        assert decrypt_backup.decrypt_job(job) == (str(job[2]), 1, 1, None)
+        assert job[2].read_text(encoding="utf-8") == "before secret after"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_stream_decrypt_joins_tokens_split_across_chunks(decrypt_backup, chunk_size):
+    first, second = encrypt_v2(decrypt_backup, "one"), encrypt_v1(decrypt_backup, "two")
+    content = f"a {first} ENC< not a token> ENC<{second} EN".encode("utf-8")
+    destination = io.BytesIO()
+    cipher = AESGCM(decrypt_backup.derive_key(KEY))
+    result = decrypt_backup.stream_decrypt(io.BytesIO(content), destination, cipher, chunk_size=chunk_size)
+    assert destination.getvalue() == b"a one ENC< not a token> ENC<two EN"
+    assert result == (len(content), 2, 2)
+
+
+def test_stream_decrypt_passes_oversized_runs_through(decrypt_backup, monkeypatch):
+    token = encrypt_v2(decrypt_backup, "x")
+    monkeypatch.setattr(decrypt_backup, "MAX_TOKEN_SIZE", len(token))
+    run = "ENC<" + "A" * 2 * len(token) + ">"
+    destination = io.BytesIO()
+    cipher = AESGCM(decrypt_backup.derive_key(KEY))
+    result = decrypt_backup.stream_decrypt(io.BytesIO(f"{run} {token}".encode("ascii")), destination, cipher, chunk_size=8)
+    # The run is too long to be held back, so it is neither decrypted nor counted
+    assert result[1:] == (1, 1)
+    assert destination.getvalue() == f"{run} x".encode("ascii")
@@ -0,0 +1,83 @@
+import gzip
+import json
+import time
+
+from werkzeug.http import http_date
+
+from conftest import create_page
+
+
+def test_load_sends_validators(app_module, client):
+    create_page(app_module, "page", "content")
+    app_module.storage.import_page("page", b"content", (int(time.time()) - 10) * 10**9)
+    response = client.get("/page/load")
+    revision = response.get_json()["revision"]
+    assert response.headers["ETag"] == f'W/"{revision}"'
+    assert response.last_modified is not None
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = client.get("/page/load", headers={"If-Modified-Since": response.headers["Last-Modified"]})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_load_ignores_if_modified_since_within_the_same_second(app_module, client, monkeypatch):
+    now = int(time.time())
+    create_page(app_module, "page")
+    app_module.storage.import_page("page", b"changed", now * 10**9)
+    headers = {"If-Modified-Since": http_date(now)}
+    # Another save within this second would keep the modification time, so it is no validator yet
+    monkeypatch.setattr(app_module.time, "time", lambda: now + 0.5)
+    response = client.get("/page/load", headers=headers)
+    assert response.status_code == 200
+    assert "Last-Modified" not in response.headers
+    assert response.get_json()["content"] == "changed"
+
+    monkeypatch.setattr(app_module.time, "time", lambda: now + 1.5)
+    response = client.get("/page/load", headers=headers)
+    assert response.status_code == 304
+
+
+def test_load_answers_304_for_current_revision(app_module, client):
+    create_page(app_module, "cached", "content")
+    response = client.get("/cached/load")
+    etag = response.headers["ETag"]
+    assert client.get("/cached/load", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/cached/save", json={"content": "changed"})
+    response = client.get("/cached/load", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["content"] == "changed"
+
+
+def test_skeleton_and_full_loads_have_their_own_etags(app_module, client):
+    create_page(app_module, "page", "text ENC<token==>")
+    full = client.get("/page/load")
+    skeleton = client.get("/page/load?mode=skeleton")
+    assert skeleton.get_json()["skeleton"] == "text [LOCKED_CONTENT_#1]"
+    assert full.headers["ETag"] != skeleton.headers["ETag"]
+    # A cached full load must not answer a skeleton load, and the other way round
+    assert client.get("/page/load?mode=skeleton", headers={"If-None-Match": full.headers["ETag"]}).status_code == 200
+    assert client.get("/page/load?mode=skeleton", headers={"If-None-Match": skeleton.headers["ETag"]}).status_code == 304
+    assert client.get("/page/load", headers={"If-None-Match": skeleton.headers["ETag"]}).status_code == 200
+
+
+def test_missing_page_has_no_etag(client):
+    response = client.get("/missing/load")
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+
+
+def test_large_json_responses_are_compressed(app_module, client):
+    content = "compressible line\n" * 1000
+    create_page(app_module, "large", content)
+    response = client.get("/large/load", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.headers["ETag"].startswith("W/")
+    assert len(response.data) < len(content) // 10
+    assert json.loads(gzip.decompress(response.data))["content"] == content
+
+    # Small responses and clients without gzip get the plain body
+    assert "Content-Encoding" not in client.get("/large/load").headers
+    create_page(app_module, "small", "short")
+    assert "Content-Encoding" not in client.get("/small/load", headers={"Accept-Encoding": "gzip"}).headers
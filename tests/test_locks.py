@@ -0,0 +1,28 @@
+import os
+import threading
+
+
+def test_page_locks_use_a_fixed_set_of_lock_files(app_module, client):
+    for number in range(500):
+        client.post(f"/random{number}/save", json={"content": "x", "base_revision": "0"})
+    lock_files = [name for name in os.listdir(app_module.LOCK_DIR) if not name.startswith(".")]
+    assert 0 < len(lock_files) <= app_module.PAGE_LOCK_STRIPES
+
+
+def test_page_lock_serializes_writers(app_module):
+    order = []
+    entered = threading.Event()
+
+    def writer():
+        entered.set()
+        with app_module.page_locks.lock("page"):
+            order.append("second")
+
+    with app_module.page_locks.lock("page"):
+        thread = threading.Thread(target=writer)
+        thread.start()
+        entered.wait()
+        thread.join(0.2)
+        order.append("first")
+    thread.join()
+    assert order == ["first", "second"]
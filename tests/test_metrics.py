@@ -0,0 +1,33 @@
+import base64
+
+from conftest import create_page
+
+
+def basic_auth(password):
+    return {"Authorization": "Basic " + base64.b64encode(f"prometheus:{password}".encode()).decode()}
+
+
+def test_requests_are_counted_and_timed_by_endpoint(app_module, client):
+    create_page(app_module, "page", "content")
+    for _ in range(3):
+        assert client.get("/page/load").status_code == 200
+    assert client.get("/missing/load").status_code == 404
+
+    response = client.get("/admin/metrics", headers=basic_auth("test-password"))
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'cryptpad_http_requests_total{endpoint="load_page",status="200"} 3' in lines
+    assert 'cryptpad_http_requests_total{endpoint="load_page",status="404"} 1' in lines
+    assert "# TYPE cryptpad_http_request_duration_seconds histogram" in lines
+    assert 'cryptpad_http_request_duration_seconds_bucket{endpoint="load_page",le="+Inf"} 4' in lines
+    assert 'cryptpad_http_request_duration_seconds_count{endpoint="load_page"} 4' in lines
+    assert "cryptpad_pages 1" in lines
+
+
+def test_metrics_require_the_admin_password_or_session(client, admin_client):
+    response = client.get("/admin/metrics")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"].startswith("Basic")
+    assert client.get("/admin/metrics", headers=basic_auth("wrong")).status_code == 401
+    assert admin_client.get("/admin/metrics").status_code == 200
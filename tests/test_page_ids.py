@@ -0,0 +1,35 @@
+import string
+
+from conftest import create_page
+
+
+def test_random_ids_grow_longer_as_ids_run_out(app_module):
+    allocator = app_module.PageIdAllocator(min_length=1, max_occupancy=0.5)
+    # Half of the one-letter IDs are handed out before IDs get a second letter
+    page_ids = allocator.allocate(13)
+    assert len(set(page_ids)) == 13
+    assert all(len(page_id) == 1 for page_id in page_ids)
+    assert [len(page_id) for page_id in allocator.allocate(3)] == [2, 2, 2]
+
+
+def test_ids_in_use_are_never_handed_out(app_module):
+    create_page(app_module, "a")
+    allocator = app_module.PageIdAllocator(min_length=1, max_occupancy=1)
+    first = allocator.allocate()[0]
+    # IDs chosen elsewhere (e.g. custom page IDs) are reserved once the allocator is loaded
+    free = sorted(set(string.ascii_lowercase) - {"a", first})
+    for page_id in free[:-1]:
+        allocator.reserve(page_id)
+    assert allocator.allocate() == [free[-1]]
+    assert len(allocator.allocate()[0]) == 2
+
+
+def test_custom_page_ids_are_reserved(app_module, admin_client, monkeypatch):
+    app_module.page_id_allocator.allocate()
+    response = admin_client.post("/admin/create_page", data={"custom_page_id": "mine"})
+    assert response.status_code == 302
+    assert "mine" in app_module.page_id_allocator._used
+    # A random ID that comes out as the custom one is drawn again
+    letters = iter("mineabcd")
+    monkeypatch.setattr(app_module.secrets, "choice", lambda alphabet: next(letters))
+    assert app_module.create_random_pages(1) == ["abcd"]
@@ -0,0 +1,165 @@
+import gzip
+import os
+
+import pytest
+
+from conftest import create_page
+
+
+def load(client, page_id):
+    response = client.get(f"/{page_id}/load")
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_apply_page_edits_uses_utf16_offsets(make_app):
+    apply_page_edits = make_app().apply_page_edits
+    # "😀" is two UTF-16 code units, as in JavaScript's String.length
+    assert apply_page_edits("a😀b", [{"start": 3, "end": 4, "text": "c"}]) == ("a😀c", None)
+    assert apply_page_edits("a😀b", [{"start": 1, "end": 3, "text": ""}]) == ("ab", None)
+    assert apply_page_edits("a😀", [{"start": 3, "end": 3, "text": "!"}]) == ("a😀!", "!")
+    # Two edits against the same base, given in any order
+    assert apply_page_edits("abcdef", [{"start": 4, "end": 5, "text": "E"}, {"start": 0, "end": 1, "text": "A"}]) == ("AbcdEf", None)
+
+
+@pytest.mark.parametrize("edits", [
+    [{"start": 0, "end": 9, "text": ""}], # Past the end
+    [{"start": 2, "end": 1, "text": ""}],
+    [{"start": 0, "end": 2, "text": ""}, {"start": 1, "end": 3, "text": ""}], # Overlapping
+    [{"start": 2, "end": 3, "text": ""}], # Splits the surrogate pair
+    "not a list",
+])
+def test_apply_page_edits_rejects_invalid_edits(make_app, edits):
+    with pytest.raises((ValueError, UnicodeError)):
+        make_app().apply_page_edits("a😀b", edits)
+
+
+def test_delta_save_and_conflict(app_module, client):
+    create_page(app_module, "delta", "hello 😀 world")
+    revision = load(client, "delta")["revision"]
+
+    response = client.post("/delta/save", json={"base_revision": revision, "edits": [{"start": 9, "end": 14, "text": "there"}]})
+    assert response.status_code == 200
+    new_revision = response.get_json()["revision"]
+    assert load(client, "delta") == {"success": True, "content": "hello 😀 there", "revision": new_revision}
+
+    # A save based on the old revision is rejected and the page is unchanged
+    response = client.post("/delta/save", json={"base_revision": revision, "edits": [{"start": 0, "end": 0, "text": "x"}]})
+    assert response.status_code == 409
+    assert response.get_json()["conflict"] is True
+    assert response.get_json()["revision"] == new_revision
+    assert load(client, "delta")["content"] == "hello 😀 there"
+
+    response = client.post("/delta/save", json={"base_revision": new_revision, "edits": [{"start": 0, "end": 99, "text": ""}]})
+    assert response.status_code == 400
+
+
+def test_skeleton_save_keeps_encrypted_sections(app_module, client):
+    first, second = "ENC<first==>", "ENC<sëcond==>"
+    create_page(app_module, "locked", f"a😀 {first} b {second} c")
+    loaded = client.get("/locked/load?mode=skeleton").get_json()
+    skeleton = loaded["skeleton"]
+    assert skeleton == "a😀 [LOCKED_CONTENT_#1] b [LOCKED_CONTENT_#2] c"
+
+    # Replaces " b " and moves the second section in front of the first
+    start = skeleton.index(" b ") + 1 # "😀" is two UTF-16 code units
+    edits = [
+        {"start": 4, "end": 4, "text": "[LOCKED_CONTENT_#2] "},
+        {"start": start, "end": start + 3 + len("[LOCKED_CONTENT_#2]"), "text": " B"},
+    ]
+    response = client.post("/locked/save", json={"base_revision": loaded["revision"], "skeleton": True, "edits": edits})
+    assert response.status_code == 200
+    assert response.get_json()["token_count"] == 2
+    assert load(client, "locked")["content"] == f"a😀 {second} {first} B c"
+
+    # Edits must not cut a label in two
+    revision = response.get_json()["revision"]
+    response = client.post("/locked/save", json={"base_revision": revision, "skeleton": True, "edits": [{"start": 6, "end": 7, "text": ""}]})
+    assert response.status_code == 400
+    assert load(client, "locked")["content"] == f"a😀 {second} {first} B c"
+
+
+@pytest.fixture
+def upload_app(make_app, backend):
+    return make_app(STORAGE_BACKEND=backend, MAX_PAGE_SIZE=4096)
+
+
+def upload(app_module, page_id, body, **headers):
+    client = app_module.app.test_client()
+    return client.post(f"/{page_id}/save", data=body, headers={"Content-Type": "text/plain; charset=utf-8", **headers})
+
+
+def staged_uploads(app_module):
+    return [name for name in os.listdir(app_module.storage.staging_dir) if name.startswith(".upload.")]
+
+
+def test_raw_save_accepts_a_gzip_body(upload_app):
+    create_page(upload_app, "page", "old")
+    content = "compressed ✓ " * 100
+    response = upload(upload_app, "page", gzip.compress(content.encode("utf-8")), **{"Content-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert load(upload_app.app.test_client(), "page") == {"success": True, "content": content, "revision": response.get_json()["revision"]}
+
+
+@pytest.mark.parametrize("body, headers, status", [
+    (b"x" * 4097, {}, 413),
+    # Small as sent, only too large once decompressed
+    (gzip.compress(b"\0" * 1024 * 1024), {"Content-Encoding": "gzip"}, 413),
+    (gzip.compress(b"cut short")[:-4], {"Content-Encoding": "gzip"}, 400),
+    (b"not gzip", {"Content-Encoding": "gzip"}, 400),
+    (b"\xff invalid UTF-8", {}, 400),
+])
+def test_rejected_raw_saves_leave_the_page_unchanged(upload_app, body, headers, status):
+    create_page(upload_app, "page", "old")
+    response = upload(upload_app, "page", body, **headers)
+    assert response.status_code == status
+    assert response.get_json()["success"] is False
+    assert load(upload_app.app.test_client(), "page")["content"] == "old"
+    assert staged_uploads(upload_app) == []
+
+
+@pytest.fixture
+def file_app(make_app, monkeypatch):
+    module = make_app(STORAGE_BACKEND="file")
+    monkeypatch.setattr(module, "PAGE_APPEND_MIN_SIZE", 4)
+    return module
+
+
+def test_append_save_writes_only_the_appended_text(file_app):
+    client = file_app.app.test_client()
+    create_page(file_app, "log", "first line\n")
+    revision = load(client, "log")["revision"]
+    response = client.post("/log/save", json={"base_revision": revision, "edits": [{"start": 11, "end": 11, "text": "second\n"}]})
+    assert response.status_code == 200
+    assert load(client, "log") == {"success": True, "content": "first line\nsecond\n", "revision": response.get_json()["revision"]}
+    assert os.listdir(file_app.storage.append_dir) == []
+
+
+def test_torn_append_is_cut_off(file_app):
+    storage = file_app.storage
+    create_page(file_app, "torn", "acknowledged")
+    # A crash after the size was recorded and part of the append was written
+    file_app.atomic_write_bytes(os.path.join(storage.append_dir, "torn"), b"12")
+    with open(storage.page_path("torn"), "ab") as f:
+        f.write(b" partial")
+    assert storage.recover_torn_appends() == ["torn"]
+    assert storage.read_page("torn")[0] == b"acknowledged"
+    assert os.listdir(storage.append_dir) == []
+
+
+def test_failed_append_is_truncated(file_app):
+    storage = file_app.storage
+    create_page(file_app, "full", "acknowledged")
+    page_path = storage.page_path("full")
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        if os.path.samestat(os.fstat(fd), os.stat(page_path)):
+            raise OSError(28, "No space left on device")
+        real_fsync(fd)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(os, "fsync", fsync)
+        with pytest.raises(OSError):
+            storage.write_page("full", b"acknowledged more", b" more")
+    assert storage.read_page("full")[0] == b"acknowledged"
@@ -0,0 +1,103 @@
+import base64
+import json
+import os
+import zlib
+
+import pytest
+
+from conftest import create_page
+
+# A token the editor can parse: version byte, 12-byte IV and a ciphertext as long as the tag
+VALID_TOKEN = "ENC<" + base64.urlsafe_b64encode(bytes([2]) + bytes(12) + bytes(16)).decode().rstrip("=") + ">"
+
+
+def corrupt_blob(app_module, digest, data):
+    """Replaces a backup blob's stored content without changing its hash."""
+    storage = app_module.storage
+    if app_module.STORAGE_BACKEND == "sqlite":
+        conn = storage._db.get()
+        with conn:
+            conn.execute("UPDATE blobs SET data = ? WHERE hash = ?", (zlib.compress(data), digest))
+    else:
+        with open(storage.blob_path(digest), "wb") as f:
+            f.write(zlib.compress(data))
+
+
+def scrub_issues(app_module):
+    issues, _ = app_module.page_catalog.scrub_issues()
+    return sorted((issue["page_id"], issue["kind"]) for issue in issues)
+
+
+def test_scrub_finds_corrupt_pages_backups_and_tokens(app_module, admin_client):
+    create_page(app_module, "good", f"fine {VALID_TOKEN}")
+    create_page(app_module, "flipped", "original")
+    create_page(app_module, "badtoken", "broken ENC<eyJub3Q=>")
+    create_page(app_module, "badbackup", "backed up")
+    app_module.create_page_backup("good")
+    entry = app_module.create_page_backup("badbackup")
+
+    # A bit flip keeps the page's size and modification time
+    st = app_module.storage.page_stat("flipped")
+    app_module.storage.import_page("flipped", b"Original", st.st_mtime_ns)
+    corrupt_blob(app_module, entry["hash"], b"backed uq")
+
+    state = app_module.integrity_scrubber.run_once()
+    assert state["finished_at"] is not None
+    assert state["stats"]["pages"] == 4
+    assert state["stats"]["backups"] == 2
+    assert state["stats"]["issues"] == 3
+    assert scrub_issues(app_module) == [
+        ("badbackup", "backup_corrupt"),
+        ("badtoken", "bad_enc_token"),
+        ("flipped", "checksum_mismatch"),
+    ]
+    assert b"checksum_mismatch" in admin_client.get("/admin").data
+
+    # Saving the page again records a new checksum; the next pass drops its issue
+    assert admin_client.post("/flipped/save", json={"content": "repaired"}).status_code == 200
+    app_module.integrity_scrubber.run_once(restart=True)
+    assert ("flipped", "checksum_mismatch") not in scrub_issues(app_module)
+
+
+def test_scrub_resumes_after_an_interruption(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "SCRUB_BATCH_PAGES", 2)
+    page_ids = ["page1", "page2", "page3", "page4", "page5"]
+    for page_id in page_ids:
+        create_page(app_module, page_id, page_id)
+
+    # The process stops while it stores the issues of the second batch
+    catalog = app_module.page_catalog
+    replace_scrub_issues = catalog.replace_scrub_issues
+    batches = []
+
+    def interrupted(batch_page_ids, issues):
+        batches.append(batch_page_ids)
+        if len(batches) == 2:
+            raise KeyboardInterrupt
+        replace_scrub_issues(batch_page_ids, issues)
+
+    monkeypatch.setattr(catalog, "replace_scrub_issues", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        app_module.integrity_scrubber.run_once()
+    with open(app_module.SCRUB_STATE_FILE, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["cursor"] == "page2"
+    assert saved["finished_at"] is None
+
+    monkeypatch.setattr(catalog, "replace_scrub_issues", replace_scrub_issues)
+    state = app_module.integrity_scrubber.run_once()
+    assert state["started_at"] == saved["started_at"]
+    assert state["finished_at"] is not None
+    assert state["stats"]["pages"] == len(page_ids)
+
+    # A finished pass is not resumed: the next one starts over
+    assert app_module.integrity_scrubber.run_once()["stats"]["pages"] == len(page_ids)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs fcntl locks")
+def test_only_one_process_scrubs_at_a_time(app_module):
+    import fcntl
+    with open(app_module.SCRUB_LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert app_module.integrity_scrubber.run_once() is None
+    assert app_module.integrity_scrubber.run_once() is not None
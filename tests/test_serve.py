@@ -0,0 +1,124 @@
+import http.client
+import os
+import socket
+import threading
+
+import pytest
+
+from conftest import create_page
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="serve.py needs a POSIX system")
+
+
+@pytest.fixture
+def server(app_module):
+    """Runs serve.py's server with two request threads on a free port."""
+    import serve
+    server = serve.PooledWSGIServer("127.0.0.1", 0, app_module.app, handler=serve.RequestHandler, threads=2, idle_timeout=5)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join(5)
+    server.server_close()
+
+
+def open_stream(server, page_id):
+    sock = socket.create_connection(server.server_address, timeout=5)
+    sock.sendall(f"GET /{page_id}/events HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+    received = b""
+    while b"retry: 5000\n\n" not in received:
+        chunk = sock.recv(4096)
+        assert chunk, received
+        received += chunk
+    assert received.startswith(b"HTTP/1.1 200")
+    assert b"text/event-stream" in received
+    return sock
+
+
+def read_until(sock, marker):
+    received = b""
+    while marker not in received:
+        chunk = sock.recv(4096)
+        assert chunk, received
+        received += chunk
+    return received
+
+
+def get(server, path):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_load_answers_while_more_streams_than_threads_are_open(app_module, server):
+    create_page(app_module, "busy", "content")
+    streams = [open_stream(server, "busy") for _ in range(4)]
+    # Connections that have not sent their request yet do not hold a thread either
+    idle = [socket.create_connection(server.server_address, timeout=5) for _ in range(4)]
+    try:
+        status, body = get(server, "/busy/load")
+        assert status == 200
+        assert b'"content":"content"' in body
+
+        # Saves are still published to every open stream
+        connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+        connection.request("POST", "/busy/save", body="changed", headers={"Content-Type": "text/plain; charset=utf-8"})
+        assert connection.getresponse().status == 200
+        connection.close()
+        for sock in streams:
+            assert b"event: revision" in read_until(sock, b"event: revision")
+    finally:
+        for sock in streams + idle:
+            sock.close()
+
+
+def test_connections_are_kept_alive_between_requests(app_module, server):
+    create_page(app_module, "page", "content")
+    connections = [http.client.HTTPConnection(*server.server_address, timeout=5) for _ in range(3)]
+    try:
+        for connection in connections:
+            connection.request("GET", "/page/load")
+            response = connection.getresponse()
+            assert response.status == 200 and response.getheader("Connection") is None
+            response.read()
+        # More kept-alive connections than threads wait for their next request, and each serves it
+        for connection in connections:
+            sock = connection.sock
+            connection.request("POST", "/page/save", body="changed", headers={"Content-Type": "text/plain; charset=utf-8"})
+            response = connection.getresponse()
+            assert response.status == 200
+            response.read()
+            connection.request("GET", "/page/load")
+            response = connection.getresponse()
+            assert b'"content":"changed"' in response.read()
+            assert connection.sock is sock
+
+        connection = connections[0]
+        connection.request("GET", "/page/load", headers={"Connection": "close"})
+        response = connection.getresponse()
+        assert response.getheader("Connection") == "close"
+        response.read()
+        assert response.will_close
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def test_event_streams_are_capped_without_hand_off(make_app):
+    app_module = make_app(SSE_THREAD_STREAMS=1)
+    create_page(app_module, "page", "content")
+    client = app_module.app.test_client()
+    first = client.get("/page/events", buffered=False)
+    assert first.status_code == 200
+    response = client.get("/page/events")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "60"
+    first.close()
+    second = client.get("/page/events", buffered=False)
+    assert second.status_code == 200
+    second.close()
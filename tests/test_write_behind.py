@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from conftest import create_page
+
+
+@pytest.fixture
+def coalescing_app(make_app, backend):
+    return make_app(STORAGE_BACKEND=backend, SAVE_COALESCE_SECONDS=60)
+
+
+def save_edits(client, page_id, *texts):
+    """Appends each text to the page with one delta save per text."""
+    for text in texts:
+        loaded = client.get(f"/{page_id}/load").get_json()
+        end = len(loaded["content"].encode("utf-16-le")) // 2
+        response = client.post(f"/{page_id}/save", json={"base_revision": loaded["revision"], "edits": [{"start": end, "end": end, "text": text}]})
+        assert response.status_code == 200, response.get_json()
+    return response.get_json()["revision"]
+
+
+def test_delta_saves_are_coalesced_into_one_write(coalescing_app):
+    storage = coalescing_app.storage
+    client = coalescing_app.app.test_client()
+    create_page(coalescing_app, "busy", "start")
+    revision = save_edits(client, "busy", " one", " two", " three")
+
+    assert client.get("/busy/load").get_json() == {"success": True, "content": "start one two three", "revision": revision}
+    # The page itself is written once the oldest journaled save is due
+    assert storage.inner.read_page("busy")[0] == b"start"
+    assert storage.flush_due() == 0
+    assert storage.flush_due(flush_all=True) == 1
+    assert storage.inner.read_page("busy")[0] == b"start one two three"
+    assert not os.path.exists(storage.journal_path("busy"))
+    assert client.get("/busy/load").get_json()["revision"] == revision
+
+
+def test_journal_is_replayed_after_a_crash(make_app, coalescing_app, backend):
+    create_page(coalescing_app, "page", "start")
+    save_edits(coalescing_app.app.test_client(), "page", " saved")
+    # The process dies while appending another save
+    with open(coalescing_app.storage.journal_path("page"), "ab") as f:
+        f.write(b'{"time":1,"edits":[{"start":0,')
+
+    restarted = make_app(STORAGE_BACKEND=backend, SAVE_COALESCE_SECONDS=60)
+    client = restarted.app.test_client()
+    assert client.get("/page/load").get_json()["content"] == "start saved"
+    assert restarted.storage.flush_due(flush_all=True) == 1
+    assert restarted.storage.inner.read_page("page")[0] == b"start saved"
+
+
+def test_journal_of_a_replaced_page_is_ignored(coalescing_app):
+    storage = coalescing_app.storage
+    create_page(coalescing_app, "page", "start")
+    save_edits(coalescing_app.app.test_client(), "page", " journaled")
+    # E.g. a migration writes the stored page directly
+    storage.inner.write_page("page", b"replaced")
+    storage._forget_pending("page")
+    assert storage.read_page("page")[0] == b"replaced"
+    storage.flush_due(flush_all=True)
+    assert storage.inner.read_page("page")[0] == b"replaced"
+
+
+def test_full_save_supersedes_the_journal(coalescing_app):
+    storage = coalescing_app.storage
+    client = coalescing_app.app.test_client()
+    create_page(coalescing_app, "page", "start")
+    save_edits(client, "page", " journaled")
+    assert client.post("/page/save", json={"content": "full"}).status_code == 200
+    assert not os.path.exists(storage.journal_path("page"))
+    assert storage.inner.read_page("page")[0] == b"full"
+
+
+def test_saves_of_a_page_are_rate_limited(make_app):
+    app_module = make_app(SAVE_RATE_PER_PAGE=0.01, SAVE_BURST_PER_PAGE=2)
+    client = app_module.app.test_client()
+    for page_id in ("limited", "other"):
+        create_page(app_module, page_id)
+    assert client.post("/limited/save", json={"content": "1"}).status_code == 200
+    assert client.post("/limited/save", json={"content": "2"}).status_code == 200
+    response = client.post("/limited/save", json={"content": "3"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
+    assert client.get("/limited/load").get_json()["content"] == "2"
+    # Other pages have their own bucket
+    assert client.post("/other/save", json={"content": "1"}).status_code == 200
+
+
+def test_saves_of_all_pages_are_rate_limited(make_app):
+    app_module = make_app(SAVE_RATE_GLOBAL=0.01, SAVE_BURST_GLOBAL=1)
+    client = app_module.app.test_client()
+    for page_id in ("first", "second"):
+        create_page(app_module, page_id)
+    assert client.post("/first/save", json={"content": "1"}).status_code == 200
+    response = client.post("/second/save", json={"content": "1"})
+    assert response.status_code == 429
+    assert "too many saves" in response.get_json()["message"]
+
+
+def test_catalog_is_updated_once_per_flushed_batch(coalescing_app, monkeypatch):
+    catalog = coalescing_app.page_catalog
+    client = coalescing_app.app.test_client()
+    create_page(coalescing_app, "page", "start")
+    checksum = catalog.page_checksum("page")["checksum"]
+    written = []
+    catalog_page_written = coalescing_app.catalog_page_written
+    monkeypatch.setattr(coalescing_app, "catalog_page_written", lambda *args: written.append(args[0]) or catalog_page_written(*args))
+
+    revision = save_edits(client, "page", " one", " two")
+    assert written == []
+    assert catalog.page_checksum("page")["checksum"] == checksum
+    assert coalescing_app.storage.flush_due(flush_all=True) == 1
+    assert written == ["page"]
+    assert catalog.page_checksum("page")["checksum"] == revision
+
+
+def test_replayed_journal_keeps_the_base_revision(make_app, coalescing_app, backend, monkeypatch):
+    create_page(coalescing_app, "page", "start")
+    revision = save_edits(coalescing_app.app.test_client(), "page", " saved")
+
+    restarted = make_app(STORAGE_BACKEND=backend, SAVE_COALESCE_SECONDS=60)
+    # The journal records both revisions, so replaying it hashes nothing
+    monkeypatch.setattr(restarted, "compute_revision", lambda data: pytest.fail("content was re-hashed"))
+    st = restarted.storage.page_stat("page")
+    assert restarted.page_revisions.cached("page", st) == revision
+    assert restarted.storage.read_page("page")[0] == b"start saved"
+    assert restarted.storage.flush_due(flush_all=True) == 1
+    assert restarted.page_catalog.page_checksum("page")["checksum"] == revision